@@ -0,0 +1,105 @@
+# bench_logging.py
+# Mesure le débit de messages du serveur avec les logs coupés / activés.
+# On utilise la V1 (TCP en clair) pour isoler le coût des logs de celui de TLS.
+#
+# Usage: python bench_logging.py [nb_clients] [messages_par_client] [taille_payload]
+
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import server
+from auth import CredentialStore
+from common import send_json
+from logs import setup_logging, stop_logging
+
+
+def start_server():
+    """Serveur V1 sur un port libre de 127.0.0.1 (même handle_client que server.py)."""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(128)
+
+    def accept_loop():
+        while True:
+            conn, addr = listener.accept()
+            threading.Thread(target=server.handle_client, args=(conn, addr), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def run_client(port, count, payload, results):
+    """Envoie count MSG en flux continu; un thread lit les ACK en parallèle."""
+    with socket.create_connection(("127.0.0.1", port)) as s:
+        sock_file = s.makefile("rb")
+        send_json(s, {"type": "LOGIN", "username": "bench", "password": "bench"})
+        sock_file.readline()
+
+        def reader():
+            for _ in range(count):
+                sock_file.readline()
+
+        t = threading.Thread(target=reader)
+        t.start()
+        msg = {"type": "MSG", "username": "bench", "payload": payload}
+        for _ in range(count):
+            send_json(s, msg)
+        t.join()
+        sock_file.close()
+    results.append(count)
+
+
+def run(port, clients, count, payload):
+    results = []
+    threads = [threading.Thread(target=run_client, args=(port, count, payload, results)) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return sum(results) / elapsed
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    size = int(sys.argv[3]) if len(sys.argv) > 3 else 1024
+    payload = "x" * size
+
+    tmp = tempfile.mkdtemp()
+    server.credentials = CredentialStore(os.path.join(tmp, "users.json"))
+    server.credentials.set_password("bench", "bench")
+
+    port = start_server()
+    log_path = os.path.join(tmp, "bench.log")
+
+    scenarios = [
+        ("logs coupés (INFO)", dict(level="INFO")),
+        ("DEBUG, 1 message sur 100", dict(level="DEBUG", sample_every=100)),
+        ("DEBUG, tous les messages", dict(level="DEBUG")),
+    ]
+
+    print(f"{clients} clients x {count} messages, payload {size} octets")
+
+    # tour de chauffe (non mesuré)
+    setup_logging(level="INFO", stream=open(os.devnull, "w"))
+    run(port, clients, max(count // 10, 1), payload)
+    stop_logging()
+
+    baseline = None
+    for name, options in scenarios:
+        with open(log_path, "w", encoding="utf-8") as stream:
+            setup_logging(stream=stream, **options)
+            rate = run(port, clients, count, payload)
+            stop_logging()
+        baseline = baseline or rate
+        print(f"  {name:<28} {rate:>10.0f} msg/s  ({rate / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
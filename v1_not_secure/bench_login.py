@@ -0,0 +1,100 @@
+# bench_login.py
+# Débit de LOGIN pendant une "tempête de reconnexions": tous les clients se
+# reconnectent en même temps (ex: après un redémarrage du serveur).
+# - 1re vague: cache froid, chaque LOGIN coûte un scrypt (pool borné)
+# - 2e vague: cache chaud, les mêmes identifiants sont validés sans scrypt
+# On utilise la V1 (TCP en clair) pour isoler le coût de l'authentification de celui de TLS.
+#
+# Usage: python bench_login.py [nb_clients] [nb_comptes]
+
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import server
+from auth import CredentialStore
+from common import send_json, recv_json
+from logs import setup_logging
+
+
+def start_server():
+    """Serveur V1 sur un port libre de 127.0.0.1 (même handle_client que server.py)."""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1024)
+
+    def accept_loop():
+        while True:
+            conn, addr = listener.accept()
+            threading.Thread(target=server.handle_client, args=(conn, addr), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def login(port, username, barrier, results):
+    """Attend que tous les clients soient prêts, puis connexion + LOGIN."""
+    barrier.wait()
+    start = time.perf_counter()
+    retries = 0
+    with socket.create_connection(("127.0.0.1", port)) as s:
+        sock_file = s.makefile("r", encoding="utf-8", newline="\n")
+        while True:
+            send_json(s, {"type": "LOGIN", "username": username, "password": "pw-" + username})
+            resp = recv_json(sock_file)
+            if resp is None or resp.get("message") != "server busy, retry later":
+                break
+            # serveur saturé: on réessaie après une courte attente aléatoire
+            retries += 1
+            time.sleep(random.uniform(0.01, 0.05))
+        sock_file.close()
+    results.append((resp.get("message") if resp else "closed", retries, time.perf_counter() - start))
+
+
+def storm(port, clients, accounts):
+    results = []
+    barrier = threading.Barrier(clients)
+    threads = [
+        threading.Thread(target=login, args=(port, f"user{i % accounts}", barrier, results))
+        for i in range(clients)
+    ]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    ok = sum(1 for message, _, _ in results if message and message.startswith("login accepted"))
+    busy = sum(retries for _, retries, _ in results)
+    latencies = sorted(latency for _, _, latency in results)
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return ok, busy, elapsed, p50, p99
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    accounts = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    setup_logging("WARNING")
+    server.credentials = CredentialStore(os.path.join(tempfile.mkdtemp(), "users.json"))
+    for i in range(accounts):
+        server.credentials.set_password(f"user{i}", f"pw-user{i}")
+
+    port = start_server()
+    print(f"{clients} clients simultanés, {accounts} comptes")
+    for name in ("cache froid", "cache chaud"):
+        runs_before = server.credentials.kdf_runs
+        ok, busy, elapsed, p50, p99 = storm(port, clients, accounts)
+        print(f"  {name:<12} {ok / elapsed:>8.0f} LOGIN/s  ok={ok} réponses busy={busy}  "
+              f"p50={p50 * 1000:.1f} ms  p99={p99 * 1000:.1f} ms  "
+              f"scrypt={server.credentials.kdf_runs - runs_before}")
+
+
+if __name__ == "__main__":
+    main()
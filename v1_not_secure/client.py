@@ -7,6 +7,7 @@ import socket   # pour créer la connexion TCP
 import time     # pour les temporisations / timestamps
 import secrets  # pour créer un nonce unique
 import os       # pour les opérations sur les fichiers
+import getpass  # pour saisir le mot de passe sans l'afficher
 from common import send_json, recv_json  # import des fonctions communes
 
 
@@ -66,6 +67,9 @@ def main():
     else:
         username = username_input
 
+    # Mot de passe (vérifié par le serveur, compte créé avec: python auth.py add <nom>)
+    password = getpass.getpass("Mot de passe : ")
+
     # Fichier à envoyer (optionnel)
     file_path = input("Chemin du fichier à envoyer (ou vide pour ne pas envoyer de fichier) : ").strip()
     if file_path == "":
@@ -88,16 +92,19 @@ def main():
         login = {
             "type": "LOGIN",
             "username": username,
-            "password": "password123",  # toujours en clair en V1
+            "password": password,  # toujours en clair en V1
             "timestamp": time.time(),
             "nonce": secrets.token_hex(8)
         }
-        print("[>] Envoi LOGIN :", login)
+        print("[>] Envoi LOGIN :", {**login, "password": "***"})
         send_json(s, login)
 
         # Réception réponse LOGIN (via sock_file, pas via la socket)
         resp = recv_json(sock_file)
         print("[<] Réponse LOGIN :", resp, "\n")
+        if resp is None or resp.get("type") != "OK":
+            print("[!] LOGIN refusé, arrêt.")
+            return
 
         # ----------- MSG -----------
         messages = [
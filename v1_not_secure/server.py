@@ -1,18 +1,147 @@
 # server.py
 # Ce fichier crée un serveur TCP qui écoute les connexions entrantes
 # et gère les messages reçus. Il répond selon le type de message reçu
-# (LOGIN, MSG, FILE, PING).
+# (LOGIN, MSG, FILE, FILE_LIST, FILE_GET, PING).
 
 import socket      # module socket pour la communication réseau
 import threading   # threading pour gérer plusieurs clients en parallèle
 import time        # time pour fournir un timestamp côté serveur
-from common import send_json, recv_json  # fonctions communes d'envoi/réception JSON
+from common import send_json, recv_json_sized  # fonctions communes d'envoi/réception JSON
+from logs import logger, setup_logging, summarize, SAMPLED  # journalisation non bloquante
+from auth import CredentialStore  # vérification des mots de passe (scrypt)
+from capture import TrafficRecorder  # enregistrement du trafic (rejoué par traffic.py)
+from dispatch import Connection, Dispatcher, optional  # table type -> handler + validation des champs
+from filestore import frames, list_files, open_stored, resolve_range, safe_filename, send_range, store_file
 
 
 HOST = "0.0.0.0"   # adresse loopback (serveur local sur la même machine) pour le second test on utilisera 0.0.0.0 
 #pour écouter sur toutes les interfaces
 PORT = 5000          # port d'écoute (port applicatif non privilégié)
 
+RECEIVE_DIR = "."    # dossier des fichiers reçus (receive_<nom>)
+
+# Niveau de log: "DEBUG" pour afficher chaque message reçu (payload tronqué)
+LOG_LEVEL = "INFO"
+
+# Enregistrement du trafic reçu, pour le rejouer avec traffic.py (voir capture.py):
+# chemin du fichier gzip (ex: "capture.jsonl.gz"), None = désactivé
+CAPTURE_FILE = None
+recorder = None
+
+# Base des utilisateurs (créée avec: python auth.py add <utilisateur>)
+USERS_FILE = "users.json"
+MAX_LOGIN_ATTEMPTS = 3   # échecs de LOGIN avant déconnexion
+
+credentials = CredentialStore(USERS_FILE)
+
+
+# Table type -> handler (voir dispatch.py): un accès au dictionnaire par
+# message, et les champs sont vérifiés avant d'appeler le handler
+dispatcher = Dispatcher(send_json)
+
+
+@dispatcher.register("LOGIN", {"username": str, "password": str}, public=True)
+def handle_login(session, msg):
+    # Vérification du mot de passe (hash scrypt, calculé hors de ce thread).
+    # En V1 il circule toujours en clair sur le réseau!
+    result = credentials.verify(msg["username"], msg["password"])
+    if result == "ok":
+        session.username = msg["username"]
+        send_json(session.conn, {
+            "type": "OK",
+            "message": "login accepted (v1 insecure)",
+            "server_time": time.time()
+        })
+        return False
+
+    # "busy" (pool scrypt saturé) n'est pas un échec: le client peut réessayer
+    session.failures += result == "invalid"
+    dispatcher.error(session, "server busy, retry later" if result == "busy" else "invalid credentials")
+    if session.failures >= MAX_LOGIN_ATTEMPTS:
+        logger.warning("[!] Trop d'échecs de LOGIN, déconnexion: %s", session.addr)
+        return True
+    return False
+
+
+@dispatcher.register("MSG", {"payload": optional(str, "")})
+def handle_msg(session, msg):
+    # Message classique: on renvoie un accusé de réception
+    send_json(session.conn, {
+        "type": "ACK",
+        "echo": msg["payload"],
+        "server_time": time.time()
+    })
+    return False
+
+
+@dispatcher.register("FILE", {"filename": optional(str, "received.txt"), "payload": optional(str, "")})
+def handle_file(session, msg):
+    # Réception d'un fichier (en V1, le contenu est envoyé en clair dans payload)
+    filename = msg["filename"]
+    data = msg["payload"]
+
+    # nom simple uniquement: "../x" ne doit pas sortir du dossier de stockage
+    if safe_filename(filename) is None:
+        dispatcher.error(session, f"invalid filename: {filename}")
+        return False
+
+    logger.info("[FILE] Reçu fichier %s de %s, taille: %s octets", filename, session.addr, len(data))
+
+    # Reconstruction du fichier côté serveur (écriture atomique, texte UTF-8)
+    store_file(RECEIVE_DIR, filename, data)
+
+    # Accusé de réception spécifique au fichier
+    send_json(session.conn, {
+        "type": "ACK_FILE",
+        "filename": filename,
+        "size": len(data),
+        "server_time": time.time()
+    })
+    return False
+
+
+@dispatcher.register("FILE_LIST")
+def handle_file_list(session, msg):
+    # fichiers stockés par FILE, récupérables par FILE_GET
+    send_json(session.conn, {
+        "type": "FILE_LIST",
+        "files": list_files(RECEIVE_DIR),
+        "server_time": time.time()
+    })
+    return False
+
+
+@dispatcher.register("FILE_GET", {"filename": str, "offset": optional(int, 0), "length": optional(int)})
+def handle_file_get(session, msg):
+    # téléchargement (éventuellement partiel: offset / length): un en-tête FILE_DATA
+    # puis les octets bruts. TCP sans TLS: une seule trame envoyée par sendfile,
+    # le noyau copie directement du fichier vers la socket (zéro copie)
+    f, size = open_stored(RECEIVE_DIR, msg["filename"])
+    if f is None:
+        dispatcher.error(session, f"no such file: {msg['filename']}")
+        return False
+    with f:
+        requested = resolve_range(size, msg["offset"], msg["length"])
+        if requested is None:
+            dispatcher.error(session, f"invalid range for: {msg['filename']} ({size} bytes)")
+            return False
+        for header, offset, length in frames(msg["filename"], size, *requested, chunk=None):
+            session.conn.sendall(header)
+            send_range(session.conn, f, offset, length)
+    logger.info("[FILE] %s envoyé à %s (%s octets à partir de %s)", msg["filename"], session.addr,
+                requested[1], requested[0])
+    return False
+
+
+@dispatcher.register("PING", public=True)
+def handle_ping(session, msg):
+    # Ping/Pong pour test de connectivité
+    send_json(session.conn, {
+        "type": "PONG",
+        "server_time": time.time()
+    })
+    return False
+
 
 def handle_client(conn, addr):
     """
@@ -20,98 +149,66 @@ def handle_client(conn, addr):
     conn : socket de connexion côté serveur
     addr : adresse (IP, port) du client
     """
-    print(f"[+] Client connecté: {addr}")
+    logger.info("[+] Client connecté: %s", addr)
 
     # IMPORTANT (nouvelle version):
     # On crée UNE FOIS un flux de lecture "file-like" à partir de la socket.
     # Cela permet d'utiliser readline() et de lire exactement 1 message (1 ligne) à la fois.
-    sock_file = conn.makefile("r", encoding="utf-8", newline="\n")
+    # Mode binaire: pas de couche de décodage texte (json.loads lit l'UTF-8 directement).
+    # Tout l'état de la connexion est dans session (utilisateur None tant que LOGIN n'a pas réussi)
+    session = Connection(conn, addr, conn.makefile("rb"))
 
     try:
         # Boucle infinie: on traite les messages tant que le client reste connecté
         while True:
-            # recv_json attend un sock_file (pas conn) dans la nouvelle version
-            msg = recv_json(sock_file)
+            # recv_json_sized attend un sock_file (pas conn) dans la nouvelle version
+            msg, size = recv_json_sized(session.file)
 
             # Si msg est None, cela signifie que le client a fermé la connexion
             if msg is None:
-                print(f"[-] Client déconnecté: {addr}")
+                logger.info("[-] Client déconnecté: %s", addr)
                 break
+            session.messages += 1
+            session.bytes_in += size
 
             # Log de ce qu'on reçoit (utile pour démo et rapport)
-            print(f"[{addr}] RECU: {msg}")
-
-            # Dans notre protocole JSON, le champ "type" indique l'action demandée
-            mtype = msg.get("type")
-
-            # Selon le type, le serveur répond différemment
-            if mtype == "LOGIN":
-                # V1 non sécurisé: pas de vraie vérification du mot de passe
-                send_json(conn, {
-                    "type": "OK",
-                    "message": "login accepted (v1 insecure)",
-                    "server_time": time.time()
-                })
-
-            elif mtype == "MSG":
-                # Message classique: on renvoie un accusé de réception
-                send_json(conn, {
-                    "type": "ACK",
-                    "echo": msg.get("payload", ""),
-                    "server_time": time.time()
-                })
-
-            elif mtype == "FILE":
-                # Réception d'un fichier (en V1, le contenu est envoyé en clair dans payload)
-                filename = msg.get("filename", "received.txt")
-                data = msg.get("payload", "")
-
-                print(f"[FILE] Reçu fichier {filename} de {addr}, taille: {len(data)} octets")
-
-                # Reconstruction du fichier côté serveur
-                # Ici, on écrit en texte UTF-8 car payload est une chaîne
-                with open(f"receive_{filename}", "w", encoding="utf-8") as f:
-                    f.write(data)
-
-                # Accusé de réception spécifique au fichier
-                send_json(conn, {
-                    "type": "ACK_FILE",
-                    "filename": filename,
-                    "size": len(data),
-                    "server_time": time.time()
-                })
-
-            elif mtype == "PING":
-                # Ping/Pong pour test de connectivité
-                send_json(conn, {
-                    "type": "PONG",
-                    "server_time": time.time()
-                })
-
-            else:
-                # Type inconnu: on renvoie une erreur
-                send_json(conn, {
-                    "type": "ERR",
-                    "message": "unknown type",
-                    "server_time": time.time()
-                })
+            logger.debug("[%s] RECU: %s", addr, summarize(msg), extra=SAMPLED)
+            if recorder is not None:
+                recorder.record(session, msg)
+
+            # Le champ "type" choisit le handler; tant que LOGIN n'a pas réussi,
+            # seuls LOGIN / PING sont acceptés. True = fermer la connexion
+            if dispatcher.dispatch(session, msg):
+                break
 
     except Exception as e:
         # On capture et affiche l'erreur pour debug (très utile en réseau)
-        print(f"[!] Erreur avec {addr}: {e}")
+        logger.warning("[!] Erreur avec %s: %s", addr, e)
 
     finally:
         # On ferme proprement le flux puis la socket
         try:
-            sock_file.close()
+            session.file.close()
         except Exception:
             pass
 
         conn.close()
-        print(f"[+] Connexion fermée: {addr}")
+        if recorder is not None:
+            recorder.closed(session)
+        logger.info("[+] Connexion fermée: %s (%s)", addr, session.stats())
 
 
 def main():
+    global recorder
+
+    # Logs écrits par un thread dédié (jamais de print() sur le chemin chaud)
+    setup_logging(LOG_LEVEL)
+
+    # Capture du trafic (fermée proprement à la sortie, voir capture.py)
+    if CAPTURE_FILE:
+        recorder = TrafficRecorder(CAPTURE_FILE, server="v1")
+        logger.info("[*] Capture du trafic dans %s", CAPTURE_FILE)
+
     # Création d'un socket IPv4 TCP:
     # AF_INET => IPv4, SOCK_STREAM => TCP
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -126,12 +223,15 @@ def main():
         # Le serveur commence à écouter
         # 5 = taille de la file d'attente des connexions en attente
         s.listen(5)
-        print(f"[*] Serveur en écoute sur {HOST}:{PORT}")
+        logger.info("[*] Serveur en écoute sur %s:%s", HOST, PORT)
+        if not credentials.has_users():
+            logger.warning("[!] Aucun utilisateur dans %s: tous les LOGIN seront refusés "
+                           "(créer un compte avec: python auth.py add <nom>)", USERS_FILE)
 
         # Boucle infinie: accepte de nouveaux clients
         while True:
             conn, addr = s.accept()
-            print(f"[+] Nouvelle connexion de {addr}")
+            logger.debug("[+] Nouvelle connexion de %s", addr)
 
             # Thread par client: permet de gérer plusieurs connexions simultanément
             client_thread = threading.Thread(
@@ -0,0 +1,200 @@
+# auth.py
+# Vérification des identifiants (LOGIN).
+#
+# - base d'utilisateurs dans un fichier JSON: nom -> sel + hash scrypt
+# - le calcul scrypt (volontairement coûteux) tourne dans un petit pool de
+#   threads borné: au-delà de HASH_QUEUE_MAX vérifications en cours, le
+#   serveur répond "busy" au lieu de saturer le CPU
+# - cache des identifiants déjà vérifiés (clé = HMAC avec un secret du
+#   processus, jamais le mot de passe en clair): une vague de reconnexions
+#   ne refait pas un scrypt par client, et des LOGIN simultanés avec les mêmes
+#   identifiants partagent un seul calcul
+# - utilisateur inconnu: on calcule quand même un scrypt (coût constant,
+#   pas de fuite d'information sur l'existence du compte par le temps de réponse)
+#
+# Ajouter un utilisateur:  python auth.py add alice
+# Supprimer:               python auth.py del alice
+
+import collections
+import getpass
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+USERS_FILE = "users.json"
+
+# Paramètres scrypt: ~16 Mo de mémoire et quelques dizaines de ms par calcul
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+HASH_WORKERS = 2       # calculs scrypt en parallèle
+HASH_QUEUE_MAX = 64    # vérifications en cours max (au-delà: "busy")
+CACHE_TTL = 600        # secondes de validité d'un identifiant vérifié
+CACHE_MAX = 10000      # entrées max du cache (LRU)
+
+
+def hash_password(password, salt=None, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+    """Retourne l'enregistrement stocké pour un mot de passe (sel + hash scrypt)."""
+    salt = salt or secrets.token_bytes(16)
+    digest = hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p, maxmem=64 * 1024 * 1024)
+    return {"salt": salt.hex(), "hash": digest.hex(), "n": n, "r": r, "p": p}
+
+
+def _check(record, password):
+    digest = hashlib.scrypt(
+        password.encode("utf-8"),
+        salt=bytes.fromhex(record["salt"]),
+        n=record["n"], r=record["r"], p=record["p"],
+        maxmem=64 * 1024 * 1024
+    )
+    return hmac.compare_digest(digest.hex(), record["hash"])
+
+
+class CredentialStore:
+    def __init__(self, path=USERS_FILE, workers=HASH_WORKERS, queue_max=HASH_QUEUE_MAX,
+                 cache_ttl=CACHE_TTL, cache_max=CACHE_MAX):
+        self.path = path
+        self.cache_ttl = cache_ttl
+        self.cache_max = cache_max
+
+        self._users = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+        # pool de calcul scrypt (hors threads réseau) + nombre de vérifications en cours borné
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="kdf")
+        self._slots = threading.BoundedSemaphore(queue_max)
+
+        # cache LRU: HMAC(secret, nom + mot de passe) -> (expiration, hash stocké)
+        self._secret = secrets.token_bytes(32)
+        self._cache = collections.OrderedDict()
+        # calculs en cours: clé -> Future (partagé par les LOGIN identiques simultanés)
+        self._running = {}
+        # enregistrement factice pour les utilisateurs inconnus (coût constant)
+        self._dummy = hash_password(secrets.token_hex(8))
+
+        self.cache_hits = 0
+        self.kdf_runs = 0
+        self.in_flight = 0
+
+    # -----------------------------------------------------------------
+    # Fichier des utilisateurs (relu automatiquement s'il change)
+    # -----------------------------------------------------------------
+    def _load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            self._users, self._mtime = {}, None
+            return
+        if mtime != self._mtime:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._users = json.load(f)
+            self._mtime = mtime
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._users, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def set_password(self, username, password):
+        with self._lock:
+            self._load()
+            self._users[username] = hash_password(password)
+            self._save()
+
+    def delete_user(self, username):
+        with self._lock:
+            self._load()
+            removed = self._users.pop(username, None) is not None
+            self._save()
+            return removed
+
+    def has_users(self):
+        with self._lock:
+            self._load()
+            return bool(self._users)
+
+    # -----------------------------------------------------------------
+    # Vérification
+    # -----------------------------------------------------------------
+    def verify(self, username, password):
+        """Retourne "ok", "invalid" ou "busy" (trop de vérifications en cours)."""
+        if not isinstance(username, str) or not isinstance(password, str):
+            return "invalid"
+
+        with self._lock:
+            self._load()
+            record = self._users.get(username)
+
+        key = hmac.new(self._secret, f"{username}\0{password}".encode("utf-8"), hashlib.sha256).digest()
+        with self._lock:
+            if record is not None:
+                entry = self._cache.get(key)
+                # l'entrée n'est valable que pour le hash actuel (changement de mot de passe)
+                if entry is not None and entry[0] > time.monotonic() and entry[1] == record["hash"]:
+                    self._cache.move_to_end(key)
+                    self.cache_hits += 1
+                    return "ok"
+
+            # même vérification déjà en cours: on attend son résultat
+            future = self._running.get(key)
+            owner = future is None
+            if owner:
+                if not self._slots.acquire(blocking=False):
+                    return "busy"
+                self.kdf_runs += 1
+                self.in_flight += 1
+                future = self._pool.submit(_check, record or self._dummy, password)
+                self._running[key] = future
+
+        try:
+            ok = future.result()
+        finally:
+            if owner:
+                with self._lock:
+                    self._running.pop(key, None)
+                    self.in_flight -= 1
+                self._slots.release()
+
+        if not ok or record is None:
+            return "invalid"
+
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.cache_ttl, record["hash"])
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_max:
+                self._cache.popitem(last=False)
+        return "ok"
+
+
+def main():
+    if len(sys.argv) != 3 or sys.argv[1] not in ("add", "del"):
+        print("Usage: python auth.py add|del <utilisateur>")
+        sys.exit(1)
+
+    store = CredentialStore(USERS_FILE)
+    action, username = sys.argv[1], sys.argv[2]
+    if action == "add":
+        password = getpass.getpass(f"Mot de passe pour {username} : ")
+        if password != getpass.getpass("Confirmation : "):
+            print("[!] Les mots de passe ne correspondent pas")
+            sys.exit(1)
+        store.set_password(username, password)
+        print(f"[*] Utilisateur {username} enregistré dans {USERS_FILE}")
+    else:
+        if store.delete_user(username):
+            print(f"[*] Utilisateur {username} supprimé")
+        else:
+            print(f"[!] Utilisateur {username} inconnu")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# certauth.py
+# Authentification des clients par certificat (TLS mutuel, optionnel).
+#
+# Le serveur demande un certificat client signé par la même CA que le sien.
+# Le CN (commonName) du certificat devient le nom d'utilisateur: le client est
+# authentifié dès la fin du handshake, sans LOGIN par mot de passe (un aller-
+# retour et un calcul scrypt de moins par connexion).
+#
+# L'identité extraite est gardée en cache (clé = empreinte SHA-256 du certificat):
+# une reconnexion (session TLS reprise, même certificat) ne refait pas l'analyse.
+#
+# Créer un certificat client pour "alice" (dans certs/):
+#   openssl req -new -newkey rsa:2048 -nodes -keyout alice.key -out alice.csr -subj "/CN=alice"
+#   openssl x509 -req -in alice.csr -CA rootCA.crt -CAkey rootCA.key -CAcreateserial \
+#       -out alice.crt -days 365 -sha256
+
+import collections
+import hashlib
+import ssl
+import threading
+
+CLIENT_CA = "../certs/rootCA.crt"
+IDENTITY_CACHE_MAX = 10000   # certificats gardés en cache (LRU)
+
+# mode -> verify_mode du contexte serveur
+CERT_MODES = {
+    "off": ssl.CERT_NONE,           # mot de passe uniquement (comportement d'origine)
+    "optional": ssl.CERT_OPTIONAL,  # certificat accepté s'il est présenté, sinon LOGIN
+    "required": ssl.CERT_REQUIRED,  # handshake refusé sans certificat valide
+}
+
+
+def configure_client_certs(context, mode, cafile=CLIENT_CA):
+    """Active la vérification des certificats clients sur un contexte serveur."""
+    context.verify_mode = CERT_MODES[mode]
+    if mode != "off":
+        context.load_verify_locations(cafile=cafile)
+
+
+def _common_name(cert):
+    """CN du sujet d'un certificat (format de getpeercert()), ou None."""
+    for rdn in cert.get("subject", ()):
+        for key, value in rdn:
+            if key == "commonName":
+                return value
+    return None
+
+
+class CertIdentityCache:
+    def __init__(self, max_entries=IDENTITY_CACHE_MAX):
+        self.max_entries = max_entries
+        # empreinte du certificat -> nom d'utilisateur
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def identity(self, conn):
+        """Nom d'utilisateur du certificat présenté sur conn, ou None (pas de certificat)."""
+        der = conn.getpeercert(binary_form=True)
+        if not der:
+            return None
+
+        key = hashlib.sha256(der).digest()
+        with self._lock:
+            name = self._cache.get(key)
+            if name is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return name
+
+        # certificat déjà vérifié par OpenSSL pendant le handshake: on lit juste le sujet
+        name = _common_name(conn.getpeercert())
+        if not name:
+            return None
+
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = name
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return name
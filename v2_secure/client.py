@@ -8,6 +8,8 @@ import socket       # Module réseau TCP
 import time         # Pour les timestamps
 import secrets      # Pour générer des nonces uniques
 import os           # Pour la gestion des fichiers
+import hashlib      # Somme SHA-256 du fichier envoyé
+import getpass      # Saisie du mot de passe sans affichage
 from common import send_json, recv_json  # Fonctions communes (inchangées)
 
 
@@ -20,6 +22,16 @@ context = ssl.create_default_context(
     cafile="../certs/rootCA.crt"  # Chemin vers le certificat de la Root CA
 )
 
+# Certificat client (optionnel, serveur avec CLIENT_CERT_MODE != "off"):
+# le serveur nous identifie par le CN du certificat, pas de mot de passe à saisir.
+CLIENT_CERT = None   # ex: "../certs/alice.crt"
+CLIENT_KEY = None    # ex: "../certs/alice.key"
+if CLIENT_CERT:
+    context.load_cert_chain(certfile=CLIENT_CERT, keyfile=CLIENT_KEY)
+
+
+FILE_READ_CHUNK = 64 * 1024   # caractères lus (et hachés) à la fois
+
 
 def send_file(sock, sock_file, path, username):
     """
@@ -27,9 +39,15 @@ def send_file(sock, sock_file, path, username):
     Le fichier est lu en clair (chiffrement assuré par TLS).
     """
 
-    # Lecture du fichier à envoyer
+    # Lecture du fichier à envoyer, par morceaux: la somme SHA-256 des octets
+    # UTF-8 est calculée au fil de la lecture (le serveur la vérifie)
+    digest = hashlib.sha256()
+    parts = []
     with open(path, "r", encoding="utf-8") as f:
-        content = f.read()
+        for part in iter(lambda: f.read(FILE_READ_CHUNK), ""):
+            digest.update(part.encode("utf-8"))
+            parts.append(part)
+    content = "".join(parts)
 
     # Construction du message FILE
     msg = {
@@ -37,6 +55,7 @@ def send_file(sock, sock_file, path, username):
         "username": username,
         "filename": os.path.basename(path),
         "payload": content,
+        "sha256": digest.hexdigest(),
         "timestamp": time.time(),
         "nonce": secrets.token_hex(8)
     }
@@ -57,6 +76,7 @@ def main():
     host = input("Adresse IP du serveur [127.0.0.1] : ").strip() or "127.0.0.1"
     port = int(input("Port du serveur [5000] : ").strip() or 5000)
     username = input("Nom d'utilisateur [alice] : ").strip() or "alice"
+    password = None if CLIENT_CERT else getpass.getpass("Mot de passe : ")
 
     file_path = input(
         "Chemin du fichier à envoyer (ou vide pour ne pas envoyer de fichier) : "
@@ -92,19 +112,26 @@ def main():
     # ----------------------------------------------------------------
     # LOGIN
     # ----------------------------------------------------------------
-    login = {
-        "type": "LOGIN",
-        "username": username,
-        "password": "password123",  # toujours en clair côté applicatif
-        "timestamp": time.time(),
-        "nonce": secrets.token_hex(8)
-    }
+    # Avec un certificat client, le serveur envoie OK dès la connexion (pas de LOGIN)
+    if not CLIENT_CERT:
+        login = {
+            "type": "LOGIN",
+            "username": username,
+            "password": password,  # en clair côté applicatif, chiffré par TLS
+            "timestamp": time.time(),
+            "nonce": secrets.token_hex(8)
+        }
 
-    print("[>] Envoi LOGIN :", login)
-    send_json(tls_sock, login)
+        print("[>] Envoi LOGIN :", {**login, "password": "***"})
+        send_json(tls_sock, login)
 
     resp = recv_json(sock_file)
     print("[<] Réponse LOGIN :", resp, "\n")
+    if resp is None or resp.get("type") != "OK":
+        print("[!] LOGIN refusé, arrêt.")
+        sock_file.close()
+        tls_sock.close()
+        return
 
     # ----------------------------------------------------------------
     # MSG
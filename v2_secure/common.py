@@ -5,10 +5,9 @@
 import json
 
 
-def send_json(sock, data):
+def encode_json(data):
     """
-    Envoie un dictionnaire Python sous forme JSON,
-    suivi d'un caractère de fin de ligne (\n).
+    Encode un dictionnaire en une ligne JSON UTF-8 (bytes terminés par \n).
     """
 
     # data est un dictionnaire Python
@@ -16,8 +15,17 @@ def send_json(sock, data):
     message = json.dumps(data) + "\n"
 
     # La chaîne JSON est encodée en UTF-8
+    return message.encode("utf-8")
+
+
+def send_json(sock, data):
+    """
+    Envoie un dictionnaire Python sous forme JSON,
+    suivi d'un caractère de fin de ligne (\n).
+    """
+
     # sendall() garantit que toutes les données sont envoyées via la socket
-    sock.sendall(message.encode("utf-8"))
+    sock.sendall(encode_json(data))
 
 
 def recv_json(sock_file):
@@ -40,3 +48,16 @@ def recv_json(sock_file):
     # en dictionnaire Python
     return json.loads(line)
 
+
+def recv_json_sized(sock_file):
+    """
+    Comme recv_json(), mais retourne (message, taille de la ligne reçue).
+    Avec un flux binaire (makefile("rb")), la taille est en octets.
+    Retourne (None, 0) si la connexion est fermée.
+    """
+    line = sock_file.readline()
+    if not line:
+        return None, 0
+
+    # json.loads() accepte directement des bytes UTF-8
+    return json.loads(line), len(line)
@@ -0,0 +1,61 @@
+# config.py
+# Fichier de configuration du serveur (JSON), relu au démarrage et à chaud.
+#
+# Les clés sont les noms des constantes du serveur, en minuscules. Exemple:
+#   {
+#       "port": 5000,
+#       "cert_file": "../certs/server.crt",
+#       "key_file": "../certs/server.key",
+#       "receive_dir": "received_files",
+#       "log_level": "INFO"
+#   }
+# Les clés absentes gardent leur valeur actuelle. Fichier absent = aucune modification.
+# Le type attendu est celui de la valeur actuelle; pour les constantes qui
+# valent None par défaut, il est donné par le serveur (types de load_config).
+
+import json
+import os
+
+CONFIG_FILE = "server.json"
+
+
+def _same_type(value, current):
+    if current is None:
+        return True
+    if isinstance(current, bool) or isinstance(value, bool):
+        return type(value) is type(current)
+    if isinstance(current, (int, float)):
+        return isinstance(value, (int, float))
+    return type(value) is type(current)
+
+
+def load_config(path, current, types=None):
+    """
+    Lit le fichier de configuration.
+    current: {NOM: valeur actuelle} des constantes modifiables (sert aussi à vérifier les types).
+    types: {NOM: type attendu} des constantes qui valent None par défaut (None reste accepté).
+    Retourne {NOM: nouvelle valeur}; lève ValueError si le fichier est invalide.
+    """
+    types = types or {}
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)   # JSONDecodeError est une ValueError
+    if not isinstance(data, dict):
+        raise ValueError(f"{path}: un objet JSON est attendu")
+
+    values = {}
+    for key, value in data.items():
+        name = key.upper()
+        if name not in current:
+            raise ValueError(f"{path}: clé inconnue '{key}'")
+        expected = types.get(name)
+        if expected is not None:
+            valid = value is None or isinstance(value, expected)
+        else:
+            valid = _same_type(value, current[name])
+        if not valid:
+            raise ValueError(f"{path}: type invalide pour '{key}'")
+        values[name] = value
+    return values
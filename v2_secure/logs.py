@@ -0,0 +1,149 @@
+# logs.py
+# Journalisation du serveur (remplace les print() sur le chemin chaud).
+# - niveaux (DEBUG pour voir chaque message reçu, INFO par défaut)
+# - échantillonnage des logs "par message" (1 sur N)
+# - troncature des payloads et masquage du mot de passe
+# - écriture dans un thread dédié via une file bornée: un thread réseau
+#   ne bloque jamais sur stdout, au pire la ligne est abandonnée (et comptée)
+
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+LOG_QUEUE_SIZE = 10000   # lignes en attente max avant abandon
+PAYLOAD_MAX = 80         # caractères gardés pour les champs texte longs
+
+# À passer en extra= sur les logs par message (soumis à l'échantillonnage)
+SAMPLED = {"sampled": True}
+
+logger = logging.getLogger("chat")
+
+_queue_handler = None
+_listener = None
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler qui n'attend jamais: si la file est pleine, la ligne est perdue."""
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Le formatage (coûteux) est fait par le thread d'écriture, pas ici
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class Sampler(logging.Filter):
+    """Ne garde qu'un enregistrement marqué 'sampled' sur every."""
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = every
+        self._n = itertools.count()
+
+    def filter(self, record):
+        if self.every <= 1 or not getattr(record, "sampled", False):
+            return True
+        return next(self._n) % self.every == 0
+
+
+class JsonFormatter(logging.Formatter):
+    """Une ligne JSON par log (pour les outils d'analyse)."""
+
+    def format(self, record):
+        return json.dumps({
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }, ensure_ascii=False)
+
+
+class MsgSummary:
+    """
+    Résumé d'un message JSON pour les logs, calculé seulement si la ligne
+    est réellement écrite (donc jamais quand le niveau DEBUG est coupé).
+    """
+
+    __slots__ = ("msg",)
+
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        if not isinstance(self.msg, dict):
+            return truncate(str(self.msg))
+        out = {}
+        for key, value in self.msg.items():
+            if key == "password":
+                value = "***"
+            elif isinstance(value, str):
+                value = truncate(value)
+            out[key] = value
+        return str(out)
+
+
+def truncate(text, limit=PAYLOAD_MAX):
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}...(+{len(text) - limit} car.)"
+
+
+def summarize(msg):
+    return MsgSummary(msg)
+
+
+def setup_logging(level="INFO", stream=None, sample_every=1, json_format=False):
+    """
+    Configure le logger "chat": QueueHandler (threads réseau) -> file bornée
+    -> QueueListener (thread d'écriture) -> stream (stdout par défaut).
+    """
+    global _queue_handler, _listener
+
+    if _listener is not None:
+        _listener.stop()
+
+    handler = logging.StreamHandler(stream or sys.stdout)
+    if json_format:
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)-5s [%(threadName)s] %(message)s"))
+
+    q = queue.Queue(LOG_QUEUE_SIZE)
+    _queue_handler = DroppingQueueHandler(q)
+    _queue_handler.addFilter(Sampler(sample_every))
+
+    _listener = logging.handlers.QueueListener(q, handler)
+    _listener.start()
+
+    logger.handlers[:] = [_queue_handler]
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger
+
+
+def stop_logging():
+    """Vide la file et arrête le thread d'écriture."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def dropped():
+    """Nombre de lignes abandonnées parce que la file était pleine."""
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+atexit.register(stop_logging)
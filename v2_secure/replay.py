@@ -0,0 +1,96 @@
+# replay.py
+# Protection contre le rejeu (LOGIN / MSG / FILE).
+#
+# Chaque message porte un "timestamp" (horloge du client) et un "nonce" aléatoire.
+# Le serveur refuse:
+# - un timestamp trop éloigné de son horloge (> REPLAY_WINDOW s, dans les deux sens)
+# - un nonce déjà vu pendant cette fenêtre
+#
+# Les nonces sont rangés par tranche de temps (BUCKET_WIDTH s, selon le timestamp
+# du message). Un rejeu porte le même timestamp: on ne consulte qu'un seul set,
+# O(1). Quand une tranche sort de la fenêtre, elle est supprimée d'un bloc (pas
+# d'expiration entrée par entrée). La mémoire reste donc proportionnelle au
+# débit x fenêtre, avec en plus un plafond dur (MAX_NONCES).
+#
+# Messages acceptés avant authentification (LOGIN, PEER): le serveur fait
+# seulement precheck() (format, fenêtre) avant de vérifier les identifiants,
+# et check() après: un pair inconnu ne peut pas remplir le cache (ce qui
+# ferait refuser "full" les messages de tous les autres).
+
+import threading
+import time
+
+REPLAY_WINDOW = 30     # écart max (s) entre timestamp client et horloge serveur
+BUCKET_WIDTH = 5       # largeur (s) d'une tranche de nonces
+MAX_NONCES = 1000000   # nonces gardés au maximum, ~100 o chacun (au-delà: "full")
+NONCE_MAX_LEN = 64     # longueur max d'un nonce accepté
+
+
+class NonceCache:
+    def __init__(self, window=REPLAY_WINDOW, bucket_width=BUCKET_WIDTH, max_nonces=MAX_NONCES):
+        self.window = window
+        self.bucket_width = bucket_width
+        self.max_nonces = max_nonces
+
+        # numéro de tranche -> set des nonces dont le timestamp tombe dans cette tranche
+        self._buckets = {}
+        self._size = 0
+        self._oldest = None   # plus petit numéro de tranche encore gardé
+        self._lock = threading.Lock()
+
+        self.rejected = 0
+
+    def precheck(self, nonce, timestamp, now=None):
+        """Format et fenêtre seulement, sans rien enregistrer: "ok", "invalid" ou "stale"."""
+        if not isinstance(nonce, str) or not 0 < len(nonce) <= NONCE_MAX_LEN:
+            return self._reject("invalid")
+        if not isinstance(timestamp, (int, float)) or isinstance(timestamp, bool):
+            return self._reject("invalid")
+        now = time.time() if now is None else now
+        if abs(now - timestamp) > self.window:
+            return self._reject("stale")
+        return "ok"
+
+    def check(self, nonce, timestamp, now=None):
+        """
+        Enregistre le nonce s'il est nouveau.
+        Retourne "ok", "invalid" (champs absents / mal formés), "stale"
+        (timestamp hors fenêtre), "replay" (nonce déjà vu) ou "full".
+        """
+        now = time.time() if now is None else now
+        result = self.precheck(nonce, timestamp, now)
+        if result != "ok":
+            return result
+
+        index = int(timestamp // self.bucket_width)
+        with self._lock:
+            self._expire_locked(now)
+            bucket = self._buckets.get(index)
+            if bucket is None:
+                bucket = self._buckets[index] = set()
+            elif nonce in bucket:
+                self.rejected += 1
+                return "replay"
+            if self._size >= self.max_nonces:
+                self.rejected += 1
+                return "full"
+            bucket.add(nonce)
+            self._size += 1
+        return "ok"
+
+    def _expire_locked(self, now):
+        """Supprime d'un bloc les tranches entièrement sorties de la fenêtre."""
+        first = int((now - self.window) // self.bucket_width)
+        if self._oldest is not None and self._oldest >= first:
+            return
+        for index in [i for i in self._buckets if i < first]:
+            self._size -= len(self._buckets.pop(index))
+        self._oldest = first
+
+    def _reject(self, reason):
+        with self._lock:
+            self.rejected += 1
+        return reason
+
+    def __len__(self):
+        return self._size
@@ -1,6 +1,6 @@
 # server.py
 # Serveur TCP sécurisé par TLS (V2)
-# Le protocole applicatif (JSON : LOGIN, MSG, FILE, PING) est identique à la V1.
+# Le protocole applicatif (JSON : LOGIN, MSG, FILE, FILE_LIST, FILE_GET, PING) est identique à la V1.
 # On remplace simplement la couche TCP brute par une couche TLS.
 #
 # Objectifs TLS:
@@ -9,11 +9,23 @@
 # - Authentification du serveur (certificat signé par la CA)
 
 import ssl         # module ssl pour activer TLS côté serveur
+import queue       # actions demandées par signal, exécutées hors du gestionnaire
+import signal      # SIGHUP = rechargement de la configuration
 import socket      # module socket pour la communication réseau TCP
 import threading   # gestion de plusieurs clients en parallèle
 import time        # timestamps côté serveur
-import os          # gestion des chemins/dossiers pour stocker les fichiers
-from common import send_json, recv_json  # fonctions JSON (inchangées)
+from common import send_json, recv_json_sized  # fonctions JSON (inchangées)
+from keepalive import IdleReaper         # détection des clients inactifs
+from logs import logger, setup_logging, summarize, SAMPLED  # journalisation non bloquante
+from auth import CredentialStore         # vérification des mots de passe (scrypt)
+from replay import NonceCache            # anti-rejeu (nonce + timestamp)
+from certauth import CertIdentityCache, configure_client_certs  # TLS mutuel (optionnel)
+from config import load_config           # fichier de configuration (rechargé à chaud)
+from capture import TrafficRecorder             # enregistrement du trafic (rejoué par traffic.py)
+from dispatch import Connection, Dispatcher, optional  # table type -> handler + validation des champs
+from filestore import (ChecksumError, frames, list_files, open_stored, resolve_range, safe_filename, send_range,
+                       store_file)
+from tlsconf import apply_tls_settings   # version TLS min, suites, courbe ECDHE
 
 HOST = "0.0.0.0"   # écoute sur toutes les interfaces (LAN + localhost)
 PORT = 5000        # port applicatif
@@ -21,89 +33,393 @@ PORT = 5000        # port applicatif
 # Dossier où on stocke les fichiers reçus (optionnel mais propre)
 RECEIVE_DIR = "received_files"
 
+# Certificat et clé du serveur.
+# NOTE IMPORTANTE SUR LES CHEMINS:
+# "certs/" est à la racine du projet (au même niveau que v2_secure/).
+# Donc depuis v2_secure/, le chemin est "../certs/..."
+CERT_FILE = "../certs/server.crt"
+KEY_FILE = "../certs/server.key"
+
+# Réglages TLS (voir tlsconf.py): version minimale ("TLSv1.2" / "TLSv1.3"),
+# suites TLS 1.2 au format OpenSSL et courbe ECDHE (None = défauts d'OpenSSL)
+TLS_MIN_VERSION = "TLSv1.2"
+TLS_CIPHERS = None
+TLS_CURVE = None
+
+# Fichier de configuration (voir config.py): relu au démarrage, puis à chaque
+# SIGHUP (kill -HUP <pid>). Le nouveau contexte TLS ne sert qu'aux nouveaux
+# handshakes: les clients déjà connectés ne sont pas coupés (rotation des certificats).
+CONFIG_FILE = "server.json"
+CONFIG_KEYS = ("HOST", "PORT", "RECEIVE_DIR", "CERT_FILE", "KEY_FILE", "CLIENT_CERT_MODE", "CLIENT_CA",
+               "LOG_LEVEL", "MAX_LOGIN_ATTEMPTS", "IDLE_TIMEOUT", "PING_TIMEOUT",
+               "TLS_MIN_VERSION", "TLS_CIPHERS", "TLS_CURVE", "CAPTURE_FILE")
+# types attendus des clés qui valent None par défaut (None = désactivé / valeur par défaut)
+CONFIG_TYPES = {"TLS_CIPHERS": str, "TLS_CURVE": str, "CAPTURE_FILE": str}
+RESTART_KEYS = {"HOST", "PORT"}   # socket d'écoute déjà ouverte: pris en compte au redémarrage
+
+# Niveau de log: "DEBUG" pour afficher chaque message reçu (payload tronqué)
+LOG_LEVEL = "INFO"
+
+# Enregistrement du trafic reçu, pour le rejouer avec traffic.py (voir capture.py):
+# chemin du fichier gzip, None = désactivé. Pris en compte par SIGHUP (capture à chaud)
+CAPTURE_FILE = None
+
+# Anti-rejeu: LOGIN / MSG / FILE doivent porter un nonce jamais vu et un
+# timestamp proche de l'horloge du serveur (voir replay.py)
+REPLAY_WINDOW = 30
+REPLAY_CHECKED = {"LOGIN", "MSG", "FILE"}
+REPLAY_ERRORS = {
+    "invalid": "missing or invalid nonce/timestamp",
+    "stale": "stale timestamp",
+    "replay": "replayed message",
+    "full": "server busy, retry later",
+}
+
+# Base des utilisateurs (créée avec: python auth.py add <utilisateur>)
+USERS_FILE = "users.json"
+MAX_LOGIN_ATTEMPTS = 3   # échecs de LOGIN avant déconnexion
+
+# Certificats clients (TLS mutuel): "off", "optional" ou "required".
+# Un client avec un certificat signé par la CA est connecté sous le CN du certificat, sans LOGIN.
+CLIENT_CERT_MODE = "off"
+CLIENT_CA = "../certs/rootCA.crt"
+
+# Keepalive: PING serveur après IDLE_TIMEOUT s sans activité,
+# éviction si pas de réponse dans les PING_TIMEOUT s suivantes
+IDLE_TIMEOUT = 60
+PING_TIMEOUT = 15
+
+
+def server_ping(conn):
+    """PING envoyé par le serveur à un client inactif."""
+    send_json(conn, {
+        "type": "PING",
+        "server_time": time.time()
+    })
+
+
+def evict_client(conn, addr):
+    """
+    Client qui ne répond plus: on coupe la socket.
+    Le thread du client sort alors de readline() et fait le nettoyage.
+    """
+    logger.info("[-] Client inactif évincé: %s", addr)
+    try:
+        conn.shutdown(socket.SHUT_RDWR)
+    except Exception:
+        pass
+
+
+reaper = IdleReaper(server_ping, evict_client, IDLE_TIMEOUT, PING_TIMEOUT)
+credentials = CredentialStore(USERS_FILE)
+nonces = NonceCache(REPLAY_WINDOW)
+cert_identities = CertIdentityCache()
+
+# Contexte TLS des nouveaux handshakes (remplacé en entier par reload_config)
+tls_context = None
+recorder = None   # enregistreur du trafic, si CAPTURE_FILE est défini
+reload_lock = threading.Lock()
+
+
+def build_tls_context(certfile, keyfile, client_cert_mode, client_ca,
+                      min_version="TLSv1.2", ciphers=None, curve=None):
+    """
+    Contexte TLS serveur:
+    - certfile : certificat serveur (signé par la CA)
+    - keyfile : clé privée du serveur
+    - optionnel: on demande aussi un certificat au client (signé par la même CA)
+    - version TLS minimale, suites de chiffrement et courbe ECDHE
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    apply_tls_settings(context, min_version, ciphers, curve)
+    context.load_cert_chain(certfile=certfile, keyfile=keyfile)
+    configure_client_certs(context, client_cert_mode, client_ca)
+    return context
+
+
+def reload_config(startup=False):
+    """
+    Relit CONFIG_FILE et les certificats, puis remplace le contexte TLS.
+    En cas d'erreur (JSON invalide, certificat illisible...), rien n'est modifié.
+    Retourne True si la nouvelle configuration est appliquée.
+    """
+    global tls_context
+
+    with reload_lock:
+        current = {name: globals()[name] for name in CONFIG_KEYS}
+        try:
+            merged = {**current, **load_config(CONFIG_FILE, current, CONFIG_TYPES)}
+            context = build_tls_context(merged["CERT_FILE"], merged["KEY_FILE"],
+                                        merged["CLIENT_CERT_MODE"], merged["CLIENT_CA"],
+                                        merged["TLS_MIN_VERSION"], merged["TLS_CIPHERS"], merged["TLS_CURVE"])
+            logger.setLevel(merged["LOG_LEVEL"])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error("[!] Configuration refusée (%s), configuration actuelle conservée", e)
+            return False
+
+        changed = sorted(name for name in CONFIG_KEYS if merged[name] != current[name])
+        for name in changed:
+            if name in RESTART_KEYS and not startup:
+                logger.warning("[!] %s modifié: pris en compte au prochain redémarrage", name)
+            else:
+                globals()[name] = merged[name]
+
+        reaper.idle_timeout = IDLE_TIMEOUT
+        reaper.ping_timeout = PING_TIMEOUT
+        tls_context = context
+        apply_capture()
+
+    if not startup:
+        logger.info("[*] Configuration rechargée (modifié: %s)", ", ".join(changed) or "certificats seulement")
+    return True
+
+
+def apply_capture():
+    """Démarre, change ou arrête l'enregistrement du trafic selon CAPTURE_FILE."""
+    global recorder
+    current = recorder.path if recorder is not None else None
+    if CAPTURE_FILE == current:
+        return
+    if recorder is not None:
+        old, recorder = recorder, None
+        old.close()
+        logger.info("[*] Capture terminée: %s (%s messages, %s perdus)", old.path, old.recorded, old.dropped)
+    if CAPTURE_FILE:
+        try:
+            recorder = TrafficRecorder(CAPTURE_FILE, server="v2")
+        except OSError as e:
+            logger.error("[!] Capture impossible dans %s: %s", CAPTURE_FILE, e)
+            return
+        logger.info("[*] Capture du trafic dans %s", CAPTURE_FILE)
+
+
+# Le gestionnaire de SIGHUP s'exécute dans le thread principal, peut-être pendant
+# qu'il tient un verrou (file du logger...): il ne fait que demander le
+# rechargement (SimpleQueue.put est réentrant), fait par le thread reload_worker.
+reload_requests = queue.SimpleQueue()
+
+
+def reload_signal(signum=None, frame=None):
+    """Gestionnaire de SIGHUP."""
+    reload_requests.put(signum)
+
+
+def reload_worker():
+    while True:
+        reload_requests.get()
+        try:
+            reload_config()
+        except Exception as e:
+            logger.error("[!] Erreur pendant le rechargement: %s", e)
+
+
+def check_replay(session, msg):
+    """Anti-rejeu des types REPLAY_CHECKED: un message capturé puis renvoyé (même nonce) ou trop ancien est refusé."""
+    if msg["type"] not in REPLAY_CHECKED:
+        return None
+    if msg["type"] == "LOGIN":
+        # nonce enregistré seulement si les identifiants sont bons (voir replay.py)
+        result = nonces.precheck(msg.get("nonce"), msg.get("timestamp"))
+    else:
+        result = nonces.check(msg.get("nonce"), msg.get("timestamp"))
+    return _replay_error(session, msg, result)
+
+
+def record_nonce(session, msg):
+    """Enregistre le nonce d'un LOGIN une fois les identifiants vérifiés. Retourne None ou le message d'erreur."""
+    return _replay_error(session, msg, nonces.check(msg.get("nonce"), msg.get("timestamp")))
+
+
+def _replay_error(session, msg, result):
+    if result == "ok":
+        return None
+    logger.warning("[!] %s refusé (%s) de %s", msg["type"], result, session.addr)
+    return REPLAY_ERRORS[result]
+
+
+# Table type -> handler (voir dispatch.py)
+dispatcher = Dispatcher(send_json, guard=check_replay)
+
+
+@dispatcher.register("LOGIN", {"username": str, "password": str}, public=True)
+def handle_login(session, msg):
+    # Dans V2, le mot de passe est toujours du JSON "en clair" côté applicatif,
+    # mais il est chiffré sur le réseau grâce à TLS. Vérification: hash scrypt.
+    result = credentials.verify(msg["username"], msg["password"])
+    if result == "ok":
+        error = record_nonce(session, msg)
+        if error is not None:
+            dispatcher.error(session, error)
+            return False
+        session.username = msg["username"]
+        send_json(session.conn, {
+            "type": "OK",
+            "message": "login accepted (v2 TLS)",
+            "server_time": time.time()
+        })
+        return False
+
+    # "busy" (pool scrypt saturé) n'est pas un échec: le client peut réessayer
+    session.failures += result == "invalid"
+    dispatcher.error(session, "server busy, retry later" if result == "busy" else "invalid credentials")
+    if session.failures >= MAX_LOGIN_ATTEMPTS:
+        logger.warning("[!] Trop d'échecs de LOGIN, déconnexion: %s", session.addr)
+        return True
+    return False
+
+
+@dispatcher.register("MSG", {"payload": optional(str, "")})
+def handle_msg(session, msg):
+    send_json(session.conn, {
+        "type": "ACK",
+        "echo": msg["payload"],
+        "server_time": time.time()
+    })
+    return False
+
+
+@dispatcher.register("FILE", {"filename": optional(str, "received.txt"), "payload": optional(str, ""),
+                              "sha256": optional(str)})
+def handle_file(session, msg):
+    filename = msg["filename"]
+    data = msg["payload"]
+
+    # nom simple uniquement: "../x" ne doit pas sortir du dossier de stockage
+    if safe_filename(filename) is None:
+        dispatcher.error(session, f"invalid filename: {filename}")
+        return False
+
+    # On stocke les fichiers reçus dans un dossier dédié (écriture atomique, texte UTF-8).
+    # SHA-256 calculée pendant l'écriture et comparée à celle du client (si envoyée)
+    try:
+        _, size, sha256 = store_file(RECEIVE_DIR, filename, data, msg["sha256"])
+    except ChecksumError as e:
+        logger.warning("[!] FILE %s de %s refusé: %s", filename, session.addr, e)
+        dispatcher.error(session, str(e))
+        return False
+
+    logger.info("[FILE] Reçu fichier %s de %s, taille: %s octets", filename, session.addr, size)
+
+    send_json(session.conn, {
+        "type": "ACK_FILE",
+        "filename": filename,
+        "size": size,
+        "sha256": sha256,
+        "server_time": time.time()
+    })
+    return False
+
+
+@dispatcher.register("FILE_LIST")
+def handle_file_list(session, msg):
+    # fichiers stockés par FILE, récupérables par FILE_GET
+    send_json(session.conn, {
+        "type": "FILE_LIST",
+        "files": list_files(RECEIVE_DIR),
+        "server_time": time.time()
+    })
+    return False
+
+
+@dispatcher.register("FILE_GET", {"filename": str, "offset": optional(int, 0), "length": optional(int)})
+def handle_file_get(session, msg):
+    # téléchargement (éventuellement partiel: offset / length) en trames FILE_DATA:
+    # en-tête JSON + octets bruts, lus par blocs (TLS chiffre en espace utilisateur)
+    conn = session.conn
+    f, size, sha256 = open_stored(RECEIVE_DIR, msg["filename"], with_digest=True)
+    if f is None:
+        dispatcher.error(session, f"no such file: {msg['filename']}")
+        return False
+    with f:
+        requested = resolve_range(size, msg["offset"], msg["length"])
+        if requested is None:
+            dispatcher.error(session, f"invalid range for: {msg['filename']} ({size} bytes)")
+            return False
+        for header, offset, length in frames(msg["filename"], size, *requested, sha256=sha256):
+            conn.sendall(header)
+            send_range(conn, f, offset, length)
+            reaper.touch(conn)  # gros fichier: le client n'est pas inactif pendant l'envoi
+    logger.info("[FILE] %s envoyé à %s (%s octets à partir de %s)", msg["filename"], session.addr,
+                requested[1], requested[0])
+    return False
+
+
+@dispatcher.register("PING", public=True)
+def handle_ping(session, msg):
+    send_json(session.conn, {
+        "type": "PONG",
+        "server_time": time.time()
+    })
+    return False
+
+
+@dispatcher.register("PONG", public=True)
+def handle_pong(session, msg):
+    # réponse à un PING serveur (activité déjà notée par reaper.touch())
+    return False
+
 
 def handle_client(conn, addr):
     """
     Gère un client (dans un thread).
     IMPORTANT : ici conn est une socket TLS (ssl.SSLSocket), pas une socket TCP brute.
     """
-    print(f"[+] Client connecté: {addr}")
+    logger.info("[+] Client connecté: %s", addr)
 
     # On crée un flux de lecture ligne-par-ligne UNE FOIS.
     # readline() = 1 message JSON (terminé par \n) dans notre protocole.
-    sock_file = conn.makefile("r", encoding="utf-8", newline="\n")
+    # Mode binaire: pas de couche de décodage texte (json.loads lit l'UTF-8 directement).
+    # Tout l'état de la connexion est dans session (utilisateur None tant que LOGIN n'a pas réussi)
+    session = Connection(conn, addr, conn.makefile("rb"))
 
     try:
-        while True:
-            # Réception d'un message JSON
-            msg = recv_json(sock_file)
-
-            # None = connexion fermée par le client
-            if msg is None:
-                print(f"[-] Client déconnecté: {addr}")
-                break
-
-            print(f"[{addr}] RECU: {msg}")
-            mtype = msg.get("type")
-
-            if mtype == "LOGIN":
-                # Dans V2, le login est toujours du JSON "en clair" côté applicatif,
-                # mais il est chiffré sur le réseau grâce à TLS.
+        # Certificat client valide: le handshake TLS a déjà authentifié l'utilisateur
+        if CLIENT_CERT_MODE != "off":
+            session.username = cert_identities.identity(conn)
+            if session.username is not None:
+                logger.info("[+] %s authentifié par certificat (%s)", addr, session.username)
                 send_json(conn, {
                     "type": "OK",
-                    "message": "login accepted (v2 TLS)",
-                    "server_time": time.time()
-                })
-
-            elif mtype == "MSG":
-                send_json(conn, {
-                    "type": "ACK",
-                    "echo": msg.get("payload", ""),
+                    "message": f"login accepted (client certificate: {session.username})",
                     "server_time": time.time()
                 })
 
-            elif mtype == "FILE":
-                filename = msg.get("filename", "received.txt")
-                data = msg.get("payload", "")
+        while True:
+            # Réception d'un message JSON
+            msg, size = recv_json_sized(session.file)
 
-                print(f"[FILE] Reçu fichier {filename} de {addr}, taille: {len(data)} octets")
+            # None = connexion fermée par le client
+            if msg is None:
+                logger.info("[-] Client déconnecté: %s", addr)
+                break
 
-                # On stocke les fichiers reçus dans un dossier dédié
-                os.makedirs(RECEIVE_DIR, exist_ok=True)
-                filepath = os.path.join(RECEIVE_DIR, f"receive_{filename}")
+            # toute réception compte comme activité pour le keepalive
+            reaper.touch(conn)
+            session.messages += 1
+            session.bytes_in += size
 
-                # Ici on écrit en texte UTF-8 car payload est une chaîne
-                with open(filepath, "w", encoding="utf-8") as f:
-                    f.write(data)
+            logger.debug("[%s] RECU: %s", addr, summarize(msg), extra=SAMPLED)
+            capture = recorder   # lu une fois: un rechargement peut le remplacer entre-temps
+            if capture is not None:
+                capture.record(session, msg)
 
-                send_json(conn, {
-                    "type": "ACK_FILE",
-                    "filename": filename,
-                    "size": len(data),
-                    "server_time": time.time()
-                })
-
-            elif mtype == "PING":
-                send_json(conn, {
-                    "type": "PONG",
-                    "server_time": time.time()
-                })
-
-            else:
-                # Message inconnu = réponse d'erreur
-                send_json(conn, {
-                    "type": "ERR",
-                    "message": "unknown type",
-                    "server_time": time.time()
-                })
+            # Handler du type (LOGIN, MSG, FILE, PING, PONG), après validation
+            # des champs et anti-rejeu; True = fermer la connexion
+            if dispatcher.dispatch(session, msg):
+                break
 
     except Exception as e:
-        print(f"[!] Erreur avec {addr}: {e}")
+        logger.warning("[!] Erreur avec %s: %s", addr, e)
 
     finally:
+        reaper.remove(conn)
+        capture = recorder
+        if capture is not None:
+            capture.closed(session)
+
         # Fermeture propre
         try:
-            sock_file.close()
+            session.file.close()
         except Exception:
             pass
 
@@ -112,25 +428,27 @@ def handle_client(conn, addr):
         except Exception:
             pass
 
-        print(f"[+] Connexion fermée: {addr}")
+        logger.info("[+] Connexion fermée: %s (%s)", addr, session.stats())
 
 
 def main():
+    # Logs écrits par un thread dédié (jamais de print() sur le chemin chaud)
+    setup_logging(LOG_LEVEL)
+
     # ----------------------------------------------------------------
-    # 1) Contexte TLS serveur
+    # 1) Configuration + contexte TLS serveur
     # ----------------------------------------------------------------
-    # On configure TLS côté serveur et on charge:
-    # - server.crt : certificat serveur (signé par la CA)
-    # - server.key : clé privée du serveur
-    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    if not reload_config(startup=True):
+        return
+
+    # kill -HUP <pid> recharge la configuration et les certificats
+    # (pas de SIGHUP sous Windows, et signal() n'est permis que dans le thread principal)
+    if hasattr(signal, "SIGHUP") and threading.current_thread() is threading.main_thread():
+        threading.Thread(target=reload_worker, name="reload", daemon=True).start()
+        signal.signal(signal.SIGHUP, reload_signal)
 
-    # NOTE IMPORTANTE SUR LES CHEMINS:
-    # Tu as indiqué que "certs/" est à la racine du projet (au même niveau que v2_secure/).
-    # Donc depuis v2_secure/, le chemin est "../certs/..."
-    context.load_cert_chain(
-        certfile="../certs/server.crt",
-        keyfile="../certs/server.key"
-    )
+    # Thread de surveillance des connexions inactives
+    reaper.start()
 
     # ----------------------------------------------------------------
     # 2) Socket TCP en écoute
@@ -140,19 +458,30 @@ def main():
         s.bind((HOST, PORT))
         s.listen(5)
 
-        print(f"[*] Serveur TLS en écoute sur {HOST}:{PORT}")
+        logger.info("[*] Serveur TLS en écoute sur %s:%s", HOST, PORT)
+        if not credentials.has_users():
+            logger.warning("[!] Aucun utilisateur dans %s: tous les LOGIN seront refusés "
+                           "(créer un compte avec: python auth.py add <nom>)", USERS_FILE)
 
         # ----------------------------------------------------------------
         # 3) Accepter des connexions et les "wrapper" en TLS
         # ----------------------------------------------------------------
         while True:
             conn, addr = s.accept()
-            print(f"[+] Nouvelle connexion TCP de {addr}")
+            logger.debug("[+] Nouvelle connexion TCP de %s", addr)
 
             # IMPORTANT: wrap_socket transforme la connexion TCP en connexion TLS
             # Le handshake TLS se fait ici.
-            tls_conn = context.wrap_socket(conn, server_side=True)
-            print(f"[+] Connexion TLS établie avec {addr}")
+            # (un handshake raté - ex: pas de certificat client en mode "required" -
+            # ne doit pas arrêter la boucle d'acceptation)
+            try:
+                tls_conn = tls_context.wrap_socket(conn, server_side=True)
+            except (ssl.SSLError, OSError) as e:
+                logger.warning("[!] Handshake TLS échoué avec %s: %s", addr, e)
+                conn.close()
+                continue
+            logger.info("[+] Connexion TLS établie avec %s", addr)
+            reaper.add(tls_conn, addr)
 
             # IMPORTANT: on passe tls_conn au thread, pas conn
             threading.Thread(
@@ -0,0 +1,435 @@
+# traffic.py
+# Rejeu d'une capture de trafic (voir capture.py) contre un serveur local:
+# test de non-régression de performance pour common.py et les serveurs.
+#
+# Usage:
+#   python traffic.py info CAPTURE
+#   python traffic.py accounts CAPTURE [--users users.json] [--password PW]
+#       crée les comptes vus dans la capture (avant de lancer le serveur de test)
+#   python traffic.py replay CAPTURE [--host H] [--port P] [--ca ../certs/rootCA.crt]
+#                            [--speed 1] [--clones 1] [--password PW] [--loopback] [--out run.json]
+#       --ca: connexion TLS (V2/V3) vérifiée par cette CA, sinon TCP brut (V1)
+#       --speed: 1 = vitesse enregistrée, N = N fois plus vite, 0 = au plus vite
+#       --clones K: chaque connexion enregistrée est rejouée K fois en parallèle
+#       --loopback: une adresse 127.x.y.z par IP enregistrée (routage par IP de la V3,
+#                   les to_ip sont réécrits en conséquence)
+#   python traffic.py compare BASE.json NEW.json [--threshold 20]
+#       code de sortie 1 si NEW régresse de plus de threshold % (débit ou p95)
+#
+# Rejeu déterministe: mêmes connexions, mêmes messages, dans le même ordre et
+# aux mêmes instants (divisés par speed). Seuls changent nonce / timestamp
+# (sinon refusés par l'anti-rejeu) et le mot de passe (effacé à l'enregistrement).
+# À vitesse enregistrée, le débit est imposé par la capture: c'est la latence
+# qui compare deux versions; --speed 0 mesure le débit maximal.
+#
+# Latence: le protocole n'a pas d'identifiant de requête, mais le serveur répond
+# dans l'ordre sur une connexion. Chaque réponse (tout message sauf ceux de
+# NOT_REPLIES) est associée à la plus ancienne requête de la connexion encore en attente.
+
+import argparse
+import json
+import secrets
+import socket
+import ssl
+import sys
+import threading
+import time
+from collections import deque
+
+from capture import read_capture
+
+DEFAULT_PASSWORD = "replay"
+START_DELAY = 0.5         # secondes laissées au démarrage des threads avant le premier message
+CONNECT_TIMEOUT = 10
+REPLY_TIMEOUT = 10        # attente max des dernières réponses d'une connexion
+DISCARD_CHUNK = 1024 * 1024
+
+SKIPPED_TYPES = {"PONG", "SHUTDOWN"}   # PONG: le rejeu répond lui-même aux PING; SHUTDOWN arrêterait le serveur
+NOT_REPLIES = {"MSG", "FILE_FROM", "PING", "SERVER_CLOSING"}   # messages relayés / initiés par le serveur
+
+MIN_SAMPLES = 100         # compare: latences ignorées pour un type moins fréquent (p95 trop bruité)
+MIN_DELTA_MS = 0.5        # compare: écart de latence ignoré en dessous (bruit de mesure)
+
+
+def encode(msg):
+    return (json.dumps(msg) + "\n").encode("utf-8")
+
+
+def loopback_address(index):
+    n = index + 2   # 127.0.0.2, 127.0.0.3, ... (127.0.0.1 reste au serveur / aux outils)
+    return f"127.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}"
+
+
+def percentile(values, p):
+    """values triées, p entre 0 et 100 (rang le plus proche)."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class ReplayConnection:
+    """Une connexion enregistrée, rejouée dans son propre thread (+ un thread de lecture)."""
+
+    def __init__(self, replayer, connection):
+        self.replayer = replayer
+        self.connection = connection
+        self.sock = None
+        self.send_lock = threading.Lock()
+        self.pending = deque()   # (type, instant d'envoi) des requêtes sans réponse
+        self.cond = threading.Condition()
+        self.closed = False
+        # mesures de cette connexion, regroupées par Replayer.report()
+        self.latencies = {}      # type de requête -> [secondes]
+        self.errors = {}         # type de requête -> nombre d'ERR reçus
+        self.sent = 0
+        self.replies = 0
+        self.deliveries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.unanswered = 0
+        self.failed = False
+
+    def _connect(self):
+        replayer = self.replayer
+        raw = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            if replayer.ip_map:
+                raw.bind((replayer.ip_map[self.connection["ip"]], 0))
+            raw.settimeout(CONNECT_TIMEOUT)
+            raw.connect((replayer.host, replayer.port))
+            if replayer.context is not None:
+                raw = replayer.context.wrap_socket(raw, server_hostname=replayer.host)
+            raw.settimeout(None)
+        except OSError:
+            raw.close()
+            raise
+        return raw
+
+    def run(self):
+        replayer = self.replayer
+        replayer.wait_until(self.connection["start"])
+        try:
+            self.sock = self._connect()
+        except OSError:
+            self.failed = True
+            replayer.finished_sending()
+            return
+        reader = threading.Thread(target=self._read, daemon=True)
+        reader.start()
+        try:
+            for t, msg in self.connection["messages"]:
+                kind = msg.get("type") if type(msg) is dict else None
+                if kind in SKIPPED_TYPES:
+                    continue
+                replayer.wait_until(t)
+                data = encode(replayer.prepare(msg) if type(msg) is dict else msg)
+                # la requête est en attente AVANT l'envoi: sa réponse peut arriver tout de suite
+                with self.cond:
+                    if self.closed:
+                        break
+                    self.pending.append((str(kind), time.perf_counter()))
+                with self.send_lock:
+                    self.sock.sendall(data)
+                self.sent += 1
+                self.bytes_sent += len(data)
+        except OSError:
+            self.failed = True
+        finally:
+            replayer.finished_sending()
+        try:
+            # dernières réponses, puis fermeture au même instant que l'original
+            # (au plus vite: quand toutes les connexions ont tout envoyé, pour que
+            # les broadcasts atteignent toujours le même nombre de destinataires)
+            with self.cond:
+                self.cond.wait_for(lambda: not self.pending or self.closed, REPLY_TIMEOUT)
+            if replayer.speed:
+                replayer.wait_until(self.connection["end"])
+            else:
+                replayer.wait_all_sent()
+        finally:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            reader.join()
+            self.sock.close()
+            self.unanswered = len(self.pending)
+
+    def _read(self):
+        sock_file = self.sock.makefile("rb")
+        try:
+            while True:
+                line = sock_file.readline()
+                if not line:
+                    break
+                self.bytes_received += len(line)
+                msg = json.loads(line)
+                mtype = msg.get("type") if type(msg) is dict else None
+
+                if mtype == "FILE_DATA":
+                    # octets bruts après l'en-tête (voir filestore.py), lus et jetés
+                    remaining = msg.get("length", 0)
+                    while remaining > 0:
+                        chunk = sock_file.read(min(remaining, DISCARD_CHUNK))
+                        if not chunk:
+                            return
+                        remaining -= len(chunk)
+                        self.bytes_received += len(chunk)
+                    if not msg.get("last"):
+                        continue
+                elif mtype == "PING":
+                    with self.send_lock:
+                        self.sock.sendall(encode({"type": "PONG"}))
+                    continue
+
+                if mtype in NOT_REPLIES:
+                    self.deliveries += 1
+                    continue
+                now = time.perf_counter()
+                with self.cond:
+                    if not self.pending:
+                        continue   # réponse non sollicitée (ex: OK d'un certificat client)
+                    kind, sent_at = self.pending.popleft()
+                    self.cond.notify()
+                self.replies += 1
+                self.latencies.setdefault(kind, []).append(now - sent_at)
+                if mtype == "ERR":
+                    self.errors[kind] = self.errors.get(kind, 0) + 1
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self.cond:
+                self.closed = True
+                self.cond.notify()
+            sock_file.close()
+
+
+class Replayer:
+    """Rejoue les connexions d'une capture (toutes en parallèle, chacune à son rythme)."""
+
+    def __init__(self, connections, host, port, context=None, speed=1.0, clones=1,
+                 password=DEFAULT_PASSWORD, loopback=False):
+        self.connections = connections
+        self.host = host
+        self.port = port
+        self.context = context
+        self.speed = speed
+        self.clones = clones
+        self.password = password
+        self.ip_map = {}
+        if loopback:
+            ips = sorted({c["ip"] for c in connections})
+            self.ip_map = {ip: loopback_address(i) for i, ip in enumerate(ips)}
+        self.t0 = 0.0
+        self._sending = 0   # connexions qui n'ont pas encore tout envoyé
+        self._sent_cond = threading.Condition()
+
+    def wait_until(self, t):
+        """Attend l'instant du rejeu correspondant à t (secondes depuis le début de la capture)."""
+        delay = self.t0 + (t / self.speed if self.speed else 0) - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    def finished_sending(self):
+        with self._sent_cond:
+            self._sending -= 1
+            self._sent_cond.notify_all()
+
+    def wait_all_sent(self):
+        with self._sent_cond:
+            self._sent_cond.wait_for(lambda: self._sending <= 0, REPLY_TIMEOUT)
+
+    def prepare(self, msg):
+        """Copie du message prête à l'envoi (nonce / timestamp neufs, mot de passe de test, IP réécrite)."""
+        msg = dict(msg)
+        if "nonce" in msg:
+            msg["nonce"] = secrets.token_hex(16)
+        if "timestamp" in msg:
+            msg["timestamp"] = time.time()
+        if msg.get("type") == "LOGIN":
+            msg["password"] = self.password
+        if msg.get("to_ip") in self.ip_map:
+            msg["to_ip"] = self.ip_map[msg["to_ip"]]
+        return msg
+
+    def run(self):
+        """Rejoue tout et retourne les connexions rejouées (avec leurs mesures) et la durée."""
+        replays = [ReplayConnection(self, c) for c in self.connections for _ in range(self.clones)]
+        threads = [threading.Thread(target=r.run, daemon=True) for r in replays]
+        self._sending = len(replays)
+        self.t0 = time.perf_counter() + START_DELAY
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return replays, time.perf_counter() - self.t0
+
+    def report(self, replays, duration):
+        """Résumé JSON d'un rejeu (comparé ensuite par compare())."""
+        latencies = {}
+        errors = {}
+        for r in replays:
+            for kind, values in r.latencies.items():
+                latencies.setdefault(kind, []).extend(values)
+            for kind, count in r.errors.items():
+                errors[kind] = errors.get(kind, 0) + count
+        sent = sum(r.sent for r in replays)
+        types = {}
+        for kind, values in sorted(latencies.items()):
+            values.sort()
+            types[kind] = {
+                "count": len(values),
+                "errors": errors.get(kind, 0),
+                "p50": round(percentile(values, 50) * 1000, 3),
+                "p95": round(percentile(values, 95) * 1000, 3),
+                "p99": round(percentile(values, 99) * 1000, 3),
+                "max": round(values[-1] * 1000, 3)
+            }
+        return {
+            "speed": self.speed,
+            "clones": self.clones,
+            "connections": len(replays),
+            "failed": sum(r.failed for r in replays),
+            "duration": round(duration, 3),
+            "sent": sent,
+            "replies": sum(r.replies for r in replays),
+            "unanswered": sum(r.unanswered for r in replays),
+            "deliveries": sum(r.deliveries for r in replays),
+            "bytes_sent": sum(r.bytes_sent for r in replays),
+            "bytes_received": sum(r.bytes_received for r in replays),
+            "throughput": round(sent / duration, 1) if duration > 0 else 0.0,
+            "types": types
+        }
+
+
+def create_accounts(connections, users_file, password):
+    """Comptes de test (mot de passe commun) pour les utilisateurs des LOGIN de la capture."""
+    from auth import CredentialStore
+
+    names = sorted({msg["username"] for c in connections for _, msg in c["messages"]
+                    if type(msg) is dict and msg.get("type") == "LOGIN" and type(msg.get("username")) is str})
+    store = CredentialStore(users_file)
+    for name in names:
+        store.set_password(name, password)
+    return names
+
+
+def compare(base, new, threshold):
+    """Affiche les écarts entre deux rejeux. Retourne la liste des régressions (au-delà de threshold %)."""
+    regressions = []
+
+    def change(before, after):
+        return (after - before) / before * 100 if before else 0.0
+
+    print(f"{'':24} {'base':>12} {'nouveau':>12} {'écart':>9}")
+    delta = change(base["throughput"], new["throughput"])
+    print(f"{'débit (msg/s)':24} {base['throughput']:>12.1f} {new['throughput']:>12.1f} {delta:>+8.1f}%")
+    if delta < -threshold:
+        regressions.append(f"débit {delta:+.1f}%")
+    for name in ("unanswered", "failed"):
+        print(f"{name:24} {base[name]:>12} {new[name]:>12}")
+        if new[name] > base[name]:
+            regressions.append(f"{name}: {base[name]} -> {new[name]}")
+
+    for kind in sorted(set(base["types"]) | set(new["types"])):
+        before, after = base["types"].get(kind), new["types"].get(kind)
+        if before is None or after is None:
+            print(f"{kind:24} {'-' if before is None else before['count']:>12} "
+                  f"{'-' if after is None else after['count']:>12}")
+            continue
+        for p in ("p50", "p95", "p99"):
+            delta = change(before[p], after[p])
+            print(f"{kind + ' ' + p + ' (ms)':24} {before[p]:>12.3f} {after[p]:>12.3f} {delta:>+8.1f}%")
+        if after["errors"] > before["errors"]:
+            regressions.append(f"{kind}: ERR {before['errors']} -> {after['errors']}")
+        if (min(before["count"], after["count"]) >= MIN_SAMPLES and after["p95"] - before["p95"] >= MIN_DELTA_MS
+                and change(before["p95"], after["p95"]) > threshold):
+            regressions.append(f"{kind} p95 {change(before['p95'], after['p95']):+.1f}%")
+    return regressions
+
+
+def print_info(header, connections):
+    counts = {}
+    for c in connections:
+        for _, msg in c["messages"]:
+            kind = msg.get("type") if type(msg) is dict else None
+            counts[str(kind)] = counts.get(str(kind), 0) + 1
+    end = max((c["end"] for c in connections), default=0.0)
+    print(f"serveur: {header.get('server') or '?'}, début: {time.ctime(header.get('started', 0))}")
+    print(f"connexions: {len(connections)} ({len({c['ip'] for c in connections})} IP), "
+          f"messages: {sum(counts.values())}, durée: {end:.1f} s")
+    for kind, count in sorted(counts.items(), key=lambda item: -item[1]):
+        print(f"  {kind:16} {count}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rejeu de captures de trafic (capture.py)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    info = commands.add_parser("info", help="résumé d'une capture")
+    info.add_argument("capture")
+
+    accounts = commands.add_parser("accounts", help="crée les comptes de la capture")
+    accounts.add_argument("capture")
+    accounts.add_argument("--users", default="users.json")
+    accounts.add_argument("--password", default=DEFAULT_PASSWORD)
+
+    replay = commands.add_parser("replay", help="rejoue une capture contre un serveur")
+    replay.add_argument("capture")
+    replay.add_argument("--host", default="127.0.0.1")
+    replay.add_argument("--port", type=int, default=5000)
+    replay.add_argument("--ca", help="CA du serveur (TLS); sans --ca: TCP brut")
+    replay.add_argument("--speed", type=float, default=1.0)
+    replay.add_argument("--clones", type=int, default=1)
+    replay.add_argument("--password", default=DEFAULT_PASSWORD)
+    replay.add_argument("--loopback", action="store_true")
+    replay.add_argument("--out", help="fichier JSON du résultat (pour compare)")
+
+    comp = commands.add_parser("compare", help="compare deux résultats de replay")
+    comp.add_argument("base")
+    comp.add_argument("new")
+    comp.add_argument("--threshold", type=float, default=20.0)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        with open(args.base, encoding="utf-8") as f:
+            base = json.load(f)
+        with open(args.new, encoding="utf-8") as f:
+            new = json.load(f)
+        regressions = compare(base, new, args.threshold)
+        for regression in regressions:
+            print(f"[!] Régression: {regression}")
+        return 1 if regressions else 0
+
+    header, connections = read_capture(args.capture)
+    if args.command == "info":
+        print_info(header, connections)
+        return 0
+    if args.command == "accounts":
+        names = create_accounts(connections, args.users, args.password)
+        print(f"[+] {len(names)} compte(s) dans {args.users}: {', '.join(names)}")
+        return 0
+
+    context = ssl.create_default_context(cafile=args.ca) if args.ca else None
+    replayer = Replayer(connections, args.host, args.port, context, args.speed, args.clones,
+                        args.password, args.loopback)
+    result = replayer.report(*replayer.run())
+    result["capture"] = args.capture
+    result["server"] = header.get("server")
+
+    print(f"{result['connections']} connexions ({result['failed']} en échec), {result['sent']} messages "
+          f"en {result['duration']:.2f} s: {result['throughput']:.0f} msg/s, "
+          f"{result['deliveries']} messages relayés reçus, {result['unanswered']} sans réponse")
+    print(f"{'type':16} {'nombre':>8} {'ERR':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for kind, t in result["types"].items():
+        print(f"{kind:16} {t['count']:>8} {t['errors']:>6} {t['p50']:>9.3f} {t['p95']:>9.3f} "
+              f"{t['p99']:>9.3f} {t['max']:>9.3f}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+# bench_coalesce.py
+# Effet des écritures groupées (coalesce.py) sur le serveur V3.
+#
+# - Salon bavard: N clients connectés, chacun envoie des MSG broadcast à la
+#   suite; chaque client reçoit les MSG de tous les autres. Mesures: débit de
+#   livraison, écritures sur les sockets (appels sendall = enregistrements TLS
+#   pour des lots < 16 Ko), latence envoi -> réception
+# - Faible charge: un seul émetteur, un MSG toutes les 2 ms: latence ajoutée
+#   par le tampon quand il n'y a rien à grouper
+# Référence "direct": un sendall par message sous un verrou (avant coalesce.py).
+# - Arriéré hors ligne plus gros que la file de sortie (OUTPUT_MAX_BYTES), livré
+#   à un lecteur lent: tout doit arriver et l'outbox être vidée (code 1 sinon)
+#
+# À lancer depuis v3_interface/ (certificats dans ../certs, rootCA.crt dans ce dossier).
+# Usage: python bench_coalesce.py [clients] [messages_par_client]
+
+import importlib
+import json
+import os
+import secrets
+import socket
+import ssl
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import coalesce
+import server
+from auth import CredentialStore
+from common import encode_json
+
+PORT = 5098
+work_dir = tempfile.mkdtemp()
+users_file = os.path.join(work_dir, "users.json")
+client_context = ssl.create_default_context(cafile="rootCA.crt")
+
+
+class DirectOutput:
+    """Comportement d'avant: chaque message = un sendall, sous un verrou par connexion."""
+
+    messages_total = 0
+    writes_total = 0
+    overflows_total = 0
+
+    def __init__(self, conn, *settings):
+        self.conn = conn
+        self._lock = threading.Lock()
+
+    def write(self, raw):
+        with self._lock:
+            self.conn.sendall(raw)
+        DirectOutput.messages_total += 1
+        DirectOutput.writes_total += 1
+
+    @contextmanager
+    def exclusive(self, data=b""):
+        with self._lock:
+            if data:
+                self.conn.sendall(data)
+            yield self.conn
+
+    def finish(self):
+        pass
+
+    def close(self, timeout=None):
+        pass
+
+
+def start_server(direct=False, **settings):
+    """Serveur V3 frais (module rechargé) avec les réglages donnés."""
+    importlib.reload(server)
+    server.PORT = PORT
+    server.METRICS_PORT = 0
+    server.LOG_LEVEL = "WARNING"
+    server.DRAIN_TIMEOUT = 1
+    server.CONFIG_FILE = os.path.join(work_dir, "absent.json")   # pas de server.json local
+    server.credentials = CredentialStore(users_file)
+    if direct:
+        server.OutputBuffer = DirectOutput
+    for name, value in settings.items():
+        setattr(server, name, value)
+    thread = threading.Thread(target=server.main, daemon=True)
+    thread.start()
+    time.sleep(0.3)
+    return thread
+
+
+def stop_server(thread):
+    server.request_shutdown("bench")
+    thread.join()
+
+
+def open_client():
+    sock = client_context.wrap_socket(socket.socket(), server_hostname="127.0.0.1")
+    sock.connect(("127.0.0.1", PORT))
+    sock_file = sock.makefile("rb")
+    sock.sendall(encode_json({"type": "LOGIN", "username": "bench", "password": "bench",
+                              "timestamp": time.time(), "nonce": secrets.token_hex(8)}))
+    sock_file.readline()
+    return sock, sock_file
+
+
+def msg():
+    # l'heure d'envoi voyage dans le payload: latence mesurée à la réception (même processus)
+    return encode_json({"type": "MSG", "to_ip": "*", "payload": repr(time.perf_counter()),
+                        "timestamp": time.time(), "nonce": secrets.token_hex(8)})
+
+
+def receive(sock_file, expected, latencies):
+    """Lit jusqu'à expected MSG relayés (les ACK sont ignorés)."""
+    got = 0
+    while got < expected:
+        line = sock_file.readline()
+        if not line:
+            break
+        m = json.loads(line)
+        if m.get("type") == "MSG":
+            latencies.append(time.perf_counter() - float(m["payload"]))
+            got += 1
+
+
+def counters(direct):
+    cls = DirectOutput if direct else coalesce.OutputBuffer
+    return cls.messages_total, cls.writes_total
+
+
+def run(direct, delay, clients, per_client, interval=0.0, senders=None):
+    """Retourne (livraisons/s, messages par écriture, latence p50, p99)."""
+    thread = start_server(direct, COALESCE_DELAY=delay)
+    conns = [open_client() for _ in range(clients)]
+    time.sleep(0.2)
+    senders = conns if senders is None else conns[:senders]
+    expected = len(senders) * per_client   # chacun reçoit aussi ses propres MSG (broadcast)
+    latencies = [[] for _ in conns]
+    readers = [threading.Thread(target=receive, args=(f, expected, latencies[i]))
+               for i, (_, f) in enumerate(conns)]
+
+    def send(sock):
+        for _ in range(per_client):
+            sock.sendall(msg())
+            if interval:
+                time.sleep(interval)
+
+    writers = [threading.Thread(target=send, args=(s,)) for s, _ in senders]
+    messages_before, writes_before = counters(direct)
+    start = time.perf_counter()
+    for t in readers + writers:
+        t.start()
+    for t in readers + writers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    messages_after, writes_after = counters(direct)
+    for s, f in conns:
+        s.close()
+        f.close()
+    stop_server(thread)
+
+    samples = sorted(x for lat in latencies for x in lat)
+    delivered = len(samples)
+    per_write = (messages_after - messages_before) / max(1, writes_after - writes_before)
+    return (delivered / elapsed, per_write,
+            samples[len(samples) // 2], samples[int(len(samples) * 0.99) - 1])
+
+
+def run_backlog(output_max=1024 * 1024, backlog=8 * 1024 * 1024, read_delay=0.01):
+    """Retourne (MSG mis en attente, MSG reçus, octets restés dans l'outbox, secondes)."""
+    thread = start_server(OUTPUT_MAX_BYTES=output_max, OUTBOX_DIR=os.path.join(work_dir, "outbox"))
+    payload = "x" * 1000
+    queued = 0
+    while server.outbox.pending("127.0.0.1") < backlog:
+        raw = encode_json({"type": "MSG", "from": "bench", "to_ip": "127.0.0.1", "payload": payload})
+        if not server.outbox.append("127.0.0.1", raw):
+            break
+        queued += 1
+
+    sock = client_context.wrap_socket(socket.socket(), server_hostname="127.0.0.1")
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16 * 1024)
+    sock.connect(("127.0.0.1", PORT))
+    sock.sendall(encode_json({"type": "LOGIN", "username": "bench", "password": "bench",
+                              "timestamp": time.time(), "nonce": secrets.token_hex(8)}))
+    received = 0
+    buffered = b""
+    start = time.perf_counter()
+    sock.settimeout(5)
+    try:
+        while received < queued:
+            data = sock.recv(16 * 1024)
+            if not data:
+                break
+            buffered += data
+            *lines, buffered = buffered.split(b"\n")
+            received += sum(1 for line in lines if b'"MSG"' in line)
+            time.sleep(read_delay)   # lecteur lent
+    except OSError:
+        pass
+    elapsed = time.perf_counter() - start
+    left = server.outbox.pending("127.0.0.1")
+    sock.close()
+    stop_server(thread)
+    return queued, received, left, elapsed
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    per_client = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    CredentialStore(users_file).set_password("bench", "bench")
+    modes = [("direct", True, 0.0), ("groupé, délai 0", False, 0.0),
+             ("groupé, délai 1 ms", False, 0.001), ("groupé, délai 5 ms", False, 0.005)]
+
+    print(f"Salon bavard: {clients} clients x {per_client} MSG broadcast")
+    for label, direct, delay in modes:
+        rate, per_write, p50, p99 = run(direct, delay, clients, per_client)
+        print(f"  {label:<20} {rate:9.0f} livraisons/s   {per_write:6.1f} msg/écriture   "
+              f"p50 {p50 * 1000:7.2f} ms   p99 {p99 * 1000:7.2f} ms")
+
+    print("Faible charge: 1 émetteur, 5 clients, 1 MSG toutes les 2 ms")
+    for label, direct, delay in modes:
+        rate, per_write, p50, p99 = run(direct, delay, 5, 300, interval=0.002, senders=1)
+        print(f"  {label:<20} {per_write:6.1f} msg/écriture   "
+              f"p50 {p50 * 1000:7.2f} ms   p99 {p99 * 1000:7.2f} ms")
+
+    print("Arriéré de 8 Mo, file de sortie de 1 Mo, lecteur lent")
+    queued, received, left, elapsed = run_backlog()
+    print(f"  {received}/{queued} MSG reçus en {elapsed:.1f} s, {left} octets restés dans l'outbox")
+    if received != queued or left:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# bench_memory.py
+# Mémoire du serveur V3 par connexion inactive.
+#
+# Lance server.py dans un processus à part, ouvre N connexions TLS qui font
+# LOGIN puis ne font plus rien, et mesure l'augmentation de la mémoire
+# résidente (VmRSS) et du nombre de threads du serveur (lus dans /proc: Linux).
+# La mémoire par connexion inactive est ce qui limite le nombre de sessions
+# qu'une machine peut garder ouvertes.
+#
+# À lancer depuis v3_interface/ (certificats dans ../certs, rootCA.crt dans ce dossier).
+# Usage: python bench_memory.py [connexions]
+
+import json
+import os
+import secrets
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+
+from auth import CredentialStore
+from coalesce import WRITER_IDLE
+from common import encode_json
+
+PORT = 5097
+work_dir = tempfile.mkdtemp()
+client_context = ssl.create_default_context(cafile="rootCA.crt")
+
+
+def proc_status(pid):
+    """(VmRSS en octets, nombre de threads) du processus."""
+    rss = threads = 0
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1]) * 1024
+            elif line.startswith("Threads:"):
+                threads = int(line.split()[1])
+    return rss, threads
+
+
+def settle(pid, seconds=1.0):
+    """Laisse le serveur finir ce qu'il a en cours, puis mesure."""
+    time.sleep(seconds)
+    return proc_status(pid)
+
+
+def open_client():
+    sock = client_context.wrap_socket(socket.socket(), server_hostname="127.0.0.1")
+    sock.connect(("127.0.0.1", PORT))
+    sock_file = sock.makefile("rb")
+    sock.sendall(encode_json({"type": "LOGIN", "username": "bench", "password": "bench",
+                              "timestamp": time.time(), "nonce": secrets.token_hex(8)}))
+    sock_file.readline()
+    return sock, sock_file
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    # serveur lancé dans un dossier temporaire: son propre users.json, outbox...
+    CredentialStore(os.path.join(work_dir, "users.json")).set_password("bench", "bench")
+    config = os.path.join(work_dir, "server.json")
+    with open(config, "w") as f:
+        json.dump({"port": PORT, "metrics_port": 0, "log_level": "WARNING",
+                   "cert_file": os.path.abspath("../certs/server.crt"),
+                   "key_file": os.path.abspath("../certs/server.key")}, f)
+    server = subprocess.Popen([sys.executable, os.path.abspath("server.py"), config], cwd=work_dir,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(1.0)
+        # premières connexions: imports paresseux, caches TLS, pools... hors mesure
+        warm = [open_client() for _ in range(20)]
+        for s, f in warm:
+            f.close()
+            s.close()
+        rss0, threads0 = settle(server.pid, WRITER_IDLE + 2.0)
+
+        conns = [open_client() for _ in range(count)]
+        # les threads d'écriture (réponses au LOGIN) s'arrêtent après WRITER_IDLE
+        rss1, threads1 = settle(server.pid, WRITER_IDLE + 2.0)
+
+        print(f"{count} connexions inactives (TLS + LOGIN)")
+        print(f"  mémoire résidente: {rss0 / 2**20:.1f} Mo -> {rss1 / 2**20:.1f} Mo, "
+              f"{(rss1 - rss0) / count / 1024:.1f} Ko par connexion")
+        print(f"  threads: {threads0} -> {threads1} ({(threads1 - threads0) / count:.1f} par connexion)")
+        for s, f in conns:
+            f.close()
+            s.close()
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# bench_replay.py
+# Mesure le coût de l'anti-rejeu (replay.NonceCache) à fort débit.
+#
+# Le temps est simulé: on fait "passer" sim_seconds secondes à rate messages/s
+# (horloge avancée message par message) pour voir, sans attendre, le coût par
+# check() et la mémoire en régime établi (fenêtre pleine, tranches qui expirent).
+#
+# Usage: python bench_replay.py [messages_par_seconde] [secondes_simulées] [threads]
+
+import secrets
+import sys
+import threading
+import time
+import tracemalloc
+
+from replay import NonceCache, BUCKET_WIDTH, REPLAY_WINDOW
+
+
+def make_nonces(count):
+    return [secrets.token_hex(8) for _ in range(count)]
+
+
+def run_single(rate, sim_seconds):
+    """Un thread, horloge simulée: débit brut de check() et taille du cache."""
+    cache = NonceCache(REPLAY_WINDOW, max_nonces=10 ** 9)
+    total = rate * sim_seconds
+    nonces = make_nonces(total)
+    t0 = 1_700_000_000.0
+    step = 1.0 / rate
+
+    peak = 0
+    start = time.perf_counter()
+    for i, nonce in enumerate(nonces):
+        now = t0 + i * step
+        cache.check(nonce, now, now)
+        if i % rate == 0:
+            peak = max(peak, len(cache))
+    elapsed = time.perf_counter() - start
+    return total / elapsed, peak, len(cache)
+
+
+def run_replays(rate):
+    """Rejeu d'une fenêtre entière de messages déjà vus: tous doivent être refusés."""
+    cache = NonceCache(REPLAY_WINDOW, max_nonces=10 ** 9)
+    now = time.time()
+    msgs = [(n, now - (i % REPLAY_WINDOW)) for i, n in enumerate(make_nonces(rate * 5))]
+    for nonce, ts in msgs:
+        cache.check(nonce, ts, now)
+    start = time.perf_counter()
+    refused = sum(cache.check(nonce, ts, now) == "replay" for nonce, ts in msgs)
+    elapsed = time.perf_counter() - start
+    return len(msgs) / elapsed, refused, len(msgs)
+
+
+def run_threads(threads, per_thread):
+    """Plusieurs threads (comme les threads clients du serveur) sur le même cache."""
+    cache = NonceCache(REPLAY_WINDOW, max_nonces=10 ** 9)
+    batches = [make_nonces(per_thread) for _ in range(threads)]
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(batch):
+        barrier.wait()
+        now = time.time()
+        for nonce in batch:
+            cache.check(nonce, now, now)
+
+    workers = [threading.Thread(target=worker, args=(b,)) for b in batches]
+    for t in workers:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return threads * per_thread / elapsed
+
+
+def memory_at(count):
+    """Octets occupés par count nonces dans le cache (tracemalloc)."""
+    now = time.time()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    # nonces créés sous tracemalloc: le cache garde les chaînes reçues
+    nonces = make_nonces(count)
+    cache = NonceCache(REPLAY_WINDOW, max_nonces=10 ** 9)
+    for nonce in nonces:
+        cache.check(nonce, now, now)
+    del nonces
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used
+
+
+def main():
+    rate = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    sim_seconds = int(sys.argv[2]) if len(sys.argv) > 2 else 120
+    threads = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+
+    print(f"fenêtre {REPLAY_WINDOW} s, {rate} msg/s simulés pendant {sim_seconds} s")
+
+    per_sec, peak, final = run_single(rate, sim_seconds)
+    print(f"  check() 1 thread        {per_sec:>12.0f} /s  ({1e6 / per_sec:.2f} µs/check)")
+    print(f"  nonces gardés           max {peak}, fin {final}  (débit x (fenêtre + 1 tranche) = {rate * (REPLAY_WINDOW + BUCKET_WIDTH)})")
+
+    per_sec, refused, total = run_replays(rate)
+    print(f"  rejeu refusé            {per_sec:>12.0f} /s  ({refused}/{total} refusés)")
+
+    per_sec = run_threads(threads, 50000)
+    print(f"  check() {threads} threads       {per_sec:>12.0f} /s")
+
+    size = rate * REPLAY_WINDOW
+    used = memory_at(size)
+    print(f"  mémoire fenêtre pleine  {used / 1e6:.1f} Mo pour {size} nonces ({used / size:.0f} o/nonce)")
+
+
+if __name__ == "__main__":
+    main()
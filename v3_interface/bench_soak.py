@@ -0,0 +1,365 @@
+# bench_soak.py
+# Essai d'endurance du serveur V3: recherche de fuites (mémoire, threads, descripteurs).
+#
+# Lance server.py dans un processus à part (dossier temporaire, certificat
+# auto-signé créé pour l'occasion avec openssl, sinon ../certs), puis fait
+# tourner en boucle des clients simulés:
+#   connexion TLS -> LOGIN -> JOIN d'un salon -> quelques MSG (salon ou
+#   broadcast) -> parfois FILE puis FILE_GET -> déconnexion
+# La déconnexion est tantôt propre, tantôt brutale (RST sans lire les messages
+# en attente, ou client qui cesse de lire pendant les broadcasts des autres),
+# tantôt avant même la réponse au LOGIN: ce sont les chemins où une connexion
+# peut rester dans une table ou un thread ne jamais se terminer.
+#
+# Toutes les --checkpoint secondes les clients s'arrêtent, le serveur se calme
+# (threads d'écriture arrêtés, roster publié) et on relève: mémoire résidente,
+# threads et descripteurs (/proc du serveur), connexions et entrées des tables
+# (STATS) et top tracemalloc (MEMORY) par rapport à la photo prise après la
+# chauffe. Échec (code de sortie 1) si la dernière mesure dépasse les seuils.
+#
+# À lancer depuis v3_interface/ (Linux: /proc).
+# Usage: python bench_soak.py [--duration 3600] [--clients 50] [--checkpoint 300]
+
+import argparse
+import collections
+import json
+import os
+import queue
+import random
+import secrets
+import socket
+import ssl
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from auth import CredentialStore
+from coalesce import WRITER_IDLE
+from common import encode_json
+from filestore import text_digest
+from presence import ROSTER_WINDOW
+
+PORT = 5096
+USERS = 20                  # comptes partagés par les clients simulés
+ROOMS = 8
+MAX_MSGS = 10               # MSG par session (1 à MAX_MSGS)
+MAX_FILE = 64 * 1024        # taille max des FILE envoyés
+FILE_NAMES = 16             # noms réutilisés: les fichiers stockés ne s'accumulent pas sur le disque
+REPLY_TIMEOUT = 30
+
+# Fin de session: probabilités (le reste = fermeture propre)
+EARLY_CLOSE = 0.05          # fermeture avant la réponse au LOGIN
+ABRUPT_CLOSE = 0.15         # RST sans lire ce qui reste
+STALL_CLOSE = 0.05          # ne lit plus pendant STALL_SECONDS puis ferme
+STALL_SECONDS = 2.0
+
+# Seuils (dernière mesure au calme - mesure de référence)
+MAX_RSS_GROWTH = 32 * 2**20
+MAX_TRACED_GROWTH = 8 * 2**20
+MAX_THREAD_GROWTH = 2
+MAX_FD_GROWTH = 4
+# métriques qui doivent revenir à leur valeur de référence (tables de routage)
+SETTLED_METRICS = ("chat_clients_connected", "chat_keepalive_tracked", "chat_rooms", "chat_roster_users")
+
+work_dir = tempfile.mkdtemp()
+
+
+def make_certificate():
+    """Certificat auto-signé pour 127.0.0.1 (openssl); à défaut, ceux de ../certs."""
+    cert, key = os.path.join(work_dir, "soak.crt"), os.path.join(work_dir, "soak.key")
+    try:
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                        "-keyout", key, "-out", cert, "-subj", "/CN=127.0.0.1",
+                        "-addext", "subjectAltName=IP:127.0.0.1"],
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return cert, key, cert
+    except (OSError, subprocess.CalledProcessError):
+        return os.path.abspath("../certs/server.crt"), os.path.abspath("../certs/server.key"), "rootCA.crt"
+
+
+def proc_usage(pid):
+    """(VmRSS en octets, threads, descripteurs ouverts) du processus pid."""
+    rss = threads = 0
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1]) * 1024
+            elif line.startswith("Threads:"):
+                threads = int(line.split()[1])
+    return rss, threads, len(os.listdir(f"/proc/{pid}/fd"))
+
+
+def stamped(data):
+    """Ajoute timestamp + nonce (anti-rejeu du serveur)."""
+    data["timestamp"] = time.time()
+    data["nonce"] = secrets.token_hex(8)
+    return encode_json(data)
+
+
+class SoakError(Exception):
+    pass
+
+
+class SimulatedClient:
+    def __init__(self, context, rng, stats):
+        self.context = context
+        self.rng = rng
+        self.stats = stats
+        self.sock = None
+        self.file = None
+
+    def connect(self):
+        self.sock = self.context.wrap_socket(socket.socket(), server_hostname="127.0.0.1")
+        self.sock.settimeout(REPLY_TIMEOUT)
+        self.sock.connect(("127.0.0.1", PORT))
+        self.file = self.sock.makefile("rb")
+
+    def send(self, data):
+        self.sock.sendall(stamped(data))
+
+    def wait(self, kind):
+        """Lit jusqu'à la réponse attendue (MSG des autres, ROSTER... ignorés)."""
+        while True:
+            line = self.file.readline()
+            if not line:
+                raise SoakError(f"connexion fermée en attendant {kind}")
+            msg = json.loads(line)
+            if msg["type"] == kind:
+                return msg
+            if msg["type"] == "ERR":
+                raise SoakError(f"ERR en attendant {kind}: {msg['message']}")
+
+    def close(self, abrupt=False):
+        if abrupt:
+            # SO_LINGER 0: RST au lieu de FIN, données non lues abandonnées
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        self.file.close()
+        self.sock.close()
+
+    def session(self):
+        rng = self.rng
+        self.connect()
+        user = f"soak{rng.randrange(USERS)}"
+        self.send({"type": "LOGIN", "username": user, "password": user})
+        end = rng.random()
+        if end < EARLY_CLOSE:
+            self.close(abrupt=True)
+            self.stats.add("early")
+            return
+        self.wait("OK")
+
+        room = f"soak{rng.randrange(ROOMS)}"
+        self.send({"type": "JOIN", "room": room})
+        self.wait("ACK")
+        for _ in range(rng.randint(1, MAX_MSGS)):
+            payload = "x" * rng.randrange(1, 512)
+            if rng.random() < 0.5:
+                self.send({"type": "MSG", "payload": payload, "room": room})
+            else:
+                self.send({"type": "MSG", "payload": payload})
+            self.wait("ACK")
+            self.stats.add("messages")
+
+        if rng.random() < 0.3:
+            name = f"soak_{rng.randrange(FILE_NAMES)}.txt"
+            text = secrets.token_hex(rng.randrange(1, MAX_FILE) // 2)
+            size, sha256 = text_digest(text)
+            self.send({"type": "FILE", "filename": name, "payload": text, "sha256": sha256})
+            self.wait("ACK_FILE")
+            self.stats.add("files")
+            if rng.random() < 0.7:
+                self.sock.sendall(encode_json({"type": "FILE_GET", "filename": name}))
+                while True:
+                    header = self.wait("FILE_DATA")
+                    if len(self.file.read(header["length"])) != header["length"]:
+                        raise SoakError("FILE_DATA tronqué")
+                    if header["last"]:
+                        break
+                self.stats.add("downloads")
+
+        end -= EARLY_CLOSE
+        if end < ABRUPT_CLOSE:
+            self.close(abrupt=True)
+            self.stats.add("abrupt")
+        elif end < ABRUPT_CLOSE + STALL_CLOSE:
+            time.sleep(STALL_SECONDS)
+            self.close(abrupt=True)
+            self.stats.add("stalled")
+        else:
+            self.close()
+        self.stats.add("sessions")
+
+
+class Admin:
+    """Connexion d'admin gardée pendant tout l'essai: STATS et MEMORY."""
+
+    def __init__(self, context):
+        self.sock = context.wrap_socket(socket.socket(), server_hostname="127.0.0.1")
+        self.sock.connect(("127.0.0.1", PORT))
+        self.file = self.sock.makefile("rb")
+        self.replies = queue.Queue()
+        self.sock.sendall(stamped({"type": "LOGIN", "username": "soak0", "password": "soak0"}))
+        threading.Thread(target=self._reader, daemon=True).start()
+        self.request({"type": "PING"}, "PONG")
+
+    def _reader(self):
+        # les broadcasts des clients simulés arrivent aussi ici: lus et ignorés
+        for line in self.file:
+            msg = json.loads(line)
+            if msg["type"] in ("STATS", "MEMORY", "PONG", "ERR"):
+                self.replies.put(msg)
+
+    def request(self, data, kind):
+        self.sock.sendall(encode_json(data))
+        reply = self.replies.get(timeout=120)
+        if reply["type"] != kind:
+            raise SoakError(f"{data['type']}: {reply}")
+        return reply
+
+    def metrics(self):
+        return self.request({"type": "STATS"}, "STATS")["metrics"]
+
+    def memory(self, action="top", limit=10):
+        return self.request({"type": "MEMORY", "action": action, "limit": limit}, "MEMORY")
+
+
+def run_clients(context, count, seconds, seed, stats):
+    """count clients simulés en boucle pendant seconds, puis attente de leur fin."""
+    deadline = time.monotonic() + seconds
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        while time.monotonic() < deadline:
+            client = SimulatedClient(context, rng, stats)
+            try:
+                client.session()
+            except (OSError, ValueError, SoakError) as e:
+                stats.add("errors")
+                if stats["errors"] <= 10:
+                    print(f"  [!] client {index}: {e}")
+                if client.file is not None:
+                    client.close(abrupt=True)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+class Stats(collections.Counter):
+    """Compteurs partagés par les clients."""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def add(self, key):
+        with self._lock:
+            self[key] += 1
+
+
+def measure(pid, admin):
+    """Attend que le serveur soit au calme puis relève l'état."""
+    # threads d'écriture arrêtés après WRITER_IDLE, dernier ROSTER_DIFF publié
+    time.sleep(WRITER_IDLE + ROSTER_WINDOW + 2.0)
+    rss, threads, fds = proc_usage(pid)
+    memory = admin.memory()
+    metrics = admin.metrics()
+    return {"rss": rss, "threads": threads, "fds": fds, "traced": memory["traced_bytes"],
+            "connections": memory["connections"], "top": memory["top"],
+            "settled": {name: metrics.get(name) for name in SETTLED_METRICS}}
+
+
+def report(label, sample, base):
+    print(f"{label}: rss {sample['rss'] / 2**20:.1f} Mo ({(sample['rss'] - base['rss']) / 2**20:+.1f}), "
+          f"tracemalloc {sample['traced'] / 2**20:.1f} Mo ({(sample['traced'] - base['traced']) / 2**20:+.2f}), "
+          f"threads {sample['threads']} ({sample['threads'] - base['threads']:+d}), "
+          f"fds {sample['fds']} ({sample['fds'] - base['fds']:+d}), connexions {sample['connections']}")
+
+
+def verdict(last, base):
+    """Liste des seuils dépassés (vide = pas de fuite détectée)."""
+    failures = []
+    if last["rss"] - base["rss"] > MAX_RSS_GROWTH:
+        failures.append(f"mémoire résidente +{(last['rss'] - base['rss']) / 2**20:.1f} Mo")
+    if last["traced"] - base["traced"] > MAX_TRACED_GROWTH:
+        failures.append(f"tracemalloc +{(last['traced'] - base['traced']) / 2**20:.1f} Mo")
+    if last["threads"] - base["threads"] > MAX_THREAD_GROWTH:
+        failures.append(f"threads +{last['threads'] - base['threads']}")
+    if last["fds"] - base["fds"] > MAX_FD_GROWTH:
+        failures.append(f"descripteurs +{last['fds'] - base['fds']}")
+    if last["connections"] != base["connections"]:
+        failures.append(f"connexions {base['connections']} -> {last['connections']}")
+    for name in SETTLED_METRICS:
+        if last["settled"][name] != base["settled"][name]:
+            failures.append(f"{name} {base['settled'][name]} -> {last['settled'][name]}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Essai d'endurance du serveur V3 (fuites)")
+    parser.add_argument("--duration", type=float, default=3600, help="durée de l'essai en secondes")
+    parser.add_argument("--clients", type=int, default=50, help="clients simulés en parallèle")
+    parser.add_argument("--checkpoint", type=float, default=300, help="secondes entre deux mesures au calme")
+    parser.add_argument("--warmup", type=float, default=60, help="chauffe avant la mesure de référence")
+    parser.add_argument("--frames", type=int, default=4, help="profondeur de pile tracemalloc (0 = sans)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    cert, key, cafile = make_certificate()
+    context = ssl.create_default_context(cafile=cafile)
+    # serveur lancé dans un dossier temporaire: son propre users.json, outbox, fichiers reçus...
+    store = CredentialStore(os.path.join(work_dir, "users.json"))
+    for i in range(USERS):
+        store.set_password(f"soak{i}", f"soak{i}")
+    config = os.path.join(work_dir, "server.json")
+    with open(config, "w") as f:
+        json.dump({"port": PORT, "metrics_port": 0, "log_level": "WARNING", "cert_file": cert, "key_file": key,
+                   "tracemalloc_frames": args.frames}, f)
+    server = subprocess.Popen([sys.executable, os.path.abspath("server.py"), config], cwd=work_dir,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    stats = Stats()
+    try:
+        time.sleep(1.0)
+        admin = Admin(context)
+        print(f"chauffe: {args.warmup:.0f} s, {args.clients} clients")
+        run_clients(context, args.clients, args.warmup, args.seed, stats)
+        admin.memory("mark")
+        base = measure(server.pid, admin)
+        report("référence", base, base)
+
+        started = time.monotonic()
+        phase = 0
+        last = base
+        while time.monotonic() - started < args.duration:
+            phase += 1
+            seconds = min(args.checkpoint, args.duration - (time.monotonic() - started))
+            run_clients(context, args.clients, seconds, args.seed + phase, stats)
+            if server.poll() is not None:
+                raise SoakError(f"serveur arrêté (code {server.returncode})")
+            last = measure(server.pid, admin)
+            print(f"  {stats['sessions']} sessions, {stats['messages']} MSG, {stats['files']} FILE, "
+                  f"{stats['downloads']} FILE_GET, fermetures: {stats['early']} avant OK, "
+                  f"{stats['abrupt']} brutales, {stats['stalled']} bloquées, {stats['errors']} erreurs")
+            report(f"t+{time.monotonic() - started:.0f}s", last, base)
+
+        if last["top"]:
+            print("allocations qui ont le plus grossi depuis la référence:")
+            for entry in last["top"]:
+                print(f"  {entry['size_diff'] / 1024:+10.1f} Ko {entry['count_diff']:+8d} blocs  {entry['where']}")
+        failures = verdict(last, base)
+        if failures:
+            print("ÉCHEC: " + "; ".join(failures))
+            sys.exit(1)
+        print("OK: pas de croissance au-delà des seuils")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
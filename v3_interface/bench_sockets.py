@@ -0,0 +1,175 @@
+# bench_sockets.py
+# Effet des réglages de sockets (sockopts.py) sur le serveur V3.
+#
+# Trois mesures, chacune avec le réglage d'origine puis le nouveau:
+# - TCP_NODELAY: latence MSG -> ACK (le serveur écrit 2 lignes: MSG relayé puis ACK)
+# - LISTEN_BACKLOG: rafale de connexions simultanées (durée connexion + handshake TLS)
+# - SEND_BUFFER / RECV_BUFFER: débit d'un flux de MSG de 1 Ko
+# (TCP_KEEPALIVE n'a pas d'effet mesurable ici: il ne sert qu'à détecter un pair disparu)
+#
+# À lancer depuis v3_interface/ (certificats dans ../certs, rootCA.crt dans ce dossier).
+# Usage: python bench_sockets.py [connexions_rafale] [messages_flux]
+
+import importlib
+import os
+import secrets
+import socket
+import ssl
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import server
+import sockopts
+from auth import CredentialStore
+from common import encode_json
+
+PORT = 5099
+work_dir = tempfile.mkdtemp()
+users_file = os.path.join(work_dir, "users.json")
+client_context = ssl.create_default_context(cafile="rootCA.crt")
+
+
+def start_server(**settings):
+    """Serveur V3 frais (module rechargé) avec les réglages donnés."""
+    importlib.reload(server)
+    server.PORT = PORT
+    server.METRICS_PORT = 0
+    server.LOG_LEVEL = "WARNING"
+    server.DRAIN_TIMEOUT = 1
+    server.CONFIG_FILE = os.path.join(work_dir, "absent.json")   # pas de server.json local
+    server.credentials = CredentialStore(users_file)
+    for name, value in settings.items():
+        setattr(server, name, value)
+    thread = threading.Thread(target=server.main, daemon=True)
+    thread.start()
+    time.sleep(0.3)
+    return thread
+
+
+def stop_server(thread):
+    server.request_shutdown("bench")
+    thread.join()
+
+
+def open_client(nodelay=True, send_buffer=0, recv_buffer=0, login=True):
+    raw = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sockopts.tune(raw, nodelay=nodelay, keepalive=False, send_buffer=send_buffer, recv_buffer=recv_buffer)
+    sock = client_context.wrap_socket(raw, server_hostname="127.0.0.1")
+    sock.connect(("127.0.0.1", PORT))
+    sock_file = sock.makefile("rb")
+    if login:
+        sock.sendall(encode_json({"type": "LOGIN", "username": "bench", "password": "bench",
+                                  "timestamp": time.time(), "nonce": secrets.token_hex(8)}))
+        sock_file.readline()
+    return sock, sock_file
+
+
+def msg(payload):
+    return encode_json({"type": "MSG", "to_ip": "*", "payload": payload,
+                        "timestamp": time.time(), "nonce": secrets.token_hex(8)})
+
+
+# ---------------------------------------------------------------------
+# 1) TCP_NODELAY
+# ---------------------------------------------------------------------
+def bench_nodelay(nodelay, rounds=200):
+    thread = start_server(TCP_NODELAY=nodelay)
+    sock, sock_file = open_client(nodelay=nodelay)
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        sock.sendall(msg("ping"))
+        sock_file.readline()   # MSG relayé (on est aussi destinataire du broadcast)
+        sock_file.readline()   # ACK
+        samples.append(time.perf_counter() - start)
+    sock.close()
+    stop_server(thread)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+# ---------------------------------------------------------------------
+# 2) LISTEN_BACKLOG
+# ---------------------------------------------------------------------
+def bench_backlog(backlog, count):
+    thread = start_server(LISTEN_BACKLOG=backlog)
+    barrier = threading.Barrier(count)
+    durations = []
+    socks = []
+    lock = threading.Lock()
+
+    def connect():
+        barrier.wait()
+        start = time.perf_counter()
+        try:
+            s, _ = open_client(login=False)
+        except OSError:
+            return
+        with lock:
+            durations.append(time.perf_counter() - start)
+            socks.append(s)
+
+    workers = [threading.Thread(target=connect) for _ in range(count)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    for s in socks:
+        s.close()
+    stop_server(thread)
+    durations.sort()
+    return len(durations), statistics.median(durations), durations[int(len(durations) * 0.99) - 1], durations[-1]
+
+
+# ---------------------------------------------------------------------
+# 3) SEND_BUFFER / RECV_BUFFER
+# ---------------------------------------------------------------------
+def bench_buffers(size, count):
+    thread = start_server(SEND_BUFFER=size, RECV_BUFFER=size)
+    sock, sock_file = open_client(send_buffer=size, recv_buffer=size)
+    payload = "x" * 1024
+
+    def reader():
+        for _ in range(count * 2):   # MSG relayé + ACK pour chaque envoi
+            sock_file.readline()
+
+    t = threading.Thread(target=reader)
+    start = time.perf_counter()
+    t.start()
+    for _ in range(count):
+        sock.sendall(msg(payload))   # nonce différent à chaque message (anti-rejeu)
+    t.join()
+    elapsed = time.perf_counter() - start
+    sock.close()
+    stop_server(thread)
+    return count / elapsed
+
+
+def main():
+    burst = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    CredentialStore(users_file).set_password("bench", "bench")
+
+    print("TCP_NODELAY: latence MSG -> ACK (200 allers-retours)")
+    for nodelay in (False, True):
+        p50, p99 = bench_nodelay(nodelay)
+        print(f"  nodelay={str(nodelay):<5}  p50 {p50 * 1000:7.2f} ms   p99 {p99 * 1000:7.2f} ms")
+
+    print(f"LISTEN_BACKLOG: {burst} connexions TLS simultanées")
+    for backlog in (5, 128):
+        ok, p50, p99, worst = bench_backlog(backlog, burst)
+        print(f"  backlog={backlog:<4}  {ok}/{burst} ok   p50 {p50 * 1000:7.1f} ms   "
+              f"p99 {p99 * 1000:7.1f} ms   max {worst * 1000:7.1f} ms")
+
+    print(f"SEND_BUFFER / RECV_BUFFER: flux de {count} MSG de 1 Ko")
+    for size in (4096, 0):
+        rate = bench_buffers(size, count)
+        label = f"{size} o" if size else "défaut"
+        print(f"  tampons {label:<8}  {rate:8.0f} msg/s")
+
+
+if __name__ == "__main__":
+    main()
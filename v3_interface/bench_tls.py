@@ -0,0 +1,173 @@
+# bench_tls.py
+# Coût des handshakes et débit chiffré selon la configuration TLS
+# (type de clé du certificat, version, suite, courbe ECDHE).
+#
+# Génère des certificats jetables (CA + serveur RSA 2048 + serveur ECDSA P-256)
+# avec la commande openssl, dans un dossier temporaire, puis pour chaque
+# configuration mesure:
+# - handshakes complets par seconde (sans reprise de session), client et serveur
+#   dans ce processus, sur 127.0.0.1
+# - temps CPU du handshake côté serveur
+# - débit d'un transfert de données après le handshake (Mo/s)
+#
+# Usage: python bench_tls.py [handshakes] [mega_octets]
+
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from tlsconf import apply_tls_settings
+
+CONFIGS = [
+    # nom, clé, version TLS, suites TLS 1.2, courbe imposée par le serveur
+    ("RSA-2048   TLS1.2 AES128-GCM", "rsa", "TLSv1.2", "ECDHE-RSA-AES128-GCM-SHA256", None),
+    ("RSA-2048   TLS1.3", "rsa", "TLSv1.3", None, None),
+    ("ECDSA-P256 TLS1.2 AES128-GCM", "ec", "TLSv1.2", "ECDHE-ECDSA-AES128-GCM-SHA256", None),
+    ("ECDSA-P256 TLS1.2 CHACHA20", "ec", "TLSv1.2", "ECDHE-ECDSA-CHACHA20-POLY1305", None),
+    ("ECDSA-P256 TLS1.2 AES128 P-256", "ec", "TLSv1.2", "ECDHE-ECDSA-AES128-GCM-SHA256", "prime256v1"),
+    ("ECDSA-P256 TLS1.3", "ec", "TLSv1.3", None, None),
+    # le client propose X25519 d'emblée: imposer P-256 coûte un aller-retour (HelloRetryRequest)
+    ("ECDSA-P256 TLS1.3 P-256", "ec", "TLSv1.3", None, "prime256v1"),
+]
+
+
+def openssl(*args, cwd):
+    subprocess.run(["openssl", *args], cwd=cwd, check=True, capture_output=True)
+
+
+def make_certs(directory):
+    """CA ECDSA + certificats serveur RSA et ECDSA pour 127.0.0.1 / localhost."""
+    with open(os.path.join(directory, "ext.cnf"), "w") as f:
+        f.write("subjectAltName=IP:127.0.0.1,DNS:localhost\n")
+    openssl("req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1", "-nodes",
+            "-keyout", "ca.key", "-out", "ca.crt", "-days", "1", "-subj", "/CN=bench-ca", cwd=directory)
+    keys = {"rsa": ["rsa:2048"], "ec": ["ec", "-pkeyopt", "ec_paramgen_curve:prime256v1"]}
+    for name, newkey in keys.items():
+        openssl("req", "-new", "-newkey", *newkey, "-nodes", "-keyout", f"{name}.key", "-out", f"{name}.csr",
+                "-subj", "/CN=localhost", cwd=directory)
+        openssl("x509", "-req", "-in", f"{name}.csr", "-CA", "ca.crt", "-CAkey", "ca.key", "-CAcreateserial",
+                "-out", f"{name}.crt", "-days", "1", "-extfile", "ext.cnf", cwd=directory)
+
+
+class BenchServer:
+    """Serveur TLS minimal: handshake, puis lit tout ce que le client envoie."""
+
+    def __init__(self, context):
+        self.context = context
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(128)
+        self.port = self.listener.getsockname()[1]
+        self.handshake_cpu = 0.0
+        self.handshakes = 0
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            start = time.thread_time()
+            try:
+                tls = self.context.wrap_socket(conn, server_side=True)
+            except (ssl.SSLError, OSError):
+                conn.close()
+                continue
+            self.handshake_cpu += time.thread_time() - start
+            self.handshakes += 1
+            threading.Thread(target=self._drain, args=(tls,), daemon=True).start()
+
+    @staticmethod
+    def _drain(tls):
+        try:
+            while tls.recv(256 * 1024):
+                pass
+        except (ssl.SSLError, OSError):
+            pass
+        tls.close()
+
+    def close(self):
+        self.listener.close()
+
+
+def connect(client_context, port):
+    raw = socket.create_connection(("127.0.0.1", port))
+    raw.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return client_context.wrap_socket(raw, server_hostname="localhost")
+
+
+def run_config(directory, key, version, ciphers, curve, handshakes, megabytes):
+    server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    apply_tls_settings(server_context, version, ciphers, curve)
+    server_context.load_cert_chain(os.path.join(directory, f"{key}.crt"), os.path.join(directory, f"{key}.key"))
+
+    # un nouveau contexte client par config, sans reprise de session: handshakes complets
+    client_context = ssl.create_default_context(cafile=os.path.join(directory, "ca.crt"))
+    apply_tls_settings(client_context, version, ciphers)
+    # version minimale côté serveur, maximale côté client: la version est imposée
+    client_context.maximum_version = client_context.minimum_version
+
+    server = BenchServer(server_context)
+    try:
+        # tour de chauffe
+        connect(client_context, server.port).close()
+        server.handshake_cpu, server.handshakes = 0.0, 0
+
+        start = time.perf_counter()
+        for _ in range(handshakes):
+            tls = connect(client_context, server.port)
+            tls.close()
+        rate = handshakes / (time.perf_counter() - start)
+        # laisse le serveur finir de compter le dernier handshake
+        time.sleep(0.05)
+        server_cpu = server.handshake_cpu / max(server.handshakes, 1)
+
+        tls = connect(client_context, server.port)
+        version, cipher = tls.version(), tls.cipher()[0]
+        block = b"x" * (256 * 1024)
+        total = megabytes * 1024 * 1024
+        start = time.perf_counter()
+        sent = 0
+        while sent < total:
+            tls.sendall(block)
+            sent += len(block)
+        tls.close()
+        throughput = sent / (time.perf_counter() - start) / 1e6
+    finally:
+        server.close()
+    return rate, server_cpu, throughput, version, cipher
+
+
+def main():
+    handshakes = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    megabytes = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+
+    if shutil.which("openssl") is None:
+        print("[!] commande openssl introuvable (nécessaire pour générer les certificats)")
+        sys.exit(1)
+
+    directory = tempfile.mkdtemp(prefix="bench_tls_")
+    try:
+        make_certs(directory)
+        print(f"{handshakes} handshakes complets par config, transfert de {megabytes} Mo "
+              f"({ssl.OPENSSL_VERSION})")
+        print(f"  {'configuration':<30} {'handshakes/s':>12} {'CPU serveur':>12} {'débit':>10}  négocié")
+        for name, key, version, ciphers, curve in CONFIGS:
+            rate, server_cpu, throughput, negotiated, cipher = run_config(
+                directory, key, version, ciphers, curve, handshakes, megabytes)
+            print(f"  {name:<30} {rate:>12.0f} {server_cpu * 1000:>9.2f} ms {throughput:>6.0f} Mo/s"
+                  f"  {negotiated} {cipher}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
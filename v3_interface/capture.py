@@ -0,0 +1,136 @@
+# capture.py
+# Enregistrement du trafic reçu par le serveur, pour le rejouer ensuite
+# contre un serveur local (voir traffic.py).
+#
+# - Messages déjà décodés (dict), par connexion, avec l'instant de réception
+# - Fichier compact: lignes JSON compressées en gzip
+#       1re ligne : {"capture": 1, "server": "v3", "started": <epoch>}
+#       puis      : [t, id, "open", ip]   1er message de la connexion id
+#                   [t, id, {message}]    message reçu
+#                   [t, id, "close"]      connexion fermée
+#   t = secondes depuis le début de l'enregistrement
+# - Mots de passe / secrets remplacés par "" (traffic.py met celui des comptes de test)
+# - Écriture dans un thread dédié via une file bornée, comme logs.py: le thread
+#   réseau ne fait qu'une copie du dict; file pleine = message perdu (et compté)
+
+import atexit
+import gzip
+import itertools
+import json
+import queue
+import threading
+import time
+
+CAPTURE_FORMAT = 1
+CAPTURE_QUEUE_SIZE = 50000    # messages en attente d'écriture max avant abandon
+FLUSH_INTERVAL = 1.0          # secondes max avant que les lignes en attente soient sur disque
+REDACTED_FIELDS = ("password", "secret")
+SKIPPED_TYPES = {"PEER", "FED"}   # liens entre nœuds (V3): pas du trafic client
+
+
+class TrafficRecorder:
+    """Enregistre les messages reçus dans path (gzip)."""
+
+    def __init__(self, path, server=""):
+        self.path = path
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._file.write(json.dumps({"capture": CAPTURE_FORMAT, "server": server, "started": time.time()}) + "\n")
+        self._start = time.perf_counter()
+        self._queue = queue.Queue(CAPTURE_QUEUE_SIZE)
+        self._ids = {}   # session -> numéro de connexion dans la capture
+        self._next_id = itertools.count(1)
+        self._closed = False
+        self.recorded = 0
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._writer, name="capture", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _put(self, row):
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+
+    def record(self, session, msg):
+        """Message reçu sur la connexion de session (thread réseau: ne bloque jamais)."""
+        if type(msg) is dict and msg.get("type") in SKIPPED_TYPES:
+            return
+        now = time.perf_counter() - self._start
+        conn_id = self._ids.get(session)
+        if conn_id is None:
+            conn_id = self._ids[session] = next(self._next_id)
+            self._put((now, conn_id, "open", session.addr[0]))
+        # copie: le dispatcher complète ensuite le message avec les valeurs par défaut
+        self._put((now, conn_id, dict(msg) if type(msg) is dict else msg))
+
+    def closed(self, session):
+        """Fin de la connexion de session (rien si elle n'a rien envoyé)."""
+        conn_id = self._ids.pop(session, None)
+        if conn_id is not None:
+            self._put((time.perf_counter() - self._start, conn_id, "close"))
+
+    def _writer(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                row = self._queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                row = ()
+            if row is None:
+                break
+            if row:
+                t, conn_id, item, *rest = row
+                if type(item) is dict:
+                    for field in REDACTED_FIELDS:
+                        if field in item:
+                            item[field] = ""
+                self._file.write(json.dumps([round(t, 6), conn_id, item, *rest], separators=(",", ":")) + "\n")
+                self.recorded += type(item) is not str
+            if time.monotonic() - last_flush >= FLUSH_INTERVAL:
+                self._file.flush()
+                last_flush = time.monotonic()
+        self._file.close()
+
+    def close(self):
+        """Écrit ce qui reste dans la file puis ferme le fichier."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+
+def read_capture(path):
+    """
+    Relit une capture. Retourne (en-tête, connexions), chaque connexion étant
+    {"id", "ip", "start", "end", "messages": [(t, message), ...]}, triées par start.
+    Une capture coupée (serveur arrêté brutalement) est lue jusqu'à la dernière ligne complète.
+    """
+    connections = {}
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("capture") != CAPTURE_FORMAT:
+            raise ValueError(f"format de capture inconnu: {header.get('capture')}")
+        try:
+            for line in f:
+                try:
+                    t, conn_id, item, *rest = json.loads(line)
+                except ValueError:
+                    break
+                conn = connections.get(conn_id)
+                if item == "open":
+                    connections[conn_id] = {"id": conn_id, "ip": rest[0], "start": t, "end": None, "messages": []}
+                elif conn is None:
+                    continue
+                elif item == "close":
+                    conn["end"] = t
+                else:
+                    conn["messages"].append((t, item))
+        except (EOFError, OSError):
+            pass
+    result = sorted(connections.values(), key=lambda c: c["start"])
+    for conn in result:
+        if conn["end"] is None:
+            conn["end"] = conn["messages"][-1][0] if conn["messages"] else conn["start"]
+    return header, result
@@ -1,7 +1,17 @@
 # client_network.py
 # Couche réseau TLS (pas d'UI ici).
 # Envoie/recevra JSON via TLS et expose des méthodes propres pour l'interface.
+#
+# Reconnexion automatique: si la connexion tombe (ou si le serveur annonce
+# SERVER_CLOSING), le thread de réception se reconnecte avec un délai
+# exponentiel tiré au hasard (full jitter: uniform(0, plafond)), pour que tous
+# les clients ne reviennent pas au même instant après un redémarrage du serveur.
+# Les MSG / FILE envoyés pendant la coupure sont gardés dans un tampon borné
+# et envoyés (dans l'ordre) dès que le LOGIN est de nouveau accepté.
 
+import collections
+import hashlib
+import random
 import ssl
 import socket
 import threading
@@ -10,56 +20,236 @@ import secrets
 import os
 
 from common import send_json, recv_json
+from delta import DELTA_ERROR_PREFIX, compute_delta
+from filestore import safe_filename
+import sockopts
+from tlsconf import apply_tls_settings
+
+RECONNECT_BASE = 0.5     # plafond (s) du 1er délai de reconnexion
+RECONNECT_MAX = 30       # plafond max (s) du délai de reconnexion
+SEND_BUFFER_MAX = 500    # MSG / FILE gardés au maximum pendant une coupure
+DOWNLOAD_CHUNK = 256 * 1024  # lecture des octets d'une trame FILE_DATA par blocs
+FILE_READ_CHUNK = 64 * 1024  # caractères lus (et hachés) à la fois par send_file
+DELTA_MAX_RATIO = 0.5    # au-delà de cette part d'octets nouveaux, FILE entier plutôt que FILE_DELTA
 
 
 class SecureClient:
-    def __init__(self, host, port, username, log_callback):
+    def __init__(self, host, port, username, log_callback, password="", certfile=None, keyfile=None,
+                 sock_options=None, tls_settings=None):
         self.host = host
         self.port = port
         self.username = username
+        self.password = password
         self.log = log_callback
 
         self.sock = None
         self.sock_file = None
 
+        # réglages TCP (arguments de sockopts.tune: nodelay, keepalive, send_buffer...)
+        self.sock_options = sock_options or {}
+
+        # nombre de messages d'historique demandés à la connexion (0 = aucun)
+        self.history_on_connect = 20
+
         # CA de confiance (dans v3_interface, rootCA.crt est dans le même dossier que ce script)
         self.context = ssl.create_default_context(cafile="rootCA.crt")
 
+        # réglages TLS (arguments de tlsconf.apply_tls_settings: min_version, ciphers, curve)
+        if tls_settings:
+            apply_tls_settings(self.context, **tls_settings)
+
+        # Certificat client (optionnel): le serveur nous authentifie pendant le
+        # handshake (CN = nom d'utilisateur), sans LOGIN par mot de passe
+        self.use_cert = certfile is not None
+        if self.use_cert:
+            self.context.load_cert_chain(certfile=certfile, keyfile=keyfile)
+
+        # session TLS gardée pour la reprise à la reconnexion (handshake abrégé)
+        self.session = None
+
+        # Reconnexion automatique
+        self.auto_reconnect = True
+        self.logged_in = False            # LOGIN accepté sur la connexion actuelle
+        self._stop = threading.Event()    # close() explicite: pas de reconnexion
+        self._reconnect_hint = None       # délai max conseillé par SERVER_CLOSING
+        self._reconnect_attempt = 0       # tentatives depuis le dernier LOGIN accepté (délai exponentiel)
+        self._last_msg_time = None        # server_time du dernier MSG reçu (historique manqué)
+
+        # Salons rejoints (de nouveau rejoints après une reconnexion)
+        self.rooms = set()
+
+        # Utilisateurs en ligne: set de (ip, utilisateur), tenu à jour par ROSTER
+        # (photo) puis ROSTER_DIFF; on_roster(joined, left) reçoit seulement les
+        # changements (l'interface n'a jamais à tout redessiner)
+        self.roster = set()
+        self.roster_version = None
+        self.on_roster = None
+
+        # Envois différentiels en cours (voir delta.py): nom -> chemin local
+        self._deltas = {}
+
+        # Téléchargements FILE_GET: nom -> (offset attendu, SHA-256 en cours), pour
+        # vérifier le fichier complet sans le relire (trames reçues dans l'ordre depuis 0)
+        self._downloads = {}
+
+        # Tampon d'envoi: messages sans timestamp / nonce (ajoutés à l'envoi réel,
+        # sinon le serveur refuserait un message resté trop longtemps en attente)
+        self._pending = collections.deque()
+        self._send_lock = threading.Lock()
+
+    # -----------------------------------------------------------------
+    # Connexion
+    # -----------------------------------------------------------------
     def connect(self):
+        self._stop.clear()
+        self._open()
+
+        # thread réception (et reconnexion)
+        threading.Thread(target=self.listen_loop, daemon=True).start()
+
+    def _open(self):
         # 1) socket TCP brute
         raw_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sockopts.tune(raw_sock, **self.sock_options)
 
         # 2) encapsulation TLS + vérification SAN/cert
-        self.sock = self.context.wrap_socket(
+        # (session reprise si possible, sinon handshake complet)
+        sock = self.context.wrap_socket(
             raw_sock,
-            server_hostname=self.host
+            server_hostname=self.host,
+            session=self.session
         )
 
         # 3) connexion (TCP + handshake TLS)
-        self.sock.connect((self.host, self.port))
+        try:
+            sock.connect((self.host, self.port))
+        except Exception:
+            sock.close()
+            raise
+        self.sock = sock
 
-        # 4) flux de lecture ligne-par-ligne
-        self.sock_file = self.sock.makefile("r", encoding="utf-8", newline="\n")
+        # 4) flux de lecture ligne-par-ligne, binaire: les trames FILE_DATA
+        # (téléchargements) sont suivies d'octets bruts lus tels quels
+        self.sock_file = self.sock.makefile("rb")
 
-        # 5) LOGIN
-        login = {
-            "type": "LOGIN",
-            "username": self.username,
-            "password": "password123",
-            "timestamp": time.time(),
-            "nonce": secrets.token_hex(8)
-        }
-        send_json(self.sock, login)
+        # 5) LOGIN (inutile avec un certificat: le serveur envoie OK dès le handshake)
+        if not self.use_cert:
+            login = {
+                "type": "LOGIN",
+                "username": self.username,
+                "password": self.password,
+                "timestamp": time.time(),
+                "nonce": secrets.token_hex(8)
+            }
+            send_json(self.sock, login)
 
-        # 6) thread réception
-        threading.Thread(target=self.listen_loop, daemon=True).start()
+        # 6) derniers messages échangés avant notre arrivée (ou manqués pendant la coupure)
+        if self.history_on_connect:
+            history = {
+                "type": "HISTORY",
+                "target": "*",
+                "limit": self.history_on_connect
+            }
+            if self._last_msg_time is not None:
+                history["since"] = self._last_msg_time
+            send_json(self.sock, history)
 
+    def close(self):
+        """Ferme la connexion (le thread de réception s'arrête, pas de reconnexion)."""
+        self._stop.set()
+        self._close_socket()
+
+    def _close_socket(self):
+        # shutdown d'abord: débloque un readline() en cours dans le thread de réception
+        # (sinon sock_file.close() attendrait la fin de cette lecture)
+        try:
+            if self.sock is not None:
+                self.sock.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+        for obj in (self.sock_file, self.sock):
+            try:
+                if obj is not None:
+                    obj.close()
+            except Exception:
+                pass
+
+    def _on_login(self):
+        """LOGIN accepté: on rejoint les salons puis on vide le tampon d'envoi."""
+        # les tickets de session TLS 1.3 arrivent après le handshake: on garde
+        # la session maintenant pour la prochaine reconnexion
+        self.session = self.sock.session
+
+        sent = 0
+        with self._send_lock:
+            try:
+                for room in sorted(self.rooms):
+                    send_json(self.sock, {"type": "JOIN", "room": room})
+                while self._pending:
+                    send_json(self.sock, self._stamp(self._pending[0]))
+                    self._pending.popleft()
+                    sent += 1
+                # envois différentiels interrompus (FILE_SIG ou ACK perdu avec la connexion):
+                # delta recalculé sur la copie actuelle du serveur
+                for name in list(self._deltas):
+                    send_json(self.sock, {"type": "FILE_SIG", "filename": name})
+            except OSError:
+                # connexion de nouveau perdue: le reste du tampon attend la suivante
+                return
+            self.logged_in = True
+            self._reconnect_attempt = 0
+        if sent:
+            self.log(f"[*] {sent} message(s) en attente envoyé(s)")
+
+    def _reconnect(self):
+        """
+        Reconnexion avec délai exponentiel + jitter. Retourne False si close() a été appelé.
+        Le nombre de tentatives n'est remis à zéro qu'après un LOGIN accepté: un refus
+        après connexion (ERR "server busy", coupure juste après LOGIN) allonge aussi le délai.
+        """
+        hint, self._reconnect_hint = self._reconnect_hint, None
+        while not self._stop.is_set():
+            ceiling = hint or min(RECONNECT_MAX, RECONNECT_BASE * 2 ** self._reconnect_attempt)
+            hint = None
+            self._reconnect_attempt += 1
+            delay = random.uniform(0, ceiling)
+            self.log(f"[*] Reconnexion dans {delay:.1f} s")
+            if self._stop.wait(delay):
+                return False
+            try:
+                self._open()
+                self.log("[+] Reconnecté au serveur")
+                return True
+            except OSError as e:
+                self.log(f"[!] Reconnexion impossible ({e})")
+        return False
+
+    # -----------------------------------------------------------------
+    # Réception
+    # -----------------------------------------------------------------
     def listen_loop(self):
         while True:
-            msg = recv_json(self.sock_file)
-            if msg is None:
+            try:
+                self._receive()
+            except (OSError, ValueError):
+                # connexion coupée (ou dernière ligne tronquée par la coupure)
+                pass
+            with self._send_lock:
+                self.logged_in = False
+            self._close_socket()
+
+            if self._stop.is_set() or not self.auto_reconnect:
                 self.log("[!] Déconnecté du serveur")
                 break
+            if not self._reconnect():
+                break
+
+    def _receive(self):
+        """Traite les messages de la connexion actuelle; retourne quand elle est perdue."""
+        while True:
+            msg = recv_json(self.sock_file)
+            if msg is None:
+                return
 
             mtype = msg.get("type")
 
@@ -68,7 +258,12 @@ class SecureClient:
                 frm = msg.get("from", "unknown")
                 frm_ip = msg.get("from_ip", "?")
                 payload = msg.get("payload", "")
-                self.log(f"[{frm}@{frm_ip}] {payload}")
+                room = msg.get("room")
+                if room:
+                    self.log(f"[#{room}] [{frm}@{frm_ip}] {payload}")
+                else:
+                    self._last_msg_time = msg.get("server_time", self._last_msg_time)
+                    self.log(f"[{frm}@{frm_ip}] {payload}")
 
             elif mtype == "FILE_FROM":
                 # fichier relayé par le serveur (si tu utilises to_ip sur FILE)
@@ -77,33 +272,276 @@ class SecureClient:
                 filename = msg.get("filename", "file.txt")
                 content = msg.get("payload", "")
 
-                # on sauvegarde localement
-                outname = f"received_{filename}"
-                with open(outname, "w", encoding="utf-8") as f:
-                    f.write(content)
+                # on sauvegarde localement, en vérifiant la somme au fil de l'écriture
+                outname = f"received_{safe_filename(filename) or 'file.txt'}"
+                digest = hashlib.sha256()
+                with open(outname, "wb") as f:
+                    for i in range(0, len(content), FILE_READ_CHUNK):
+                        chunk = content[i:i + FILE_READ_CHUNK].encode("utf-8")
+                        digest.update(chunk)
+                        f.write(chunk)
+
+                expected = msg.get("sha256")
+                if expected is not None and digest.hexdigest() != expected:
+                    os.remove(outname)
+                    self.log(f"[!] Fichier {filename} de {frm}@{frm_ip} altéré (SHA-256 différente), ignoré")
+                else:
+                    self.log(f"[FILE] reçu de {frm}@{frm_ip} -> {outname}")
+
+            elif mtype == "FILE_DATA":
+                # morceau d'un fichier demandé par FILE_GET: "length" octets bruts suivent
+                self._save_file_data(msg)
+
+            elif mtype == "FILE_SIG":
+                # signature de la copie stockée: calcul du delta hors du thread de réception
+                path = self._deltas.get(msg.get("filename"))
+                if path is not None:
+                    threading.Thread(target=self._send_delta, args=(path, msg), daemon=True).start()
+
+            elif mtype == "FILE_LIST":
+                files = msg.get("files", [])
+                self.log(f"[FICHIERS] {len(files)} fichier(s) sur le serveur")
+                for item in files:
+                    self.log(f"    {item.get('filename')} ({item.get('size')} octets)")
 
-                self.log(f"[FILE] reçu de {frm}@{frm_ip} -> {outname}")
+            elif mtype == "PING":
+                # keepalive du serveur: on répond sinon il nous évince
+                with self._send_lock:
+                    send_json(self.sock, {
+                        "type": "PONG",
+                        "timestamp": time.time()
+                    })
 
-            elif mtype in ("ACK", "ACK_FILE", "OK", "ERR", "PONG"):
+            elif mtype == "SERVER_CLOSING":
+                # arrêt (ou redémarrage) du serveur: on part tout de suite pour qu'il
+                # n'ait pas à attendre l'échéance, et on revient plus tard
+                after = msg.get("reconnect_after") or RECONNECT_BASE
+                target = msg.get("reconnect_to")
+                if target:
+                    host, _, port = target.rpartition(":")
+                    self.host, self.port = host or self.host, int(port)
+                self._reconnect_hint = after
+                self.log(f"[SERVEUR] arrêt du serveur, reconnexion dans {after} s au plus")
+                return
+
+            elif mtype == "ROSTER":
+                self._apply_roster(msg)
+
+            elif mtype == "ROSTER_DIFF":
+                self._apply_roster_diff(msg)
+
+            elif mtype == "HISTORY":
+                # les MSG rejoués suivent cet en-tête et s'affichent normalement
+                self.log(f"[HISTORIQUE] {msg.get('count', 0)} message(s) précédent(s)")
+
+            elif mtype == "OK":
+                self.log(f"[SERVEUR] {msg}")
+                self._on_login()
+
+            elif mtype == "ERR" and not self.logged_in:
+                self.log(f"[SERVEUR] {msg}")
+                if msg.get("message") == "invalid credentials":
+                    # inutile de réessayer avec le même mot de passe
+                    self._stop.set()
+                    return
+                if msg.get("message") == "server busy, retry later":
+                    # LOGIN à refaire: reconnexion avec délai
+                    return
+
+            elif mtype == "ERR" and str(msg.get("message", "")).startswith(DELTA_ERROR_PREFIX):
+                # delta refusé ("delta <raison>: <nom>", copie stockée remplacée entre-temps...): fichier entier
+                path = self._deltas.pop(msg["message"].partition(": ")[2], None)
+                self.log(f"[SERVEUR] {msg}")
+                if path is not None:
+                    self._send_whole_file(path)
+
+            elif mtype == "ACK_FILE":
+                self._deltas.pop(msg.get("filename"), None)
+                self.log(f"[SERVEUR] {msg}")
+
+            elif mtype in ("ACK", "ERR", "PONG"):
                 self.log(f"[SERVEUR] {msg}")
 
             else:
                 self.log(f"[SERVEUR] {msg}")
 
-    def send_message(self, text, to_ip="*"):
+    @staticmethod
+    def _pairs(entries):
+        return {(e.get("ip"), e.get("user")) for e in entries if isinstance(e, dict)}
+
+    def _apply_roster(self, msg):
+        """Photo complète (connexion ou reconnexion): seul l'écart avec la liste actuelle est signalé."""
+        users = self._pairs(msg.get("users", []))
+        joined, left = users - self.roster, self.roster - users
+        self.roster = users
+        self.roster_version = msg.get("version")
+        self.log(f"[EN LIGNE] {len(users)} utilisateur(s)")
+        self._roster_changed(joined, left)
+
+    def _apply_roster_diff(self, msg):
+        version = msg.get("version")
+        if self.roster_version is None or version is None or version <= self.roster_version:
+            return   # pas encore de photo, ou diff déjà inclus dans la photo
+        if version != self.roster_version + 1:
+            # diff manqué: on redemande la photo complète
+            self.request_roster()
+            return
+        joined = self._pairs(msg.get("joined", [])) - self.roster
+        left = self._pairs(msg.get("left", [])) & self.roster
+        self.roster = (self.roster | joined) - left
+        self.roster_version = version
+        for ip, user in sorted(joined, key=str):
+            self.log(f"[EN LIGNE] + {user}@{ip}")
+        for ip, user in sorted(left, key=str):
+            self.log(f"[EN LIGNE] - {user}@{ip}")
+        self._roster_changed(joined, left)
+
+    def _roster_changed(self, joined, left):
+        if self.on_roster is not None and (joined or left):
+            self.on_roster(joined, left)
+
+    def _save_file_data(self, msg):
+        """Écrit une trame FILE_DATA à sa place dans downloaded_<nom> (reprise possible avec offset)."""
+        length = int(msg.get("length", 0))
+        offset = int(msg.get("offset", 0))
+        name = safe_filename(msg.get("filename")) or "file"
+        outname = f"downloaded_{name}"
+
+        # somme continuée seulement si cette trame suit la précédente (téléchargement depuis 0)
+        if offset == 0:
+            self._downloads[name] = (0, hashlib.sha256())
+        expected_offset, digest = self._downloads.pop(name, (None, None))
+        if expected_offset != offset:
+            digest = None
+
+        with open(outname, "r+b" if os.path.exists(outname) else "wb") as f:
+            f.seek(offset)
+            remaining = length
+            while remaining:
+                data = self.sock_file.read(min(DOWNLOAD_CHUNK, remaining))
+                if not data:
+                    raise OSError("connexion fermée pendant un téléchargement")
+                f.write(data)
+                if digest is not None:
+                    digest.update(data)
+                remaining -= len(data)
+            if msg.get("last") and offset + length == msg.get("size"):
+                # fin du fichier atteinte: on enlève un éventuel reste d'une version plus longue
+                f.truncate(offset + length)
+
+        if not msg.get("last"):
+            if digest is not None:
+                self._downloads[name] = (offset + length, digest)
+            return
+        if digest is None or offset + length != msg.get("size") or msg.get("sha256") is None:
+            # plage partielle ou reprise: pas de vérification sans relire le fichier
+            self.log(f"[FILE] téléchargé -> {outname} ({msg.get('size')} octets)")
+        elif digest.hexdigest() == msg["sha256"]:
+            self.log(f"[FILE] téléchargé -> {outname} ({msg.get('size')} octets, SHA-256 vérifiée)")
+        else:
+            self.log(f"[!] {outname}: SHA-256 différente de celle du serveur, fichier altéré")
+
+    # -----------------------------------------------------------------
+    # Envoi
+    # -----------------------------------------------------------------
+    @staticmethod
+    def _stamp(msg):
+        """Ajoute timestamp et nonce au moment de l'envoi réel."""
+        return {**msg, "timestamp": time.time(), "nonce": secrets.token_hex(8)}
+
+    def _send(self, msg, buffer=True):
+        """
+        Envoie msg, ou le garde dans le tampon (buffer=True) si la connexion est coupée.
+        Retourne False si le message n'a pu être ni envoyé ni gardé.
+        """
+        with self._send_lock:
+            if self.logged_in:
+                try:
+                    send_json(self.sock, self._stamp(msg) if buffer else msg)
+                    return True
+                except OSError:
+                    # le thread de réception voit aussi la coupure et se reconnecte
+                    self.logged_in = False
+            if not buffer:
+                return False
+            if len(self._pending) >= SEND_BUFFER_MAX:
+                self.log("[!] Tampon d'envoi plein: message non envoyé")
+                return False
+            self._pending.append(msg)
+            return True
+
+    def send_message(self, text, to_ip="*", room=None):
         msg = {
             "type": "MSG",
             "username": self.username,
             "to_ip": to_ip,  # "*" ou IP précise
-            "payload": text,
-            "timestamp": time.time(),
-            "nonce": secrets.token_hex(8)
+            "payload": text
         }
-        send_json(self.sock, msg)
+        if room is not None:
+            msg["room"] = room  # prioritaire sur to_ip: envoi aux membres du salon
+        return self._send(msg)
+
+    def join_room(self, room):
+        self.rooms.add(room)
+        self._send({"type": "JOIN", "room": room}, buffer=False)
+
+    def leave_room(self, room):
+        self.rooms.discard(room)
+        self._send({"type": "LEAVE", "room": room}, buffer=False)
+
+    def send_file(self, path, to_ip="*", room=None, delta=True):
+        """
+        Envoie un fichier. Stockage sur le serveur (to_ip="*"): si une copie du même
+        nom y est déjà, seuls les blocs modifiés partent (FILE_SIG puis FILE_DELTA).
+        """
+        if delta and room is None and to_ip in ("*", "") and self.logged_in:
+            name = os.path.basename(path)
+            self._deltas[name] = path
+            if self._send({"type": "FILE_SIG", "filename": name}, buffer=False):
+                return True
+            self._deltas.pop(name, None)
+        return self._send_whole_file(path, to_ip, room)
+
+    def _send_delta(self, path, sig):
+        """Calcule et envoie le FILE_DELTA (ou le fichier entier si le delta n'apporte rien)."""
+        name = sig["filename"]
+        try:
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                result = None
+                if sig.get("weak"):
+                    result = compute_delta(f, sig, literal_max=int(size * DELTA_MAX_RATIO))
+        except (OSError, KeyError, TypeError) as e:
+            self._deltas.pop(name, None)
+            self.log(f"[!] Delta impossible pour {name} ({e})")
+            return
+        if result is None:
+            # pas de copie sur le serveur, ou trop de changements
+            self._deltas.pop(name, None)
+            self._send_whole_file(path)
+            return
+        ops, size, sha256, copied, literal = result
+        self._send({
+            "type": "FILE_DELTA",
+            "filename": name,
+            "version": sig["version"],
+            "block": sig["block"],
+            "ops": ops,
+            "size": size,
+            "sha256": sha256
+        })
+        self.log(f"[FILE] {name}: {literal} octet(s) nouveaux envoyés, {copied} repris de la copie du serveur")
 
-    def send_file(self, path, to_ip="*"):
+    def _send_whole_file(self, path, to_ip="*", room=None):
+        # lecture par morceaux: SHA-256 des octets UTF-8 calculée au passage (vérifiée
+        # par le serveur puis par les destinataires d'un relai)
+        digest = hashlib.sha256()
+        parts = []
         with open(path, "r", encoding="utf-8") as f:
-            content = f.read()
+            for part in iter(lambda: f.read(FILE_READ_CHUNK), ""):
+                digest.update(part.encode("utf-8"))
+                parts.append(part)
+        content = "".join(parts)
 
         msg = {
             "type": "FILE",
@@ -111,7 +549,40 @@ class SecureClient:
             "to_ip": to_ip,  # "*" = stockage serveur, IP = relai vers client(s)
             "filename": os.path.basename(path),
             "payload": content,
-            "timestamp": time.time(),
-            "nonce": secrets.token_hex(8)
+            "sha256": digest.hexdigest()
+        }
+        if room is not None:
+            msg["room"] = room
+        return self._send(msg)
+
+    def request_roster(self):
+        """Redemande la photo complète des utilisateurs en ligne (réponse ROSTER)."""
+        self._send({"type": "ROSTER"}, buffer=False)
+
+    def request_file_list(self):
+        """Demande la liste des fichiers stockés sur le serveur (réponse FILE_LIST)."""
+        self._send({"type": "FILE_LIST"}, buffer=False)
+
+    def download_file(self, filename, offset=0, length=None):
+        """Télécharge un fichier stocké (ou la plage offset / length) dans downloaded_<nom>."""
+        msg = {
+            "type": "FILE_GET",
+            "filename": filename,
+            "offset": offset
+        }
+        if length is not None:
+            msg["length"] = length
+        self._send(msg, buffer=False)
+
+    def request_history(self, target="*", limit=50, since=None, room=None):
+        """Demande les derniers messages (broadcast "*", reçus sur notre IP, ou d'un salon)."""
+        msg = {
+            "type": "HISTORY",
+            "target": target,
+            "limit": limit
         }
-        send_json(self.sock, msg)
+        if room is not None:
+            msg["room"] = room
+        if since is not None:
+            msg["since"] = since
+        self._send(msg, buffer=False)
@@ -0,0 +1,167 @@
+# coalesce.py
+# Écritures groupées: un tampon de sortie par connexion.
+#
+# Sans tampon, chaque message (réponse, MSG relayé, PING) fait son propre
+# sendall: un appel système et, en TLS, un enregistrement chiffré (en-tête +
+# tag d'authentification, ~30 octets, et un passage dans OpenSSL) pour un
+# message de quelques dizaines d'octets.
+# Ici les messages sont ajoutés à une file, et un thread d'écriture par
+# connexion envoie tout ce qui est en attente en UN sendall (même principe
+# que les liens de federation.py):
+# - au repos: envoi dès le réveil du thread (pas de délai ajouté avec delay=0)
+# - sous charge: pendant un envoi, les messages suivants s'accumulent et
+#   partent ensemble au suivant
+# - delay > 0: le thread attend jusqu'à delay secondes après le plus ancien
+#   message en attente (ou max_bytes en attente) pour grouper davantage:
+#   c'est le plafond de latence ajoutée
+# - file bornée (max_pending octets): un client trop lent pour suivre est
+#   coupé au lieu de bloquer les broadcasts vers les autres
+# - l'appelant ne bloque plus sur la socket: un broadcast ne fait qu'ajouter
+#   à N files
+# - thread d'écriture démarré à la demande et arrêté après WRITER_IDLE secondes
+#   sans rien à envoyer: un client inactif ne coûte pas de thread (pile,
+#   ~20 Ko de mémoire résidente chacun); sous charge il reste en place
+
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+FLUSH_TIMEOUT = 2.0   # secondes max pour envoyer ce qui reste à la fermeture
+WRITER_IDLE = 5.0     # secondes sans rien à envoyer avant l'arrêt du thread d'écriture
+
+
+class OutputBuffer:
+    """File de sortie + thread d'écriture d'une connexion."""
+
+    __slots__ = ("conn", "delay", "max_bytes", "max_pending", "_pending", "_size", "_first",
+                 "_cond", "_send_lock", "_closing", "closed", "error", "_thread")
+
+    # totaux tous tampons confondus (métriques); sans verrou: approximatifs
+    messages_total = 0
+    writes_total = 0
+    overflows_total = 0
+
+    def __init__(self, conn, delay=0.0, max_bytes=64 * 1024, max_pending=4 * 1024 * 1024):
+        self.conn = conn
+        self.delay = delay
+        self.max_bytes = max_bytes
+        self.max_pending = max_pending
+        self._pending = []
+        self._size = 0
+        self._first = 0.0            # instant d'arrivée du plus ancien message en attente
+        self._cond = threading.Condition()
+        self._send_lock = threading.Lock()   # une seule écriture sur la socket à la fois
+        self._closing = False        # plus rien n'est accepté, le reste part sans délai
+        self.closed = False
+        self.error = None
+        self._thread = None          # thread d'écriture, None tant qu'il n'y a rien à envoyer
+
+    def write(self, raw):
+        """Ajoute une ou plusieurs lignes encodées. OSError si la connexion est fermée ou la file pleine."""
+        with self._cond:
+            if self._closing or self.closed:
+                raise OSError(self.error or "connexion fermée")
+            overflow = bool(self._pending) and self._size + len(raw) > self.max_pending
+            if not overflow:
+                if not self._pending:
+                    self._first = time.monotonic()
+                self._pending.append(raw)
+                self._size += len(raw)
+                OutputBuffer.messages_total += 1
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._writer, daemon=True)
+                    self._thread.start()
+                else:
+                    self._cond.notify()
+        if overflow:
+            OutputBuffer.overflows_total += 1
+            self._fail(f"file de sortie pleine ({self._size} octets): client trop lent")
+            raise OSError(self.error)
+
+    def _send_pending(self, extra=b""):
+        """Envoie tout ce qui est en attente (+ extra) en un seul sendall. À appeler avec _send_lock."""
+        with self._cond:
+            batch = self._pending
+            self._pending = []
+            self._size = 0
+        if extra:
+            batch.append(extra)
+        if not batch:
+            return
+        self.conn.sendall(batch[0] if len(batch) == 1 else b"".join(batch))
+        OutputBuffer.writes_total += 1
+
+    def _writer(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closing and not self.closed:
+                    if not self._cond.wait(WRITER_IDLE) and not self._pending and not self._closing:
+                        # rien à envoyer depuis WRITER_IDLE: le prochain write() relancera un thread
+                        self._thread = None
+                        return
+                if self.closed or (self._closing and not self._pending):
+                    return
+                # regroupement: jusqu'à delay après le plus ancien message, ou max_bytes en attente
+                while self.delay > 0 and not self._closing and self._size < self.max_bytes:
+                    left = self._first + self.delay - time.monotonic()
+                    if left <= 0:
+                        break
+                    self._cond.wait(left)
+            try:
+                with self._send_lock:
+                    self._send_pending()
+            except OSError as e:
+                self._fail(str(e))
+                return
+
+    @contextmanager
+    def exclusive(self, data=b""):
+        """
+        Accès direct à la socket (ex: octets bruts de FILE_GET): ce qui était en
+        attente part d'abord, avec data, puis rien d'autre n'est écrit jusqu'à la sortie du bloc.
+        """
+        with self._send_lock:
+            if self.closed:
+                raise OSError(self.error or "connexion fermée")
+            try:
+                self._send_pending(data)
+                yield self.conn
+            except OSError as e:
+                self._fail(str(e))
+                raise
+
+    def _fail(self, reason):
+        """Connexion inutilisable: on vide la file et on coupe la socket (le thread client fait le nettoyage)."""
+        with self._cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.error = reason
+            self._pending = []
+            self._size = 0
+            self._cond.notify_all()
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def finish(self):
+        """Plus de nouveaux messages; le thread d'écriture envoie le reste sans attendre puis s'arrête."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+
+    def close(self, timeout=FLUSH_TIMEOUT):
+        """finish() puis attend l'envoi du reste; à l'échéance, la socket est coupée."""
+        self.finish()
+        with self._cond:
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            if thread.is_alive():
+                # client qui ne lit plus: sendall bloqué, on le débloque en coupant la socket
+                self._fail("envoi du reste interrompu à la fermeture")
+                thread.join()
+        with self._cond:
+            self.closed = True
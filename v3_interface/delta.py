@@ -0,0 +1,294 @@
+# delta.py
+# Envoi différentiel d'un fichier déjà stocké sur le serveur (principe de rsync).
+#
+# 1. Le client demande la signature de la copie stockée (FILE_SIG): le fichier
+#    est découpé en blocs de taille fixe, et pour chaque bloc le serveur donne
+#    une somme faible (adler32, calculable en glissant d'un octet) et une
+#    somme forte (blake2b 64 bits). Lecture par blocs: mémoire bornée quelle
+#    que soit la taille du fichier.
+# 2. Le client parcourt sa nouvelle version avec une fenêtre glissante de la
+#    taille d'un bloc: quand la somme faible puis la somme forte d'une fenêtre
+#    correspondent à un bloc du serveur, il envoie une référence à ce bloc au
+#    lieu de ses octets. Le fichier est lu par morceaux de READ_CHUNK (fenêtre
+#    bornée elle aussi); seuls les octets sans correspondance sont gardés.
+# 3. FILE_DELTA: liste d'opérations, [index, nombre] = copier des blocs de la
+#    copie stockée, "base64" = octets nouveaux. Le serveur reconstruit le
+#    fichier dans un fichier temporaire, vérifie taille et SHA-256 puis le met
+#    en place de façon atomique avec sa somme (comme store_file).
+#    Taille annoncée bornée (max_size), et octets recopiés bornés à
+#    COPY_MAX_RATIO fois la copie stockée: un petit FILE_DELTA qui répète les
+#    mêmes blocs ne peut pas produire un fichier énorme.
+#
+# La signature porte une "version" de la copie stockée (inode, taille, mtime):
+# si le fichier a été remplacé entre FILE_SIG et FILE_DELTA, le delta est
+# refusé (ERR "delta base changed: nom") et le client renvoie le fichier entier.
+# Tout refus a la forme "delta <raison>: <nom>" (DELTA_ERROR_PREFIX): le client
+# retrouve le fichier concerné quelle que soit la raison.
+#
+# Cas favorable: un journal qui grossit ou change à quelques endroits; les
+# blocs alignés sont reconnus directement (adler32 de zlib, en C) et la
+# fenêtre ne glisse octet par octet (en Python) qu'autour des modifications.
+# Fichier entièrement changé: abandon dès que la suite d'octets sans
+# correspondance dépasse STALL_BLOCKS blocs et tout ce qui a été reconnu
+# jusque-là (au lieu de glisser jusqu'à literal_max, ~1 s par Mo).
+
+import base64
+import hashlib
+import math
+import os
+import tempfile
+import zlib
+
+from filestore import install_file, safe_filename, stored_path
+
+BLOCK_MIN = 2 * 1024      # taille de bloc ~ racine carrée de la taille du fichier, bornée
+BLOCK_MAX = 64 * 1024
+READ_CHUNK = 1024 * 1024  # lecture du fichier local par morceaux
+COPY_CHUNK = 256 * 1024   # recopie des blocs côté serveur
+COPY_MAX_RATIO = 2        # octets recopiés max / taille de la copie stockée
+STALL_BLOCKS = 16         # blocs sans correspondance (au-delà de ce qui a été reconnu) avant abandon
+MOD = 65521               # module d'adler32
+DELTA_ERROR_PREFIX = "delta "
+
+
+def block_size(size):
+    """Taille de bloc pour un fichier de size octets (multiple de 1 Ko)."""
+    return max(BLOCK_MIN, min(BLOCK_MAX, math.isqrt(size) // 1024 * 1024))
+
+
+def strong_sum(data):
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+def version_of(st):
+    """Identifie une version précise du fichier stocké (remplacé = nouvel inode)."""
+    return f"{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def signature(directory, filename):
+    """
+    Signature de la copie stockée: {"size", "version", "block", "weak", "strong"}.
+    Fichier absent: size 0, listes vides. None si le nom est refusé.
+    """
+    path = stored_path(directory, filename)
+    if path is None:
+        return None
+    try:
+        f = open(path, "rb")
+    except (FileNotFoundError, IsADirectoryError):
+        return {"size": 0, "version": None, "block": BLOCK_MIN, "weak": [], "strong": []}
+    with f:
+        st = os.fstat(f.fileno())
+        block = block_size(st.st_size)
+        weak, strong = [], []
+        buf = bytearray(block)
+        view = memoryview(buf)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            weak.append(zlib.adler32(view[:n]))
+            strong.append(strong_sum(view[:n]))
+    return {"size": st.st_size, "version": version_of(st), "block": block, "weak": weak, "strong": strong}
+
+
+def compute_delta(f, sig, literal_max=None):
+    """
+    Opérations FILE_DELTA pour envoyer le fichier f (binaire, déjà ouvert) sachant la signature sig.
+    Retourne (ops, taille, sha256, octets copiés, octets littéraux), ou None si les
+    octets nouveaux dépassent literal_max ou si, avec literal_max, plus rien ne
+    correspond (autant envoyer le fichier entier).
+    """
+    block = sig["block"]
+    base_size = sig["size"]
+    blocks = len(sig["weak"])
+    last_len = base_size - (blocks - 1) * block if blocks else 0
+    index = {}
+    for i, w in enumerate(sig["weak"]):
+        index.setdefault(w, []).append(i)
+
+    ops = []
+    digest = hashlib.sha256()
+    total = copied = literal_bytes = 0
+    buf = bytearray()
+    pos = 0          # début de la fenêtre dans buf
+    lit_start = 0    # début des octets littéraux pas encore émis
+    weak = None      # (a, b) d'adler32 pour buf[pos:pos + block], None = à recalculer
+    unmatched = 0    # octets parcourus depuis la dernière correspondance
+    eof = False
+
+    def emit_literal(end):
+        nonlocal literal_bytes
+        if end > lit_start:
+            ops.append(base64.b64encode(buf[lit_start:end]).decode("ascii"))
+            literal_bytes += end - lit_start
+
+    def emit_copy(i, length):
+        nonlocal copied
+        if ops and isinstance(ops[-1], list) and ops[-1][0] + ops[-1][1] == i:
+            ops[-1][1] += 1
+        else:
+            ops.append([i, 1])
+        copied += length
+
+    def match(window, length):
+        candidates = index.get(zlib.adler32(window) if weak is None else (weak[1] << 16) | weak[0])
+        if not candidates:
+            return None
+        strong = strong_sum(window)
+        for i in candidates:
+            size = last_len if i == blocks - 1 else block
+            if size == length and sig["strong"][i] == strong:
+                return i
+        return None
+
+    while True:
+        # fenêtre complète disponible (lecture du morceau suivant si besoin)
+        if not eof and len(buf) - pos < block + 1:
+            # tampon borné: littéraux en attente émis, octets déjà traités retirés
+            if pos - lit_start >= READ_CHUNK:
+                emit_literal(pos)
+                lit_start = pos
+            if lit_start >= READ_CHUNK:
+                del buf[:lit_start]
+                pos -= lit_start
+                lit_start = 0
+            chunk = f.read(READ_CHUNK)
+            if chunk:
+                buf += chunk
+                digest.update(chunk)
+                total += len(chunk)
+            else:
+                eof = True
+        remaining = len(buf) - pos
+        if remaining == 0:
+            break
+        if remaining < block and not eof:
+            continue
+        if remaining < block:
+            # fin du fichier: seul le dernier bloc (plus court) de la copie stockée peut correspondre
+            i = match(bytes(buf[pos:]), remaining) if blocks and last_len == remaining else None
+            if i is not None:
+                emit_literal(pos)
+                emit_copy(i, remaining)
+                lit_start = pos = len(buf)
+            break
+
+        window = memoryview(buf)[pos:pos + block]
+        i = match(window, block) if blocks else None
+        if i is not None:
+            window.release()
+            emit_literal(pos)
+            emit_copy(i, block)
+            pos += block
+            lit_start = pos
+            weak = None
+            unmatched = 0
+        else:
+            window.release()
+            # pas de correspondance: la fenêtre avance d'un octet (adler32 glissant)
+            if weak is None:
+                w = zlib.adler32(buf[pos:pos + block])
+                weak = (w & 0xFFFF, w >> 16)
+            if pos + block < len(buf):
+                out, new = buf[pos], buf[pos + block]
+                a = (weak[0] - out + new) % MOD
+                b = (weak[1] - block * out + a - 1) % MOD
+                weak = (a, b)
+            else:
+                weak = None
+            pos += 1
+            unmatched += 1
+        if literal_max is not None and (literal_bytes + pos - lit_start > literal_max
+                                        or unmatched > max(STALL_BLOCKS * block, copied)):
+            return None
+
+    emit_literal(len(buf))
+    if literal_max is not None and literal_bytes > literal_max:
+        return None
+    if copied > COPY_MAX_RATIO * base_size:
+        # refusé par le serveur (blocs répétés): fichier entier
+        return None
+    return ops, total, digest.hexdigest(), copied, literal_bytes
+
+
+class DeltaError(ValueError):
+    """Delta refusé; message "delta <raison>: <nom>" renvoyé au client dans l'ERR."""
+
+    def __init__(self, reason, filename):
+        super().__init__(f"{DELTA_ERROR_PREFIX}{reason}: {filename}")
+        self.filename = filename
+
+
+def apply_delta(directory, filename, version, block, ops, size, sha256, max_size=None):
+    """
+    Reconstruit le fichier à partir de la copie stockée et des opérations, puis le
+    met en place atomiquement. Retourne (chemin, octets copiés, octets littéraux).
+    DeltaError si le delta est invalide, trop gros (size > max_size) ou si la copie stockée a changé.
+    """
+    path = stored_path(directory, filename)
+    if path is None:
+        raise DeltaError("invalid filename", filename)
+    if max_size is not None and size > max_size:
+        raise DeltaError("too large", filename)
+    try:
+        base = open(path, "rb")
+    except (FileNotFoundError, IsADirectoryError):
+        raise DeltaError("base changed", filename)
+    with base:
+        st = os.fstat(base.fileno())
+        if version != version_of(st) or block != block_size(st.st_size):
+            raise DeltaError("base changed", filename)
+        fd, tmp = tempfile.mkstemp(dir=directory or ".", prefix=".upload_")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                copied, literal, digest = _rebuild(base, st.st_size, block, ops, size, out, filename)
+            if digest != sha256:
+                raise DeltaError("checksum mismatch", filename)
+            # somme gardée comme celle d'un FILE (clé du contenu, FILE_LIST / FILE_GET)
+            install_file(tmp, directory, safe_filename(filename), sha256)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    return path, copied, literal
+
+
+def _rebuild(base, base_size, block, ops, size, out, filename):
+    digest = hashlib.sha256()
+    written = copied = literal = 0
+
+    def write(data):
+        nonlocal written
+        written += len(data)
+        if written > size:
+            raise DeltaError("larger than announced size", filename)
+        digest.update(data)
+        out.write(data)
+
+    for op in ops:
+        if isinstance(op, str):
+            try:
+                data = base64.b64decode(op, validate=True)
+            except ValueError:
+                raise DeltaError("invalid literal", filename)
+            write(data)
+            literal += len(data)
+        elif (isinstance(op, list) and len(op) == 2 and all(type(x) is int for x in op)
+              and op[0] >= 0 and op[1] > 0 and op[0] * block < base_size):
+            start = op[0] * block
+            left = min(op[1] * block, base_size - start)
+            if copied + left > COPY_MAX_RATIO * base_size:
+                raise DeltaError("too many copied blocks", filename)
+            base.seek(start)
+            while left:
+                data = base.read(min(COPY_CHUNK, left))
+                if not data:
+                    raise DeltaError("base truncated", filename)
+                write(data)
+                copied += len(data)
+                left -= len(data)
+        else:
+            raise DeltaError("invalid operation", filename)
+    if written != size:
+        raise DeltaError("size mismatch", filename)
+    return copied, literal, digest.hexdigest()
@@ -0,0 +1,80 @@
+# drain.py
+# Arrêt propre du serveur (drain): suivi des connexions ouvertes et des
+# messages en cours de traitement.
+#
+# Déroulement (voir server.drain):
+# 1) closing: plus de nouvelles connexions, les clients reçoivent SERVER_CLOSING
+# 2) les clients partent d'eux-mêmes; leurs derniers messages sont traités normalement
+# 3) échéance atteinte: stopping, on n'accepte plus de nouveau message (le client
+#    n'a pas d'ACK et le renverra au serveur suivant), on attend la fin des
+#    traitements en cours (écriture de FILE, relais) puis on coupe les connexions
+
+import threading
+import time
+
+
+class Drainer:
+    def __init__(self):
+        self.closing = threading.Event()   # arrêt demandé
+        self.stopping = False              # échéance atteinte: plus aucun message traité
+        self._conns = set()
+        self._busy = 0                     # messages en cours de traitement
+        self._local = threading.local()
+        self._cond = threading.Condition()
+
+    # -----------------------------------------------------------------
+    # Connexions
+    # -----------------------------------------------------------------
+    def add(self, conn):
+        with self._cond:
+            self._conns.add(conn)
+
+    def remove(self, conn):
+        """Fin de connexion (appelé par le thread du client, y compris après une exception)."""
+        self.end()
+        with self._cond:
+            self._conns.discard(conn)
+            self._cond.notify_all()
+
+    def connections(self):
+        with self._cond:
+            return list(self._conns)
+
+    def __len__(self):
+        return len(self._conns)
+
+    # -----------------------------------------------------------------
+    # Traitements en cours (un par thread client au plus)
+    # -----------------------------------------------------------------
+    def begin(self):
+        with self._cond:
+            self._busy += 1
+        self._local.busy = True
+
+    def end(self):
+        if not getattr(self._local, "busy", False):
+            return
+        self._local.busy = False
+        with self._cond:
+            self._busy -= 1
+            self._cond.notify_all()
+
+    # -----------------------------------------------------------------
+    # Attente (deadline = time.monotonic() à ne pas dépasser)
+    # -----------------------------------------------------------------
+    def _wait(self, predicate, deadline):
+        with self._cond:
+            while not predicate():
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self._cond.wait(left)
+            return True
+
+    def wait_disconnected(self, deadline):
+        """Attend que toutes les connexions soient fermées. Retourne False à l'échéance."""
+        return self._wait(lambda: not self._conns, deadline)
+
+    def wait_idle(self, deadline):
+        """Attend la fin des traitements en cours. Retourne False à l'échéance."""
+        return self._wait(lambda: self._busy == 0, deadline)
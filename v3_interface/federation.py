@@ -0,0 +1,354 @@
+# federation.py
+# Fédération: plusieurs serveurs V3 reliés en un seul domaine de routage.
+#
+# - Chaque nœud ouvre un lien TLS vers les nœuds de PEERS (sur leur port
+#   habituel) et s'annonce avec PEER {node, secret}; la réponse est PEER_OK.
+#   Un lien sert dans les deux sens, quel que soit le nœud qui l'a ouvert.
+# - Chaque nœud annonce ses propres clients (paires IP / utilisateur): un
+#   instantané à l'ouverture du lien, puis seulement les changements.
+# - Un MSG / FILE n'est relayé qu'aux nœuds qui hébergent un destinataire
+#   (l'IP ciblée, ou au moins un client pour un broadcast).
+# - Envois groupés: chaque lien a une file et un thread d'écriture qui vide
+#   tout ce qui est en attente en une seule trame FED {items: [...]}. Au repos,
+#   une trame par message (pas de délai ajouté); sous charge, beaucoup
+#   de messages par trame (un seul sendall, un seul enregistrement TLS).
+#
+# Pas de boucle: les nœuds forment un maillage complet (chacun liste tous les
+# autres dans PEERS), un nœud n'annonce que ses clients locaux et un message
+# reçu d'un pair est livré localement, jamais relayé à nouveau.
+# Les salons (rooms) restent locaux à chaque nœud.
+
+import hmac
+import random
+import secrets
+import socket
+import threading
+import time
+from collections import deque
+
+from common import encode_json, recv_json
+
+LINK_QUEUE_MAX = 10000      # éléments en attente par lien (au-delà: lien coupé puis resynchronisé)
+BATCH_MAX_ITEMS = 256       # éléments max par trame FED
+BATCH_MAX_BYTES = 1024 * 1024
+RECONNECT_BASE = 0.5        # délai (s) avant de rappeler un nœud injoignable (exponentiel + jitter)
+RECONNECT_MAX = 30
+
+
+class PeerLink:
+    """
+    Lien TLS avec un autre nœud: file d'éléments à envoyer + thread d'écriture.
+    send(raw): écriture sur la socket; pour un lien accepté, celle du tampon de
+    sortie de la connexion (PEER_OK, PING et SERVER_CLOSING passent par le même
+    chemin, jamais deux écritures TLS en même temps). Par défaut (lien ouvert
+    par ce nœud): sendall sous le verrou du lien, partagé avec les PONG.
+    """
+
+    def __init__(self, federation, node, conn, send=None):
+        self.federation = federation
+        self.node = node
+        self.conn = conn
+        self.send = send or self._locked_sendall
+        self._send_lock = threading.Lock()
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self.closed = False
+        threading.Thread(target=self._writer, daemon=True).start()
+
+    def push(self, item, size=0):
+        """Ajoute un élément à la prochaine trame. Retourne False si le lien est fermé ou saturé."""
+        with self._cond:
+            if self.closed:
+                return False
+            if len(self._queue) >= LINK_QUEUE_MAX:
+                overflow = True
+            else:
+                overflow = False
+                self._queue.append((item, size))
+                self._cond.notify()
+        if overflow:
+            # pair trop lent: on coupe, il se resynchronisera (instantané) au prochain lien
+            self.federation.log("[!] Fédération: file pleine vers %s, lien coupé", self.node)
+            self.close()
+            return False
+        return True
+
+    def _locked_sendall(self, raw):
+        with self._send_lock:
+            self.conn.sendall(raw)
+
+    def _writer(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self.closed:
+                    self._cond.wait()
+                if self.closed:
+                    return
+                items = []
+                size = 0
+                while self._queue and len(items) < BATCH_MAX_ITEMS and size < BATCH_MAX_BYTES:
+                    item, item_size = self._queue.popleft()
+                    items.append(item)
+                    size += item_size
+            try:
+                self.send(encode_json({"type": "FED", "node": self.federation.node, "items": items}))
+            except Exception:
+                self.close()
+                return
+            self.federation.frames_sent += 1
+            self.federation.items_sent += len(items)
+
+    def close(self):
+        """
+        Arrête l'écriture et coupe la socket: le thread qui lit ce lien (handle_client
+        ou _run_outbound) sort alors de readline() et appelle detach().
+        """
+        with self._cond:
+            if self.closed:
+                return
+            self.closed = True
+            self._cond.notify()
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+
+
+class Federation:
+    """
+    Table des liens et des routes annoncées par les autres nœuds.
+    deliver(to, raw, server_time): livraison locale d'un message relayé par un pair
+    ("*" = broadcast, sinon IP); server_time est None si le message ne va pas en historique.
+    """
+
+    def __init__(self, deliver, log=None):
+        self.deliver = deliver
+        self.log = log or (lambda *args: None)
+        self.node = None
+        self.secret = None
+        self._links = {}    # nœud -> [PeerLink] (deux liens si les deux nœuds se sont appelés)
+        self._by_conn = {}  # connexion -> PeerLink
+        self._routes = {}   # nœud -> {ip: {utilisateur, ...}}
+        self._local = {}    # (ip, utilisateur) -> nombre de connexions locales
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.frames_sent = 0
+        self.items_sent = 0
+        self.items_received = 0
+        self.forwarded = 0
+
+    @property
+    def enabled(self):
+        return self.secret is not None
+
+    # -----------------------------------------------------------------
+    # Démarrage / arrêt
+    # -----------------------------------------------------------------
+    def start(self, node, secret, peers, context, tune=None):
+        """Active la fédération et lance un thread d'appel par nœud de peers ("hôte:port")."""
+        self.node = node
+        self.secret = secret
+        for address in peers:
+            host, _, port = address.rpartition(":")
+            threading.Thread(target=self._dial_loop, args=(host, int(port), context, tune),
+                             daemon=True).start()
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            links = list(self._by_conn.values())
+        for link in links:
+            link.close()
+
+    # -----------------------------------------------------------------
+    # Liens
+    # -----------------------------------------------------------------
+    def accept_peer(self, node, secret):
+        """Vérifie un PEER reçu. Retourne None si accepté, sinon le message d'erreur."""
+        if not self.enabled:
+            return "federation disabled"
+        if not hmac.compare_digest(secret.encode(), self.secret.encode()):
+            return "invalid federation secret"
+        if node == self.node:
+            return "peer has the same node name"
+        return None
+
+    def attach(self, node, conn, send=None):
+        """Enregistre un lien ouvert et lui envoie l'instantané des clients locaux (voir PeerLink pour send)."""
+        link = PeerLink(self, node, conn, send)
+        with self._lock:
+            self._links.setdefault(node, []).append(link)
+            self._by_conn[conn] = link
+            # sous le verrou: aucun changement local ne peut passer entre l'instantané et la suite
+            for ip, user in self._local:
+                link.push({"op": "add", "ip": ip, "user": user})
+        self.log("[+] Fédération: lien avec %s", node)
+        return link
+
+    def detach(self, link_or_conn):
+        """Retire un lien; les routes du nœud sont oubliées quand son dernier lien tombe."""
+        with self._lock:
+            link = link_or_conn if isinstance(link_or_conn, PeerLink) else self._by_conn.get(link_or_conn)
+            if link is None or self._by_conn.pop(link.conn, None) is None:
+                return
+            links = [l for l in self._links.get(link.node, []) if l is not link]
+            if links:
+                self._links[link.node] = links
+            else:
+                self._links.pop(link.node, None)
+                self._routes.pop(link.node, None)
+        link.close()
+        self.log("[-] Fédération: lien avec %s fermé", link.node)
+
+    def links(self):
+        with self._lock:
+            return len(self._by_conn)
+
+    def _dial_loop(self, host, port, context, tune):
+        """Garde un lien ouvert vers host:port (rappel avec délai exponentiel + jitter)."""
+        attempt = 0
+        while not self._stop.is_set():
+            try:
+                raw = socket.create_connection((host, port), timeout=10)
+                if tune is not None:
+                    tune(raw)
+                conn = context.wrap_socket(raw, server_hostname=host)
+                conn.settimeout(None)
+            except OSError as e:
+                attempt += 1
+                self.log("[!] Fédération: %s:%s injoignable (%s)", host, port, e)
+                self._stop.wait(random.uniform(0, min(RECONNECT_MAX, RECONNECT_BASE * 2 ** attempt)))
+                continue
+            attempt = 0
+            hint = self._run_outbound(conn, f"{host}:{port}")
+            self._stop.wait(random.uniform(0, hint or RECONNECT_BASE))
+
+    def _run_outbound(self, conn, address):
+        """PEER puis lecture des trames du nœud appelé. Retourne le délai conseillé avant rappel."""
+        sock_file = conn.makefile("rb")
+        link = None
+        hint = None
+        try:
+            conn.sendall(encode_json({
+                "type": "PEER",
+                "node": self.node,
+                "secret": self.secret,
+                "timestamp": time.time(),
+                "nonce": secrets.token_hex(16)
+            }))
+            reply = recv_json(sock_file)
+            if not reply or reply.get("type") != "PEER_OK":
+                self.log("[!] Fédération: %s a refusé le lien (%s)", address,
+                         reply.get("message") if reply else "connexion fermée")
+                return RECONNECT_MAX
+            link = self.attach(reply.get("node") or address, conn)
+
+            while not link.closed:
+                msg = recv_json(sock_file)
+                if msg is None:
+                    break
+                mtype = msg.get("type")
+                if mtype == "FED":
+                    self.receive(conn, msg.get("items"))
+                elif mtype == "PING":
+                    # keepalive du nœud appelé (même chemin d'écriture que les trames FED)
+                    link.send(encode_json({"type": "PONG", "server_time": time.time()}))
+                elif mtype == "SERVER_CLOSING":
+                    hint = msg.get("reconnect_after")
+                    break
+        except (OSError, ValueError) as e:
+            self.log("[!] Fédération: lien vers %s interrompu (%s)", address, e)
+        finally:
+            if link is not None:
+                self.detach(link)
+            try:
+                sock_file.close()
+                conn.close()
+            except Exception:
+                pass
+        return hint
+
+    # -----------------------------------------------------------------
+    # Routes annoncées
+    # -----------------------------------------------------------------
+    def _announce_locked(self, op, ip, user):
+        for links in self._links.values():
+            for link in links:
+                link.push({"op": op, "ip": ip, "user": user})
+
+    def local_add(self, ip, user):
+        """Un client local vient d'être enregistré (annoncé si c'est le 1er pour cette paire)."""
+        with self._lock:
+            count = self._local.get((ip, user), 0)
+            self._local[(ip, user)] = count + 1
+            if count == 0:
+                self._announce_locked("add", ip, user)
+
+    def local_remove(self, ip, user):
+        with self._lock:
+            count = self._local.get((ip, user), 0)
+            if count <= 1:
+                if self._local.pop((ip, user), None) is not None:
+                    self._announce_locked("del", ip, user)
+            else:
+                self._local[(ip, user)] = count - 1
+
+    def remote_routes(self):
+        """Nombre de paires IP / utilisateur annoncées par les autres nœuds."""
+        with self._lock:
+            return sum(len(users) for routes in self._routes.values() for users in routes.values())
+
+    def locate(self, username):
+        """Nœuds où l'utilisateur est connecté."""
+        with self._lock:
+            return [node for node, routes in self._routes.items()
+                    if any(username in users for users in routes.values())]
+
+    # -----------------------------------------------------------------
+    # Relais
+    # -----------------------------------------------------------------
+    def forward(self, to, raw, server_time=None):
+        """
+        Relaie une ligne encodée aux nœuds qui hébergent un destinataire:
+        to = "*" (nœuds ayant au moins un client) ou une IP.
+        Retourne le nombre de nœuds visés.
+        """
+        if not self._routes:
+            return 0
+        item = {"op": "msg", "to": to, "time": server_time, "line": raw.decode("utf-8")}
+        with self._lock:
+            targets = [links[0] for node, links in self._links.items()
+                       if self._routes.get(node) and (to == "*" or to in self._routes[node])]
+        count = 0
+        for link in targets:
+            count += link.push(item, len(raw))
+        self.forwarded += count
+        return count
+
+    def receive(self, conn, items):
+        """Trame FED reçue sur conn. Retourne False si conn n'est pas un lien de fédération."""
+        link = self._by_conn.get(conn)
+        if link is None or not isinstance(items, list):
+            return False
+        for item in items:
+            op = item.get("op") if isinstance(item, dict) else None
+            if op == "msg":
+                to, line = item.get("to"), item.get("line")
+                if isinstance(to, str) and isinstance(line, str):
+                    # livraison locale seulement: jamais relayé à nouveau (pas de boucle)
+                    self.deliver(to, line.encode("utf-8"), item.get("time"))
+            elif op in ("add", "del"):
+                with self._lock:
+                    if link.node not in self._links:
+                        continue
+                    routes = self._routes.setdefault(link.node, {})
+                    ip, user = item.get("ip"), item.get("user")
+                    if op == "add":
+                        routes.setdefault(ip, set()).add(user)
+                    else:
+                        users = routes.get(ip, set())
+                        users.discard(user)
+                        if not users:
+                            routes.pop(ip, None)
+        self.items_received += len(items)
+        return True
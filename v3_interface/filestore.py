@@ -0,0 +1,237 @@
+# filestore.py
+# Fichiers stockés sur le serveur par FILE, relus par FILE_LIST / FILE_GET.
+#
+# - Noms de fichiers nettoyés (nom simple, sans dossier): un FILE "../x" ne
+#   peut ni écrire ni être relu hors du dossier de stockage
+# - Écriture atomique (fichier temporaire puis os.replace): un téléchargement
+#   en cours garde l'ancienne version complète même si le fichier est remplacé
+# - Envoi d'une plage du fichier sans le charger en mémoire:
+#   * TCP brut (V1): socket.sendfile, copie faite par le noyau (zéro copie)
+#   * TLS (V2/V3): le chiffrement se fait en espace utilisateur, donc lecture
+#     par blocs de STREAM_CHUNK dans un tampon réutilisé (un par thread)
+#
+# - Somme SHA-256 des octets UTF-8 calculée pendant l'écriture (encodage par
+#   morceaux, sans second passage sur les données): comparée à celle annoncée
+#   par l'expéditeur avant de mettre le fichier en place, puis gardée à côté
+#   (.sha256_<nom>: somme, taille, mtime du fichier). C'est la clé du contenu:
+#   renvoyée par FILE_LIST et dans les trames FILE_DATA pour que le
+#   destinataire vérifie ce qu'il a reçu. Elle n'est valable que si taille et
+#   mtime correspondent encore au fichier ouvert.
+#
+# Réponse à FILE_GET: une ou plusieurs trames FILE_DATA, chacune = une ligne
+# JSON {"type": "FILE_DATA", "filename", "size", "offset", "length", "last",
+# "sha256"} suivie d'exactement "length" octets bruts. Entre deux trames,
+# d'autres messages (MSG relayés...) peuvent s'intercaler.
+
+import hashlib
+import os
+import ssl
+import tempfile
+import threading
+
+from common import encode_json
+
+STORED_PREFIX = "receive_"   # fichiers stockés sous RECEIVE_DIR/receive_<nom>
+DIGEST_PREFIX = ".sha256_"   # somme du fichier stocké sous RECEIVE_DIR/.sha256_<nom>
+ENCODE_CHUNK = 64 * 1024     # caractères encodés (et hachés) à la fois
+STREAM_CHUNK = 256 * 1024    # octets par trame FILE_DATA (et taille du tampon de lecture)
+FILENAME_MAX = 255
+
+_buffers = threading.local()
+
+
+def safe_filename(name):
+    """Nom de fichier simple (sans dossier ni caractère de contrôle), ou None si refusé."""
+    if not isinstance(name, str) or not 0 < len(name) <= FILENAME_MAX:
+        return None
+    if name in (".", "..") or "/" in name or "\\" in name or any(ord(c) < 32 for c in name):
+        return None
+    return name
+
+
+def stored_path(directory, filename):
+    """Chemin du fichier stocké, ou None si le nom est refusé."""
+    name = safe_filename(filename)
+    return os.path.join(directory, STORED_PREFIX + name) if name is not None else None
+
+
+class ChecksumError(ValueError):
+    """Contenu reçu différent de la somme annoncée (altéré en route)."""
+
+
+def encoded_chunks(text):
+    """Octets UTF-8 de text, morceau par morceau (jamais tout le texte encodé d'un coup)."""
+    for i in range(0, len(text), ENCODE_CHUNK):
+        yield text[i:i + ENCODE_CHUNK].encode("utf-8")
+
+
+def text_digest(text):
+    """(taille en octets UTF-8, SHA-256) de text, en un seul passage."""
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in encoded_chunks(text):
+        digest.update(chunk)
+        size += len(chunk)
+    return size, digest.hexdigest()
+
+
+def digest_path(directory, filename):
+    return os.path.join(directory, DIGEST_PREFIX + filename)
+
+
+def install_file(tmp, directory, filename, sha256):
+    """Met en place tmp (fichier complet, fermé) sous filename avec sa somme. À appeler avec un nom sûr."""
+    st = os.stat(tmp)
+    fd, tmp_digest = tempfile.mkstemp(dir=directory or ".", prefix=".upload_")
+    try:
+        with os.fdopen(fd, "w", encoding="ascii") as f:
+            f.write(f"{sha256} {st.st_size} {st.st_mtime_ns}\n")
+        # somme d'abord: jamais de nouveau fichier avec l'ancienne somme (l'inverse
+        # est écarté par la vérification taille / mtime de stored_digest)
+        os.replace(tmp_digest, digest_path(directory, filename))
+    except BaseException:
+        os.unlink(tmp_digest)
+        raise
+    os.replace(tmp, os.path.join(directory, STORED_PREFIX + filename))
+
+
+def store_file(directory, filename, data, sha256=None):
+    """
+    Écrit data (texte UTF-8) de façon atomique, en calculant sa somme au passage.
+    Retourne (chemin, taille en octets, sha256), ou None si le nom est refusé.
+    ChecksumError (rien n'est écrit) si sha256 est donné et ne correspond pas.
+    """
+    path = stored_path(directory, filename)
+    if path is None:
+        return None
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory or ".", prefix=".upload_")
+    try:
+        digest = hashlib.sha256()
+        size = 0
+        with os.fdopen(fd, "wb") as f:
+            for chunk in encoded_chunks(data):
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        if sha256 is not None and digest.hexdigest() != sha256:
+            raise ChecksumError(f"checksum mismatch: {filename}")
+        install_file(tmp, directory, filename, digest.hexdigest())
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return path, size, digest.hexdigest()
+
+
+def stored_digest(directory, filename, st):
+    """SHA-256 du fichier stocké dont os.stat / os.fstat a donné st, ou None si inconnue."""
+    try:
+        with open(digest_path(directory, filename), encoding="ascii") as f:
+            sha256, size, mtime_ns = f.read().split()
+    except (OSError, ValueError):
+        return None
+    return sha256 if (int(size), int(mtime_ns)) == (st.st_size, st.st_mtime_ns) else None
+
+
+def list_files(directory):
+    """[{filename, size, mtime}] des fichiers stockés."""
+    files = []
+    try:
+        entries = os.scandir(directory or ".")
+    except FileNotFoundError:
+        return files
+    with entries:
+        for entry in entries:
+            if entry.name.startswith(STORED_PREFIX) and entry.is_file():
+                st = entry.stat()
+                name = entry.name[len(STORED_PREFIX):]
+                files.append({
+                    "filename": name,
+                    "size": st.st_size,
+                    "mtime": st.st_mtime,
+                    "sha256": stored_digest(directory, name, st)
+                })
+    files.sort(key=lambda item: item["filename"])
+    return files
+
+
+def open_stored(directory, filename, with_digest=False):
+    """
+    Ouvre un fichier stocké en binaire. Retourne (fichier, taille) ou (None, 0) s'il n'existe pas.
+    with_digest=True: (fichier, taille, sha256 ou None).
+    """
+    path = stored_path(directory, filename)
+    if path is None:
+        return (None, 0, None) if with_digest else (None, 0)
+    try:
+        f = open(path, "rb")
+    except (FileNotFoundError, IsADirectoryError):
+        return (None, 0, None) if with_digest else (None, 0)
+    # taille (et somme) de CE fichier ouvert (un remplacement ultérieur ne le modifie pas)
+    st = os.fstat(f.fileno())
+    if with_digest:
+        return f, st.st_size, stored_digest(directory, filename, st)
+    return f, st.st_size
+
+
+def resolve_range(size, offset=0, length=None):
+    """Plage demandée -> (offset, length) bornée à la taille du fichier, ou None si invalide."""
+    if offset < 0 or offset > size or (length is not None and length < 0):
+        return None
+    available = size - offset
+    return offset, available if length is None else min(length, available)
+
+
+def frames(filename, size, offset, length, chunk=STREAM_CHUNK, sha256=None):
+    """
+    Découpe une plage en trames: (en-tête encodé, offset, longueur) successifs. chunk=None: une seule trame.
+    sha256: somme du fichier entier, ajoutée aux en-têtes (vérification par le destinataire).
+    """
+    chunk = chunk or max(length, 1)
+    position, end = offset, offset + length
+    while True:
+        count = min(chunk, end - position)
+        header = {
+            "type": "FILE_DATA",
+            "filename": filename,
+            "size": size,
+            "offset": position,
+            "length": count,
+            "last": position + count >= end
+        }
+        if sha256 is not None:
+            header["sha256"] = sha256
+        yield encode_json(header), position, count
+        position += count
+        if position >= end:
+            return
+
+
+def _buffer():
+    buf = getattr(_buffers, "buf", None)
+    if buf is None:
+        buf = _buffers.buf = bytearray(STREAM_CHUNK)
+    return buf
+
+
+def send_range(sock, f, offset, length):
+    """Envoie length octets de f à partir de offset (sendfile sur TCP brut, tampon réutilisé sur TLS)."""
+    if length == 0:
+        return 0
+    if not isinstance(sock, ssl.SSLSocket):
+        sent = sock.sendfile(f, offset, length)
+    else:
+        view = memoryview(_buffer())
+        f.seek(offset)
+        sent = 0
+        while sent < length:
+            n = f.readinto(view[:min(len(view), length - sent)])
+            if not n:
+                break
+            sock.sendall(view[:n])
+            sent += n
+    if sent != length:
+        # le pair attend exactement length octets: la connexion n'est plus utilisable
+        raise OSError(f"fichier raccourci pendant l'envoi ({sent}/{length} octets)")
+    return sent
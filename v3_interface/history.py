@@ -0,0 +1,142 @@
+# history.py
+# Historique des derniers MSG relayés, pour les clients qui arrivent en retard.
+#
+# - un tampon circulaire (deque bornée) par cible: "*" (broadcast), "ip:x.x.x.x"
+# - on garde la ligne JSON déjà encodée (bytes) telle qu'envoyée aux clients:
+#   un HISTORY ne ré-encode rien, il concatène des bytes et fait un seul envoi
+# - optionnel: journal append-only sur disque, relu au démarrage pour
+#   reconstruire les tampons (la mémoire reste bornée par HISTORY_SIZE)
+# - le journal est réécrit (compacté) avec le seul contenu des tampons quand il
+#   contient plus de COMPACT_RATIO fois ce qu'ils gardent: sa taille (et la
+#   relecture au démarrage) reste bornée elle aussi
+# - au plus MAX_KEYS cibles: au-delà, celle qui a reçu un message il y a le plus
+#   longtemps est oubliée (un client qui crée salon sur salon ne fait pas
+#   grossir la mémoire ni, après compaction, le journal)
+
+import collections
+import json
+import os
+import threading
+
+HISTORY_SIZE = 200   # messages gardés par cible
+REPLAY_MAX = 200     # messages max renvoyés par requête HISTORY
+COMPACT_RATIO = 2    # lignes du journal / messages gardés au-delà desquelles il est compacté
+MAX_KEYS = 1000      # cibles gardées (les moins récemment utilisées sont oubliées)
+
+
+class HistoryStore:
+    def __init__(self, size=HISTORY_SIZE, log_path=None, max_keys=MAX_KEYS):
+        self.size = size
+        self.log_path = log_path
+        self.max_keys = max_keys
+        # cible -> deque[(server_time, ligne JSON encodée)], de la moins à la plus récemment utilisée
+        self._rings = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._log = None
+        self._kept = 0          # messages gardés dans les tampons
+        self._log_lines = 0     # lignes du journal sur disque
+
+        if log_path:
+            self._load()
+            if self._needs_compaction():
+                self._compact_locked()
+            else:
+                self._log = open(log_path, "ab")
+
+    def _load(self):
+        """
+        Reconstruit les tampons à partir du journal (seule la fin de chaque cible est gardée).
+        Une dernière ligne incomplète (arrêt brutal pendant l'écriture) est retirée du
+        fichier: le journal est rouvert en ajout et la ligne suivante s'y collerait.
+        """
+        if not os.path.exists(self.log_path):
+            return
+        complete = 0   # fin de la dernière ligne complète
+        with open(self.log_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                complete += len(line)
+                try:
+                    key, ts, raw = line.split(b"\t", 2)
+                    json.loads(raw)   # ligne renvoyée telle quelle aux clients: doit être lisible
+                    self._add_locked(key.decode("utf-8"), float(ts), raw)
+                    self._log_lines += 1
+                except ValueError:
+                    # ligne illisible (journal abîmé): ignorée
+                    continue
+        if complete < os.path.getsize(self.log_path):
+            os.truncate(self.log_path, complete)
+
+    def _add_locked(self, key, server_time, raw):
+        ring = self._rings.get(key)
+        if ring is None:
+            if len(self._rings) >= self.max_keys:
+                _, evicted = self._rings.popitem(last=False)
+                self._kept -= len(evicted)
+            ring = self._rings[key] = collections.deque(maxlen=self.size)
+        else:
+            self._rings.move_to_end(key)
+        if len(ring) < self.size:
+            self._kept += 1
+        ring.append((server_time, raw))
+
+    def _needs_compaction(self):
+        return self._log_lines > COMPACT_RATIO * self._kept + self.size
+
+    def _compact_locked(self):
+        """Réécrit le journal avec le contenu des tampons (fichier temporaire puis remplacement atomique)."""
+        if self._log is not None:
+            self._log.close()
+        tmp = self.log_path + ".tmp"
+        with open(tmp, "wb") as f:
+            for key, ring in self._rings.items():
+                prefix = f"{key}\t".encode("utf-8")
+                for server_time, raw in ring:
+                    f.write(prefix + f"{server_time!r}\t".encode("utf-8") + raw)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.log_path)
+        self._log = open(self.log_path, "ab")
+        self._log_lines = self._kept
+
+    def append(self, key, server_time, raw):
+        """Ajoute une ligne déjà encodée (terminée par \\n) à l'historique de key."""
+        with self._lock:
+            self._add_locked(key, server_time, raw)
+            if self._log is not None:
+                self._log.write(f"{key}\t{server_time!r}\t".encode("utf-8") + raw)
+                self._log.flush()
+                self._log_lines += 1
+                if self._needs_compaction():
+                    self._compact_locked()
+
+    def replay(self, key, limit=REPLAY_MAX, since=None):
+        """
+        Retourne (nombre, bytes) des derniers messages de key:
+        les `limit` derniers, ou ceux postérieurs à `since` (timestamp serveur).
+        """
+        limit = max(0, min(limit, REPLAY_MAX))
+        with self._lock:
+            ring = self._rings.get(key)
+            if not ring or limit == 0:
+                return 0, b""
+            entries = list(ring)
+
+        if since is not None:
+            # pas d'ordre garanti sur server_time: les messages relayés gardent l'heure
+            # de leur nœud d'origine (celle que le client a vue et renvoie dans since)
+            # et les horloges des nœuds diffèrent. Au plus size entrées: filtrage linéaire
+            entries = [entry for entry in entries if entry[0] > since]
+        selected = entries[-limit:]
+        return len(selected), b"".join(raw for _, raw in selected)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(ring) for ring in self._rings.values())
+
+    def close(self):
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
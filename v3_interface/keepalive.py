@@ -0,0 +1,130 @@
+# keepalive.py
+# Détection et éviction des connexions inactives (keepalive côté serveur).
+#
+# Chaque connexion garde la date de sa dernière activité. Un seul thread
+# surveille un tas (heap) d'échéances, trié par date :
+# - échéance atteinte sans activité -> le serveur envoie un PING
+# - toujours rien après PING_TIMEOUT -> la connexion est évincée
+# Le tas contient au plus une entrée par connexion, donc le coût reste
+# O(log n) par échéance, quel que soit le nombre de messages échangés.
+# Une connexion fermée laisse son entrée dans le tas (ignorée à l'échéance);
+# quand ces entrées mortes deviennent majoritaires le tas est reconstruit,
+# sinon elles garderaient les sockets fermées en mémoire jusqu'à
+# IDLE_TIMEOUT (des milliers sous un fort renouvellement des connexions).
+
+import heapq
+import itertools
+import threading
+import time
+
+from logs import logger
+
+IDLE_TIMEOUT = 60   # secondes sans activité avant l'envoi d'un PING serveur
+PING_TIMEOUT = 15   # secondes laissées au client pour répondre au PING
+HEAP_SLACK = 64     # entrées mortes tolérées dans le tas avant reconstruction
+
+
+class IdleReaper:
+    """
+    Surveille l'activité des connexions et évince celles qui ne répondent plus.
+    send_ping(conn) : envoie un PING au client
+    on_evict(conn, addr) : appelé (hors verrou) quand une connexion est évincée
+    """
+
+    def __init__(self, send_ping, on_evict, idle_timeout=IDLE_TIMEOUT, ping_timeout=PING_TIMEOUT):
+        self.send_ping = send_ping
+        self.on_evict = on_evict
+        self.idle_timeout = idle_timeout
+        self.ping_timeout = ping_timeout
+
+        # conn -> [dernière activité, date du PING en attente (ou None), addr]
+        self._conns = {}
+        # tas d'échéances: (date, numéro d'ordre, conn)
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+        # compteurs exposés (pings envoyés, connexions évincées)
+        self.pings_sent = 0
+        self.evictions = 0
+
+    def start(self):
+        threading.Thread(target=self._run, name="idle-reaper", daemon=True).start()
+
+    def add(self, conn, addr):
+        """Commence à surveiller une connexion."""
+        now = time.monotonic()
+        with self._cond:
+            self._conns[conn] = [now, None, addr]
+            heapq.heappush(self._heap, (now + self.idle_timeout, next(self._seq), conn))
+            self._cond.notify()
+
+    def remove(self, conn):
+        """Arrête la surveillance (l'entrée du tas sera ignorée à son échéance)."""
+        with self._cond:
+            self._conns.pop(conn, None)
+            if len(self._heap) > 2 * len(self._conns) + HEAP_SLACK:
+                # une entrée par connexion encore suivie: O(n), amorti sur n retraits
+                self._heap = [item for item in self._heap if item[2] in self._conns]
+                heapq.heapify(self._heap)
+
+    def touch(self, conn):
+        """
+        Note une activité sur la connexion (appelé à chaque message reçu).
+        Chemin chaud : pas de verrou, une simple écriture dans une liste.
+        """
+        entry = self._conns.get(conn)
+        if entry is not None:
+            entry[0] = time.monotonic()
+
+    def __len__(self):
+        return len(self._conns)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+
+                deadline, _, conn = self._heap[0]
+                now = time.monotonic()
+                if deadline > now:
+                    self._cond.wait(deadline - now)
+                    continue
+                heapq.heappop(self._heap)
+
+                entry = self._conns.get(conn)
+                if entry is None:
+                    # connexion déjà retirée
+                    continue
+
+                last, pinged, addr = entry
+                if (pinged is None or last > pinged) and last + self.idle_timeout > now:
+                    # activité récente (ou réponse au PING): on replanifie
+                    entry[1] = None
+                    heapq.heappush(self._heap, (last + self.idle_timeout, next(self._seq), conn))
+                    continue
+
+                if pinged is None:
+                    entry[1] = now
+                    heapq.heappush(self._heap, (now + self.ping_timeout, next(self._seq), conn))
+                    action = "ping"
+                else:
+                    del self._conns[conn]
+                    action = "evict"
+
+            # Les envois et fermetures se font hors verrou (ils peuvent bloquer)
+            if action == "ping":
+                try:
+                    self.send_ping(conn)
+                    self.pings_sent += 1
+                    continue
+                except Exception:
+                    # socket déjà morte: inutile d'attendre le PING_TIMEOUT
+                    self.remove(conn)
+
+            self.evictions += 1
+            try:
+                self.on_evict(conn, addr)
+            except Exception as e:
+                logger.warning("[!] Erreur lors de l'éviction de %s: %s", addr, e)
@@ -0,0 +1,258 @@
+# metrics.py
+# Registre de métriques en mémoire (compteurs, jauges, histogrammes de latence).
+# Exposé de deux façons:
+# - texte au format Prometheus sur un petit serveur HTTP local (GET /metrics)
+# - dictionnaire JSON via le message STATS du protocole
+#
+# Sur le chemin chaud, une mise à jour = un verrou non contendu + une addition,
+# ce qui reste négligeable devant un envoi TLS.
+
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Bornes (en secondes) des histogrammes de latence par défaut
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Bornes des histogrammes de taille (nombre de destinataires d'un fan-out)
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+def _label_str(labels):
+    """('type', 'MSG') -> '{type="MSG"}' pour le format Prometheus."""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Counter:
+    """Compteur croissant, éventuellement découpé par une étiquette (ex: type de message)."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, label_value=None):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for label_value, value in items:
+            labels = ((self.label, label_value),) if self.label else ()
+            yield self.name, labels, value
+
+    def snapshot(self):
+        with self._lock:
+            if self.label:
+                return dict(self._values)
+            return self._values.get(None, 0)
+
+
+class Gauge:
+    """
+    Valeur instantanée. Soit mise à jour explicitement (set/inc/dec),
+    soit lue à la demande via une fonction (ex: taille d'une file).
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, func=None):
+        self.name = name
+        self.help = help_text
+        self.func = func
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self._value -= amount
+
+    def get(self):
+        if self.func is not None:
+            try:
+                return self.func()
+            except Exception:
+                return 0
+        return self._value
+
+    def samples(self):
+        yield self.name, (), self.get()
+
+    def snapshot(self):
+        return self.get()
+
+
+class FuncCounter(Gauge):
+    """Compteur dont la valeur est tenue ailleurs (lue via func au moment de l'export)."""
+
+    kind = "counter"
+
+
+class Histogram:
+    """Histogramme à bornes fixes (compte par tranche + somme + nombre d'observations)."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        # une case de plus pour les valeurs au-delà de la dernière borne (+Inf)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+            self._count += 1
+
+    def time(self):
+        """Utilisable en 'with histo.time():' pour mesurer un bloc."""
+        return _Timer(self)
+
+    def samples(self):
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            yield self.name + "_bucket", (("le", bound),), cumulative
+        yield self.name + "_bucket", (("le", "+Inf"),), count
+        yield self.name + "_sum", (), total
+        yield self.name + "_count", (), count
+
+    def snapshot(self):
+        with self._lock:
+            count, total = self._count, self._sum
+        return {
+            "count": count,
+            "sum": round(total, 6),
+            "avg": round(total / count, 6) if count else 0.0,
+        }
+
+
+class HistogramVec:
+    """Famille d'histogrammes découpée par une étiquette (ex: un par type de message)."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.buckets = buckets
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, value):
+        child = self._children.get(value)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(value, Histogram(self.name, self.help, self.buckets))
+        return child
+
+    def samples(self):
+        for value, child in list(self._children.items()):
+            for name, labels, sample in child.samples():
+                yield name, ((self.label, value),) + labels, sample
+
+    def snapshot(self):
+        return {value: child.snapshot() for value, child in list(self._children.items())}
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Registry:
+    """Ensemble nommé de métriques."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, label=None):
+        return self._add(Counter(name, help_text, label))
+
+    def gauge(self, name, help_text, func=None):
+        return self._add(Gauge(name, help_text, func))
+
+    def func_counter(self, name, help_text, func):
+        return self._add(FuncCounter(name, help_text, func))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, buckets))
+
+    def histogram_vec(self, name, help_text, label, buckets=LATENCY_BUCKETS):
+        return self._add(HistogramVec(name, help_text, label, buckets))
+
+    def render(self):
+        """Texte au format d'exposition Prometheus."""
+        lines = []
+        for m in self._metrics.values():
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for name, labels, value in m.samples():
+                lines.append(f"{name}{_label_str(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Dictionnaire {nom: valeur} (pour le message STATS)."""
+        return {name: m.snapshot() for name, m in self._metrics.items()}
+
+
+def serve_http(registry, host, port):
+    """Lance (dans un thread) un serveur HTTP local qui répond GET /metrics."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # pas de log par requête (le scraping est périodique)
+            pass
+
+    httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="metrics-http", daemon=True).start()
+    return httpd
@@ -0,0 +1,216 @@
+# outbox.py
+# File d'attente persistante pour les destinataires hors ligne (store-and-forward).
+#
+# Un MSG / FILE ciblé vers une IP sans client connecté est gardé sur disque
+# au lieu d'être perdu, puis livré quand un client de cette IP se reconnecte.
+#
+# Organisation sur disque, par destinataire:
+#   OUTBOX_DIR/<ip>/00000001.seg, 00000002.seg, ...  (segments append-only)
+#   OUTBOX_DIR/<ip>/cursor                           (octets déjà livrés du 1er segment)
+# Chaque segment contient des lignes JSON déjà encodées, telles qu'elles seront
+# envoyées. La livraison lit les segments par gros blocs (coupés sur une fin
+# de ligne) et fait un seul sendall par bloc: plusieurs messages par écriture.
+# La mémoire utilisée ne dépend pas de la taille de l'arriéré (un bloc à la fois).
+
+import ipaddress
+import os
+import threading
+
+OUTBOX_DIR = "outbox"
+SEGMENT_MAX = 1024 * 1024          # taille max d'un segment avant d'en ouvrir un nouveau
+OUTBOX_MAX_BYTES = 50 * 1024 * 1024  # arriéré max par destinataire
+MAX_RECIPIENTS = 1000              # destinataires hors ligne max
+READ_CHUNK = 256 * 1024            # taille des blocs lus (et envoyés) à la livraison
+LOCK_STRIPES = 64                  # verrous partagés entre destinataires (mémoire bornée)
+
+
+def normalize_ip(value):
+    """Retourne l'IP normalisée, ou None si value n'est pas une adresse IP."""
+    try:
+        return str(ipaddress.ip_address(value))
+    except ValueError:
+        return None
+
+
+class Outbox:
+    def __init__(self, directory=OUTBOX_DIR, segment_max=SEGMENT_MAX, max_bytes=OUTBOX_MAX_BYTES):
+        self.directory = directory
+        self.segment_max = segment_max
+        self.max_bytes = max_bytes
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        # ip -> octets en attente (seule info gardée en mémoire par destinataire)
+        self._pending = {}
+        self._meta_lock = threading.Lock()
+
+        self.queued = 0      # messages mis en attente
+        self.delivered = 0   # messages livrés après reconnexion
+
+        if os.path.isdir(directory):
+            self._scan()
+
+    # -----------------------------------------------------------------
+    # Fichiers
+    # -----------------------------------------------------------------
+    def _dir(self, ip):
+        return os.path.join(self.directory, ip.replace(":", "_"))
+
+    def _segments(self, ip):
+        d = self._dir(ip)
+        if not os.path.isdir(d):
+            return []
+        return sorted(os.path.join(d, n) for n in os.listdir(d) if n.endswith(".seg"))
+
+    def _read_cursor(self, ip):
+        try:
+            with open(os.path.join(self._dir(ip), "cursor"), "r", encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _write_cursor(self, ip, offset):
+        path = os.path.join(self._dir(ip), "cursor")
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(str(offset))
+        os.replace(tmp, path)
+
+    def _scan(self):
+        """Au démarrage: recalcule l'arriéré de chaque destinataire à partir du disque."""
+        for name in os.listdir(self.directory):
+            ip = normalize_ip(name.replace("_", ":"))
+            if ip is None:
+                continue
+            size = sum(os.path.getsize(p) for p in self._segments(ip)) - self._read_cursor(ip)
+            if size > 0:
+                self._pending[ip] = size
+
+    # -----------------------------------------------------------------
+    # API (l'appelant tient lock_for(ip) pour append / deliver)
+    # -----------------------------------------------------------------
+    def lock_for(self, ip):
+        return self._locks[hash(ip) % LOCK_STRIPES]
+
+    def pending(self, ip):
+        return self._pending.get(ip, 0)
+
+    def recipients(self):
+        return len(self._pending)
+
+    def total_bytes(self):
+        return sum(self._pending.values())
+
+    def append(self, ip, raw):
+        """
+        Ajoute une ligne encodée à l'arriéré de ip. Retourne False si la limite est atteinte.
+        OSError si l'écriture échoue (rien n'est alors ajouté).
+        """
+        with self._meta_lock:
+            current = self._pending.get(ip, 0)
+            if current + len(raw) > self.max_bytes:
+                return False
+            if current == 0 and len(self._pending) >= MAX_RECIPIENTS:
+                return False
+            self._pending[ip] = current + len(raw)
+
+        try:
+            segments = self._segments(ip)
+            size = os.path.getsize(segments[-1]) if segments else 0
+            if segments and size + len(raw) <= self.segment_max:
+                path = segments[-1]
+            else:
+                os.makedirs(self._dir(ip), exist_ok=True)
+                number = int(os.path.basename(segments[-1])[:-4]) + 1 if segments else 1
+                path = os.path.join(self._dir(ip), f"{number:08d}.seg")
+                size = 0
+            try:
+                with open(path, "ab") as f:
+                    f.write(raw)
+            except OSError:
+                # pas de ligne partielle dans le segment: la suivante s'y collerait
+                if os.path.exists(path):
+                    os.truncate(path, size)
+                raise
+        except OSError:
+            # écriture ratée (disque plein...): l'arriéré compté reste celui du disque
+            self._consume(ip, len(raw))
+            raise
+        self.queued += 1
+        return True
+
+    def deliver(self, ip, sendall):
+        """
+        Livre l'arriéré de ip via sendall(bytes), bloc par bloc. sendall doit être
+        bloquant: un bloc est retiré de l'arriéré dès son retour.
+        Les segments entièrement livrés sont supprimés; si l'envoi échoue en
+        cours de route, la position est gardée et le segment de tête compacté.
+        Retourne le nombre de messages livrés.
+        """
+        if not self._pending.get(ip):
+            return 0
+
+        count = 0
+        offset = self._read_cursor(ip)
+        try:
+            for path in self._segments(ip):
+                with open(path, "rb") as f:
+                    f.seek(offset)
+                    rest = b""
+                    while True:
+                        chunk = f.read(READ_CHUNK)
+                        if not chunk:
+                            break
+                        data = rest + chunk
+                        # on n'envoie que des lignes complètes
+                        cut = data.rfind(b"\n") + 1
+                        data, rest = data[:cut], data[cut:]
+                        if data:
+                            sendall(data)
+                            offset += len(data)
+                            count += data.count(b"\n")
+                            self._consume(ip, len(data))
+                            # position sauvegardée: pas de re-livraison après un arrêt brutal
+                            self._write_cursor(ip, offset)
+                os.remove(path)
+                offset = 0
+                self._write_cursor(ip, 0)
+        finally:
+            self.delivered += count
+            self._compact(ip, offset)
+        return count
+
+    def _consume(self, ip, size):
+        with self._meta_lock:
+            left = self._pending.get(ip, 0) - size
+            if left > 0:
+                self._pending[ip] = left
+            else:
+                self._pending.pop(ip, None)
+
+    def _compact(self, ip, offset):
+        """
+        Réécrit le segment de tête sans la partie déjà livrée (et remet le
+        curseur à 0), ou supprime le dossier du destinataire s'il est vide.
+        """
+        segments = self._segments(ip)
+        if not segments:
+            d = self._dir(ip)
+            if os.path.isdir(d):
+                for name in os.listdir(d):
+                    os.remove(os.path.join(d, name))
+                os.rmdir(d)
+            with self._meta_lock:
+                self._pending.pop(ip, None)
+            return
+
+        if offset:
+            head = segments[0]
+            tmp = head + ".tmp"
+            with open(head, "rb") as src, open(tmp, "wb") as dst:
+                src.seek(offset)
+                while True:
+                    block = src.read(READ_CHUNK)
+                    if not block:
+                        break
+                    dst.write(block)
+            os.replace(tmp, head)
+        self._write_cursor(ip, 0)
@@ -0,0 +1,132 @@
+# presence.py
+# Liste des utilisateurs en ligne (roster) avec mises à jour incrémentales.
+#
+# À la connexion, un client reçoit une photo complète (ROSTER), puis seulement
+# les différences (ROSTER_DIFF: joined / left). Les changements sont groupés
+# pendant ROSTER_WINDOW secondes: quand N clients se reconnectent en même
+# temps (redémarrage, coupure réseau), chaque abonné reçoit un seul
+# ROSTER_DIFF avec les N arrivées au lieu de N messages, soit ~N messages en
+# tout au lieu de N². Une arrivée suivie d'un départ dans la même fenêtre
+# (ou l'inverse) s'annule et n'est pas envoyée.
+#
+# Une entrée = (ip, utilisateur); plusieurs connexions pour la même paire
+# comptent pour une seule entrée (présente tant qu'il en reste une).
+#
+# "version" augmente de 1 à chaque ROSTER_DIFF: un client qui reçoit la
+# photo version v applique ensuite les diffs v+1, v+2...; photo et diffs sont
+# envoyés sous le même verrou, jamais dans le désordre.
+
+import threading
+import time
+
+from common import encode_json
+
+ROSTER_WINDOW = 0.25   # secondes de regroupement des changements
+
+
+def _entries(pairs):
+    return [{"ip": ip, "user": user} for ip, user in sorted(pairs, key=lambda p: (p[0], p[1] or ""))]
+
+
+class Presence:
+    def __init__(self, send, window=ROSTER_WINDOW):
+        self.send = send              # send(conn, raw): envoi d'une ligne encodée (non bloquant)
+        self.window = window
+        self._counts = {}             # (ip, utilisateur) -> connexions ouvertes
+        self._published = set()       # état déjà annoncé aux abonnés
+        self._changed = set()         # paires modifiées depuis le dernier envoi
+        self._subscribers = set()
+        self._snapshot = None         # photo encodée de _published (une fois par version)
+        self.version = 0
+        self.diffs_sent = 0           # ROSTER_DIFF envoyés (un par abonné)
+        self._cond = threading.Condition()   # RLock: subscribe() appelle snapshot()
+        self._thread = threading.Thread(target=self._flusher, daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._published)
+
+    def add(self, ip, user):
+        """Nouvelle connexion authentifiée pour (ip, user)."""
+        key = (ip, user)
+        with self._cond:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+            if count == 0:
+                self._mark_locked(key)
+
+    def remove(self, ip, user):
+        """Connexion de (ip, user) fermée."""
+        key = (ip, user)
+        with self._cond:
+            count = self._counts.get(key, 0)
+            if count <= 1:
+                if self._counts.pop(key, None) is not None:
+                    self._mark_locked(key)
+            else:
+                self._counts[key] = count - 1
+
+    def _mark_locked(self, key):
+        if not self._changed:
+            self._cond.notify()
+        self._changed.add(key)
+
+    def subscribe(self, conn):
+        """Envoie la photo actuelle à conn puis l'abonne aux ROSTER_DIFF suivants."""
+        with self._cond:
+            self.snapshot(conn)
+            self._subscribers.add(conn)
+
+    def unsubscribe(self, conn):
+        with self._cond:
+            self._subscribers.discard(conn)
+
+    def snapshot(self, conn):
+        """Photo seule (message ROSTER), sans changer l'abonnement."""
+        with self._cond:
+            if self._snapshot is None:
+                self._snapshot = encode_json({
+                    "type": "ROSTER",
+                    "version": self.version,
+                    "users": _entries(self._published),
+                    "server_time": time.time()
+                })
+            self.send(conn, self._snapshot)
+
+    def _flusher(self):
+        while True:
+            with self._cond:
+                while not self._changed:
+                    self._cond.wait()
+            # fenêtre de regroupement à partir du premier changement
+            time.sleep(self.window)
+            with self._cond:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        changed, self._changed = self._changed, set()
+        joined = {k for k in changed if k in self._counts and k not in self._published}
+        left = {k for k in changed if k not in self._counts and k in self._published}
+        if not joined and not left:
+            return
+        self._published |= joined
+        self._published -= left
+        self.version += 1
+        self._snapshot = None
+        raw = encode_json({
+            "type": "ROSTER_DIFF",
+            "version": self.version,
+            "joined": _entries(joined),
+            "left": _entries(left),
+            "server_time": time.time()
+        })
+        dead = []
+        for conn in self._subscribers:
+            try:
+                self.send(conn, raw)
+                self.diffs_sent += 1
+            except Exception:
+                # connexion en cours de fermeture: son thread fera le nettoyage
+                dead.append(conn)
+        self._subscribers.difference_update(dead)
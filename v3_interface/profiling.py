@@ -0,0 +1,211 @@
+# profiling.py
+# Profilage à chaud du serveur, sans redémarrage.
+#
+# cProfile ne suit que le thread qui l'active; or le serveur a un thread par
+# client. On utilise donc un échantillonneur de piles: un thread relève
+# périodiquement la pile de TOUS les threads (sys._current_frames()) et
+# compte les piles observées. Le coût est nul quand il est arrêté.
+#
+# Résultat:
+# - un fichier "collapsed stacks" (une pile par ligne + nombre d'échantillons),
+#   lisible par flamegraph.pl / speedscope
+# - un top des fonctions (échantillons "self" = fonction en haut de pile)
+#
+# Fuites mémoire: MemoryTracer active tracemalloc à chaud (coûteux: ~2x plus
+# lent sur les allocations, réservé aux essais d'endurance) et donne les lieux
+# d'allocation qui ont le plus grossi depuis une référence. process_usage()
+# lit la mémoire résidente, les threads et les descripteurs ouverts (Linux).
+
+import collections
+import gc
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+SAMPLE_INTERVAL = 0.005   # 5 ms entre deux relevés
+MAX_DEPTH = 64            # profondeur de pile max relevée
+
+# Fonctions où un thread attend (socket, verrou): exclues du top
+IDLE_FUNCS = {"readinto", "accept", "wait", "_wait_for_tstate_lock", "serve_forever", "get"}
+
+# Allocations de tracemalloc lui-même et de l'import des modules: exclues du top mémoire
+TRACE_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Échantillonneur de piles pour tous les threads du processus."""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self._stacks = collections.Counter()
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.samples = 0
+        self.started_at = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        """Démarre l'échantillonnage. Retourne False s'il tourne déjà."""
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._stacks.clear()
+            self.samples = 0
+            self.started_at = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """Arrête l'échantillonnage. Retourne False s'il ne tournait pas."""
+        with self._lock:
+            if self._thread is None:
+                return False
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            return True
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_DEPTH:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                # racine -> feuille, comme attendu par le format collapsed
+                self._stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def top(self, limit=15):
+        """[(fonction, échantillons self, échantillons inclusifs)] triés par self."""
+        own = collections.Counter()
+        inclusive = collections.Counter()
+        for stack, count in self._stacks.items():
+            frames = stack.split(";")
+            if frames[-1].split(" ", 1)[0] in IDLE_FUNCS:
+                continue
+            own[frames[-1]] += count
+            for label in set(frames):
+                inclusive[label] += count
+        return [(label, n, inclusive[label]) for label, n in own.most_common(limit)]
+
+    def dump(self, directory):
+        """Écrit les piles au format collapsed et retourne le chemin du fichier."""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, time.strftime("profile-%Y%m%d-%H%M%S.folded"))
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+def process_usage():
+    """
+    (mémoire résidente en octets, threads, descripteurs ouverts) du processus.
+    Lu dans /proc (Linux); ailleurs la mémoire et les descripteurs valent None.
+    """
+    rss = fds = None
+    threads = threading.active_count()
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith("Threads:"):
+                    threads = int(line.split()[1])
+        fds = len(os.listdir("/proc/self/fd"))
+    except OSError:
+        pass
+    return rss, threads, fds
+
+
+def _where(traceback):
+    # appel le plus récent d'abord: "outbox.py:88 <- server.py:630"
+    return " <- ".join(f"{os.path.basename(frame.filename)}:{frame.lineno}" for frame in reversed(traceback))
+
+
+class MemoryTracer:
+    """tracemalloc démarré à chaud, avec une photo de référence pour repérer ce qui grossit."""
+
+    def __init__(self):
+        self.frames = 0
+        self._baseline = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return tracemalloc.is_tracing()
+
+    def start(self, frames=1):
+        """Démarre le suivi (frames = profondeur de pile gardée par allocation)."""
+        with self._lock:
+            if tracemalloc.is_tracing() and frames == self.frames:
+                return False
+            tracemalloc.stop()
+            tracemalloc.start(frames)
+            self.frames = frames
+            self._baseline = None
+            return True
+
+    def stop(self):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                return False
+            tracemalloc.stop()
+            self.frames = 0
+            self._baseline = None
+            return True
+
+    def traced(self):
+        """Octets actuellement suivis (0 si arrêté)."""
+        return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+    def _snapshot(self):
+        # cycles libérés d'abord: seul ce qui est encore référencé compte
+        gc.collect()
+        return tracemalloc.take_snapshot().filter_traces(TRACE_FILTERS)
+
+    def mark(self):
+        """Photo de référence pour top(). Retourne False si le suivi est arrêté."""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                return False
+            self._baseline = self._snapshot()
+            return True
+
+    def top(self, limit=15):
+        """
+        [(lieu, octets, variation, blocs, variation)] triés par croissance depuis
+        mark() (ou par taille sans référence). Liste vide si le suivi est arrêté.
+        """
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                return []
+            snapshot = self._snapshot()
+            key = "traceback" if self.frames > 1 else "lineno"
+            if self._baseline is not None:
+                stats = snapshot.compare_to(self._baseline, key)
+                stats.sort(key=lambda s: (s.size_diff, s.size), reverse=True)
+                return [(_where(s.traceback), s.size, s.size_diff, s.count, s.count_diff) for s in stats[:limit]]
+            stats = snapshot.statistics(key)
+            return [(_where(s.traceback), s.size, s.size, s.count, s.count) for s in stats[:limit]]
@@ -0,0 +1,77 @@
+# rooms.py
+# Salons (rooms): abonnements JOIN / LEAVE et ensembles de membres.
+#
+# Pour chaque salon on garde un tuple de connexions, remplacé en entier à
+# chaque JOIN / LEAVE (copie à l'écriture). Un envoi vers un salon lit donc
+# ce tuple sans verrou et ne touche que ses membres: O(taille du salon)
+# au lieu de O(tous les clients) pour un broadcast.
+
+import threading
+
+MAX_ROOMS_PER_CONN = 50   # salons max par connexion
+ROOM_NAME_MAX = 64        # longueur max d'un nom de salon
+
+
+def valid_room_name(name):
+    # pas de caractère de contrôle: le nom sert de clé d'historique ("room:<nom>"),
+    # écrite telle quelle dans le journal (champs séparés par \t, une ligne par message)
+    return isinstance(name, str) and 0 < len(name) <= ROOM_NAME_MAX and name.isprintable()
+
+
+class RoomTable:
+    def __init__(self, max_rooms_per_conn=MAX_ROOMS_PER_CONN):
+        self.max_rooms_per_conn = max_rooms_per_conn
+        self._members = {}   # salon -> tuple de connexions
+        self._by_conn = {}   # connexion -> set des salons rejoints
+        self._lock = threading.Lock()
+
+    def join(self, conn, room):
+        """Ajoute conn au salon. Retourne le nombre de membres, ou None si la limite est atteinte."""
+        with self._lock:
+            joined = self._by_conn.setdefault(conn, set())
+            if room not in joined:
+                if len(joined) >= self.max_rooms_per_conn:
+                    return None
+                joined.add(room)
+                self._members[room] = self._members.get(room, ()) + (conn,)
+            return len(self._members[room])
+
+    def leave(self, conn, room):
+        """Retire conn du salon. Retourne False s'il n'en faisait pas partie."""
+        if not valid_room_name(room):
+            return False
+        with self._lock:
+            joined = self._by_conn.get(conn)
+            if not joined or room not in joined:
+                return False
+            joined.discard(room)
+            if not joined:
+                del self._by_conn[conn]
+            self._remove_member_locked(conn, room)
+            return True
+
+    def remove_conn(self, conn):
+        """Retire conn de tous ses salons (déconnexion)."""
+        with self._lock:
+            for room in self._by_conn.pop(conn, ()):
+                self._remove_member_locked(conn, room)
+
+    def _remove_member_locked(self, conn, room):
+        members = tuple(c for c in self._members.get(room, ()) if c is not conn)
+        if members:
+            self._members[room] = members
+        else:
+            self._members.pop(room, None)
+
+    def members(self, room):
+        """Membres actuels du salon (tuple immuable, lu sans verrou)."""
+        return self._members.get(room, ())
+
+    def is_member(self, conn, room):
+        return valid_room_name(room) and room in self._by_conn.get(conn, ())
+
+    def rooms_of(self, conn):
+        return sorted(self._by_conn.get(conn, ()))
+
+    def __len__(self):
+        return len(self._members)
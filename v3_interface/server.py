@@ -2,70 +2,1294 @@
 # Serveur TLS + routage par IP.
 # - MSG: broadcast ("to_ip":"*") ou ciblé ("to_ip":"10.192.57.xxx")
 # - FILE: par défaut stocké côté serveur, optionnellement relayé à une IP
+# - FILE_LIST / FILE_GET: liste et téléchargement (par plages) des fichiers stockés
 
+import queue
 import ssl
+import signal
 import socket
 import threading
 import time
-import os
+import sys
 
-from common import send_json, recv_json
+from auth import CredentialStore
+from certauth import CertIdentityCache, configure_client_certs
+from common import encode_json, recv_json_sized
+from config import load_config
+from capture import TrafficRecorder
+from coalesce import FLUSH_TIMEOUT, OutputBuffer
+from dispatch import Connection, Dispatcher, optional
+from drain import Drainer
+from delta import DeltaError, apply_delta, signature
+from federation import Federation
+from filestore import (ChecksumError, frames, list_files, open_stored, resolve_range, safe_filename, send_range,
+                       store_file, text_digest)
+from history import HistoryStore
+from keepalive import IdleReaper
+from logs import logger, setup_logging, stop_logging, summarize, SAMPLED, dropped
+from metrics import Registry, SIZE_BUCKETS, serve_http
+from outbox import Outbox, normalize_ip
+from presence import Presence
+from profiling import MemoryTracer, StackSampler, process_usage
+from replay import NonceCache
+from rooms import RoomTable, valid_room_name
+from tlsconf import apply_tls_settings
+import sockopts
 
 HOST = "0.0.0.0"
 PORT = 5000
 
 RECEIVE_DIR = "received_files"
+# taille max d'un fichier reçu (FILE, ou fichier reconstruit par FILE_DELTA)
+FILE_MAX_BYTES = 64 * 1024 * 1024
+
+# Réglages des sockets (voir sockopts.py)
+LISTEN_BACKLOG = 128          # connexions en attente d'accept(): absorbe les rafales (reconnexions)
+TCP_NODELAY = True            # pas de Nagle: les petits messages partent tout de suite
+SEND_BUFFER = 0               # SO_SNDBUF / SO_RCVBUF en octets, 0 = défaut du système
+RECV_BUFFER = 0
+READ_BUFFER = 2048            # tampon du flux de lecture par connexion (une ligne plus longue est lue
+                              # quand même); petit: mémoire par client inactif (défaut Python 8 Ko)
+TCP_KEEPALIVE = True          # sondes TCP du noyau (en plus du PING applicatif)
+KEEPALIVE_IDLE = 60
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 5
+
+# Écritures groupées (voir coalesce.py): les messages vers un client partent
+# ensemble en un seul sendall / enregistrement TLS. COALESCE_DELAY = plafond
+# de latence ajoutée pour grouper davantage (0 = seulement ce qui s'accumule
+# pendant l'envoi précédent); OUTPUT_MAX_BYTES en attente = client trop lent, coupé.
+# Pris en compte pour les nouvelles connexions.
+COALESCE_DELAY = 0.0
+COALESCE_MAX_BYTES = 64 * 1024
+OUTPUT_MAX_BYTES = 16 * 1024 * 1024
+
+# Liste des utilisateurs en ligne (voir presence.py): ROSTER à la connexion puis
+# ROSTER_DIFF groupés sur ROSTER_WINDOW secondes (reconnexion en masse: ~N
+# messages au lieu de N²)
+ROSTER_WINDOW = 0.25
+
+# Certificat et clé du serveur (relus à chaque rechargement: rotation sans redémarrage)
+CERT_FILE = "../certs/server.crt"
+KEY_FILE = "../certs/server.key"
+
+# Réglages TLS (voir tlsconf.py et bench_tls.py): version minimale ("TLSv1.2" / "TLSv1.3"),
+# suites TLS 1.2 au format OpenSSL et courbe ECDHE (None = défauts d'OpenSSL).
+# Un certificat ECDSA (CERT_FILE / KEY_FILE) rend le handshake bien moins coûteux qu'un RSA.
+TLS_MIN_VERSION = "TLSv1.2"
+TLS_CIPHERS = None
+TLS_CURVE = None
+
+# Fichier de configuration (voir config.py), relu au démarrage puis sur SIGHUP
+# ou message RELOAD (admin). Le nouveau contexte TLS ne sert qu'aux nouveaux
+# handshakes: les connexions en cours ne sont pas coupées.
+CONFIG_FILE = "server.json"
+CONFIG_KEYS = ("HOST", "PORT", "RECEIVE_DIR", "FILE_MAX_BYTES", "CERT_FILE", "KEY_FILE", "CLIENT_CERT_MODE", "CLIENT_CA",
+               "LOG_LEVEL", "MAX_LOGIN_ATTEMPTS", "IDLE_TIMEOUT", "PING_TIMEOUT",
+               "LISTEN_BACKLOG", "TCP_NODELAY", "SEND_BUFFER", "RECV_BUFFER", "READ_BUFFER",
+               "TCP_KEEPALIVE", "KEEPALIVE_IDLE", "KEEPALIVE_INTERVAL", "KEEPALIVE_COUNT",
+               "COALESCE_DELAY", "COALESCE_MAX_BYTES", "OUTPUT_MAX_BYTES", "ROSTER_WINDOW",
+               "TLS_MIN_VERSION", "TLS_CIPHERS", "TLS_CURVE",
+               "OUTBOX_DIR", "HISTORY_LOG", "METRICS_PORT", "NODE_NAME", "PEERS", "FEDERATION_SECRET", "PEER_CA",
+               "CAPTURE_FILE", "TRACEMALLOC_FRAMES")
+# types attendus des clés qui valent None par défaut (None = désactivé / valeur par défaut)
+CONFIG_TYPES = {"TLS_CIPHERS": str, "TLS_CURVE": str, "HISTORY_LOG": str, "CAPTURE_FILE": str,
+                "NODE_NAME": str, "FEDERATION_SECRET": str}
+# socket d'écoute déjà ouverte: pris en compte au redémarrage
+# (les autres réglages des sockets s'appliquent aux nouvelles connexions)
+RESTART_KEYS = {"HOST", "PORT", "LISTEN_BACKLOG", "OUTBOX_DIR", "HISTORY_LOG", "METRICS_PORT",
+                "NODE_NAME", "PEERS", "FEDERATION_SECRET", "PEER_CA"}
+
+# Niveau de log: "DEBUG" pour afficher chaque message reçu (payload tronqué),
+# LOG_SAMPLE_EVERY = N pour n'en garder qu'un sur N
+LOG_LEVEL = "INFO"
+LOG_SAMPLE_EVERY = 1
+
+# Anti-rejeu: LOGIN / MSG / FILE doivent porter un nonce jamais vu et un
+# timestamp proche de l'horloge du serveur (voir replay.py)
+REPLAY_WINDOW = 30
+REPLAY_CHECKED = {"LOGIN", "MSG", "FILE", "FILE_DELTA", "PEER"}
+# nonce enregistré seulement après vérification des identifiants (voir replay.py)
+REPLAY_AFTER_AUTH = {"LOGIN", "PEER"}
+REPLAY_ERRORS = {
+    "invalid": "missing or invalid nonce/timestamp",
+    "stale": "stale timestamp",
+    "replay": "replayed message",
+    "full": "server busy, retry later",
+}
+
+# Base des utilisateurs (créée avec: python auth.py add <utilisateur>)
+USERS_FILE = "users.json"
+MAX_LOGIN_ATTEMPTS = 3   # échecs de LOGIN avant déconnexion
+
+# Certificats clients (TLS mutuel): "off", "optional" ou "required".
+# Un client avec un certificat signé par la CA est connecté sous le CN du certificat, sans LOGIN.
+CLIENT_CERT_MODE = "off"
+CLIENT_CA = "../certs/rootCA.crt"
+
+# Keepalive: PING serveur après IDLE_TIMEOUT s sans activité,
+# éviction si pas de réponse dans les PING_TIMEOUT s suivantes
+IDLE_TIMEOUT = 60
+PING_TIMEOUT = 15
+
+# Endpoint HTTP local des métriques (format Prometheus), 0 = désactivé
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9100
+
+# Profilage à chaud: SIGUSR1 (ou message PROFILE depuis la machine locale)
+# démarre/arrête l'échantillonneur; les piles sont écrites dans PROFILE_DIR
+PROFILE_DIR = "profiles"
+ADMIN_IPS = {"127.0.0.1", "::1"}
+
+# Recherche de fuites: TRACEMALLOC_FRAMES > 0 active tracemalloc (profondeur de
+# pile gardée par allocation); message MEMORY (admin): top des allocations qui
+# grossissent. Mémoire / threads / descripteurs du processus dans les métriques.
+TRACEMALLOC_FRAMES = 0
+
+# Historique des MSG (rejoué sur demande HISTORY); HISTORY_LOG = chemin d'un
+# journal sur disque pour le conserver entre deux redémarrages (None = mémoire seule)
+HISTORY_SIZE = 200
+HISTORY_LOG = None
+
+# MSG / FILE ciblés vers une IP hors ligne: gardés sur disque et livrés à la reconnexion
+OUTBOX_DIR = "outbox"
+
+# Enregistrement du trafic reçu, pour le rejouer avec traffic.py (voir capture.py):
+# chemin du fichier gzip, None = désactivé. Pris en compte par SIGHUP (capture à chaud)
+CAPTURE_FILE = None
+
+# Arrêt propre (SIGTERM, Ctrl-C ou message SHUTDOWN admin): plus de nouvelles connexions,
+# SERVER_CLOSING envoyé aux clients, puis DRAIN_TIMEOUT s pour qu'ils partent d'eux-mêmes.
+# RECONNECT_AFTER: délai max conseillé avant reconnexion (chaque client tire un délai au
+# hasard en dessous, pour étaler les reconnexions); RECONNECT_TO: autre serveur ("hôte:port") ou None
+DRAIN_TIMEOUT = 10
+RECONNECT_AFTER = 5
+RECONNECT_TO = None
+
+# Fédération (voir federation.py): plusieurs serveurs reliés par TLS en un seul
+# domaine de routage. Chaque nœud liste tous les autres dans PEERS ("hôte:port");
+# FEDERATION_SECRET est partagé par tous les nœuds (None = fédération désactivée).
+# Les certificats des autres nœuds sont vérifiés avec PEER_CA.
+NODE_NAME = None        # None = nom de la machine:PORT
+PEERS = []
+FEDERATION_SECRET = None
+PEER_CA = "../certs/rootCA.crt"
 
 # Table des clients connectés: ip -> liste de connexions TLS
 clients_by_ip = {}
 clients_lock = threading.Lock()
 
+# État de chaque connexion ouverte (voir dispatch.Connection): socket -> Connection
+# (adresse, utilisateur, flux de lecture, tampon de sortie, compteurs). Ajoutée
+# dès l'accept, avant LOGIN; Connection.registered = présente dans clients_by_ip.
+connections = {}
+
+# Salons: room -> membres (JOIN / LEAVE)
+rooms = RoomTable()
+
+# Arriéré des destinataires hors ligne
+outbox = Outbox(OUTBOX_DIR)
+
+# Vérification des mots de passe (scrypt dans un pool borné + cache)
+credentials = CredentialStore(USERS_FILE)
+
+# Connexions ouvertes et messages en cours de traitement (pour l'arrêt propre)
+drainer = Drainer()
+listener = None   # socket d'écoute (fermée par request_shutdown)
+
+# Contexte TLS des nouveaux handshakes (remplacé en entier par reload_config)
+tls_context = None
+reload_lock = threading.Lock()
+
+# Identités extraites des certificats clients (par empreinte)
+cert_identities = CertIdentityCache()
+
+# Nonces vus récemment (tranches de temps expirées d'un bloc)
+nonces = NonceCache(REPLAY_WINDOW)
+
+
+def _remove_locked(conn, ip):
+    """Retire conn de la table (clients_lock doit être tenu)."""
+    lst = [c for c in clients_by_ip.get(ip, []) if c is not conn]
+    if lst:
+        clients_by_ip[ip] = lst
+    else:
+        clients_by_ip.pop(ip, None)
+    state = connections.get(conn)
+    if state is not None and state.registered:
+        state.registered = False
+        federation.local_remove(ip, state.username)
+        presence.remove(ip, state.username)
+    presence.unsubscribe(conn)
+    rooms.remove_conn(conn)
+
+
+def flush_outputs(conns, deadline):
+    """Envoie ce qui reste dans les tampons de sortie de conns (tous en parallèle) avant de les couper."""
+    states = [connections.get(c) for c in conns]
+    buffers = [state.output for state in states if state is not None and state.output is not None]
+    for output in buffers:
+        output.finish()
+    for output in buffers:
+        output.close(max(0.0, deadline - time.monotonic()))
+
+
+def _close_quietly(conn):
+    """Coupe la socket: le thread du client sort de readline() et fait son nettoyage."""
+    try:
+        conn.shutdown(socket.SHUT_RDWR)
+    except Exception:
+        pass
+
+
+def server_ping(conn):
+    """PING envoyé par le serveur pour vérifier qu'un client inactif est vivant."""
+    send_json(conn, {
+        "type": "PING",
+        "server_time": time.time()
+    })
+
+
+def evict_client(conn, addr):
+    """Retire un client qui ne répond plus et ferme sa connexion."""
+    logger.info("[-] Client inactif évincé: %s", addr)
+    with clients_lock:
+        _remove_locked(conn, addr[0])
+    _close_quietly(conn)
+
+
+reaper = IdleReaper(server_ping, evict_client, IDLE_TIMEOUT, PING_TIMEOUT)
+
+# ---------------------------------------------------------------------
+# Métriques du serveur
+# ---------------------------------------------------------------------
+registry = Registry()
+
+CONNECTIONS = registry.counter("chat_connections_total", "Connexions TCP acceptées")
+HANDSHAKES = registry.counter("chat_tls_handshakes_total", "Handshakes TLS par résultat", label="result")
+HANDSHAKE_TIME = registry.histogram("chat_tls_handshake_seconds", "Durée des handshakes TLS")
+SESSIONS_RESUMED = registry.counter("chat_tls_sessions_resumed_total", "Handshakes avec reprise de session TLS")
+# types sans handler comptés sous "other" (pas d'étiquettes illimitées)
+MESSAGES = registry.counter("chat_messages_total", "Messages reçus par type", label="type")
+BYTES_IN = registry.counter("chat_bytes_in_total", "Octets applicatifs reçus")
+BYTES_OUT = registry.counter("chat_bytes_out_total", "Octets applicatifs envoyés")
+FANOUT_SIZE = registry.histogram("chat_fanout_recipients", "Destinataires par envoi routé", SIZE_BUCKETS)
+FANOUT_TIME = registry.histogram("chat_fanout_seconds", "Durée des envois routés (broadcast / to_ip)")
+LOGINS = registry.counter("chat_logins_total", "LOGIN par résultat (ok / invalid / busy / cert)", label="result")
+LOGIN_TIME = registry.histogram("chat_login_seconds", "Durée de vérification des LOGIN")
+FILE_STORE_TIME = registry.histogram("chat_file_store_seconds", "Durée d'écriture des fichiers stockés")
+FILE_SIG_TIME = registry.histogram("chat_file_signature_seconds", "Durée de calcul des signatures FILE_SIG")
+FILE_DELTA_BYTES = registry.counter("chat_file_delta_bytes_total", "Octets des fichiers reçus par FILE_DELTA",
+                                    label="source")
+FILE_SERVE_TIME = registry.histogram("chat_file_get_seconds", "Durée des téléchargements FILE_GET")
+DISPATCH_TIME = registry.histogram_vec("chat_dispatch_seconds", "Temps de traitement par type de message", "type")
+RELOADS = registry.counter("chat_config_reloads_total", "Rechargements de la configuration par résultat",
+                           label="result")
+REPLAY_REJECTS = registry.counter("chat_replay_rejected_total", "Messages refusés par l'anti-rejeu", label="reason")
+
+registry.gauge("chat_clients_connected", "Connexions enregistrées dans la table de routage",
+               func=lambda: sum(len(conns) for conns in clients_by_ip.values()))
+registry.gauge("chat_rooms", "Salons ayant au moins un membre", func=lambda: len(rooms))
+registry.gauge("chat_outbox_recipients", "Destinataires hors ligne avec messages en attente",
+               func=lambda: outbox.recipients())
+registry.gauge("chat_outbox_bytes", "Octets en attente de livraison", func=lambda: outbox.total_bytes())
+registry.func_counter("chat_outbox_queued_total", "Messages mis en attente (destinataire hors ligne)",
+                      func=lambda: outbox.queued)
+registry.func_counter("chat_outbox_delivered_total", "Messages en attente livrés à la reconnexion",
+                      func=lambda: outbox.delivered)
+registry.gauge("chat_auth_kdf_in_flight", "Calculs scrypt en cours ou en attente",
+               func=lambda: credentials.in_flight)
+registry.func_counter("chat_auth_cache_hits_total", "LOGIN validés par le cache (sans scrypt)",
+                      func=lambda: credentials.cache_hits)
+registry.func_counter("chat_cert_identity_cache_hits_total", "Certificats clients reconnus par le cache",
+                      func=lambda: cert_identities.hits)
+registry.gauge("chat_replay_nonces", "Nonces gardés par l'anti-rejeu", func=lambda: len(nonces))
+registry.gauge("chat_federation_links", "Liens ouverts avec les autres nœuds", func=lambda: federation.links())
+registry.gauge("chat_federation_remote_routes", "Paires IP / utilisateur annoncées par les autres nœuds",
+               func=lambda: federation.remote_routes())
+registry.func_counter("chat_federation_forwarded_total", "Messages relayés vers un autre nœud",
+                      func=lambda: federation.forwarded)
+registry.func_counter("chat_federation_frames_total", "Trames FED envoyées (plusieurs messages par trame)",
+                      func=lambda: federation.frames_sent)
+registry.func_counter("chat_federation_items_total", "Éléments (messages + routes) envoyés dans les trames FED",
+                      func=lambda: federation.items_sent)
+registry.gauge("chat_keepalive_tracked", "Connexions surveillées par le keepalive", func=lambda: len(reaper))
+registry.func_counter("chat_keepalive_pings_total", "PING envoyés aux clients inactifs",
+                      func=lambda: reaper.pings_sent)
+registry.func_counter("chat_evictions_total", "Connexions évincées (inactives ou envoi en échec)",
+                      func=lambda: reaper.evictions)
+registry.func_counter("chat_log_dropped_total", "Lignes de log abandonnées (file pleine)", func=dropped)
+
+
+# Un tampon de sortie par connexion (Connection.output, voir coalesce.py): les
+# écritures de plusieurs threads (réponses, broadcasts, PING) sont mises en file
+# dans l'ordre et groupées; les trames FILE_DATA passent par OutputBuffer.exclusive()
+registry.func_counter("chat_output_messages_total", "Messages mis en file de sortie",
+                      func=lambda: OutputBuffer.messages_total)
+registry.func_counter("chat_output_writes_total", "Écritures sur les sockets (plusieurs messages par écriture)",
+                      func=lambda: OutputBuffer.writes_total)
+registry.func_counter("chat_output_overflows_total", "Clients coupés: file de sortie pleine",
+                      func=lambda: OutputBuffer.overflows_total)
+
+
+def send_raw(conn, raw):
+    """Envoie une ou plusieurs lignes JSON déjà encodées (+ comptage des octets)."""
+    state = connections.get(conn)
+    if state is None or state.output is None:
+        conn.sendall(raw)
+    else:
+        state.output.write(raw)
+    BYTES_OUT.inc(len(raw))
+
+
+def send_raw_blocking(conn, raw):
+    """Comme send_raw, mais ne revient qu'une fois raw écrit sur la socket (après ce qui était en file)."""
+    state = connections.get(conn)
+    if state is None or state.output is None:
+        conn.sendall(raw)
+    else:
+        _send_exclusive(state.output, raw)
+    BYTES_OUT.inc(len(raw))
+
+
+def send_json(conn, data):
+    """Comme send_json de common.py, avec comptage des octets envoyés."""
+    send_raw(conn, encode_json(data))
+
+
+# Utilisateurs en ligne (ROSTER / ROSTER_DIFF); fenêtre mise à jour par reload_config
+presence = Presence(send_raw, ROSTER_WINDOW)
+registry.gauge("chat_roster_users", "Paires IP / utilisateur annoncées dans le roster", func=lambda: len(presence))
+registry.gauge("chat_roster_version", "Version du roster (un ROSTER_DIFF par version)",
+               func=lambda: presence.version)
+registry.func_counter("chat_roster_diffs_total", "ROSTER_DIFF envoyés (un par abonné)",
+                      func=lambda: presence.diffs_sent)
+
+
+# Historique en mémoire; main() le remplace par une version journalisée si HISTORY_LOG est défini
+history = HistoryStore(HISTORY_SIZE)
+registry.gauge("chat_history_messages", "MSG gardés en historique", func=lambda: len(history))
+
+# Enregistreur du trafic (None tant que CAPTURE_FILE n'est pas défini)
+recorder = None
+registry.func_counter("chat_capture_messages_total", "Messages écrits dans CAPTURE_FILE",
+                      func=lambda: recorder.recorded if recorder is not None else 0)
+registry.func_counter("chat_capture_dropped_total", "Messages non enregistrés (file d'écriture pleine)",
+                      func=lambda: recorder.dropped if recorder is not None else 0)
+
+
+# ---------------------------------------------------------------------
+# Profilage à chaud
+# ---------------------------------------------------------------------
+sampler = StackSampler()
+tracer = MemoryTracer()
 
-def register_client(conn, addr):
-    """Ajoute un client dans la table."""
+registry.gauge("chat_process_resident_bytes", "Mémoire résidente du serveur", func=lambda: process_usage()[0] or 0)
+registry.gauge("chat_process_threads", "Threads du serveur", func=lambda: process_usage()[1])
+registry.gauge("chat_process_open_fds", "Descripteurs de fichiers ouverts", func=lambda: process_usage()[2] or 0)
+registry.gauge("chat_tracemalloc_bytes", "Octets suivis par tracemalloc (0 = arrêté)", func=lambda: tracer.traced())
+
+
+def profile_start():
+    started = sampler.start()
+    if started:
+        logger.info("[*] Profilage démarré")
+    return started
+
+
+def profile_stop():
+    """Arrête le profilage, écrit les piles et retourne (chemin, top des fonctions)."""
+    if not sampler.stop():
+        return None, []
+    path = sampler.dump(PROFILE_DIR)
+    top = sampler.top()
+    logger.info("[*] Profilage arrêté (%s relevés) -> %s", sampler.samples, path)
+    for label, own, inclusive in top:
+        logger.info("    %6d self %6d incl  %s", own, inclusive, label)
+    return path, top
+
+
+def profile_toggle(signum=None, frame=None):
+    """SIGUSR1 (exécuté par signal_worker): démarre ou arrête le profilage."""
+    if sampler.running:
+        profile_stop()
+    else:
+        profile_start()
+
+
+# ---------------------------------------------------------------------
+# Configuration et rechargement à chaud
+# ---------------------------------------------------------------------
+def build_tls_context(certfile, keyfile, client_cert_mode, client_ca,
+                      min_version="TLSv1.2", ciphers=None, curve=None):
+    """Nouveau contexte TLS serveur (lève OSError / ssl.SSLError / ValueError si la config est invalide)."""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    apply_tls_settings(context, min_version, ciphers, curve)
+    context.load_cert_chain(certfile=certfile, keyfile=keyfile)
+    configure_client_certs(context, client_cert_mode, client_ca)
+    return context
+
+
+def reload_config(startup=False):
+    """
+    Relit CONFIG_FILE et les certificats, puis remplace le contexte TLS.
+    Tout est validé avant d'appliquer quoi que ce soit: en cas d'erreur
+    (JSON invalide, certificat illisible...) la configuration actuelle est gardée.
+    Retourne (True, constantes modifiées) ou (False, message d'erreur).
+    """
+    global tls_context
+
+    with reload_lock:
+        current = {name: globals()[name] for name in CONFIG_KEYS}
+        try:
+            values = load_config(CONFIG_FILE, current, CONFIG_TYPES)
+            merged = {**current, **values}
+            context = build_tls_context(merged["CERT_FILE"], merged["KEY_FILE"],
+                                        merged["CLIENT_CERT_MODE"], merged["CLIENT_CA"],
+                                        merged["TLS_MIN_VERSION"], merged["TLS_CIPHERS"], merged["TLS_CURVE"])
+            logger.setLevel(merged["LOG_LEVEL"])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            RELOADS.inc(label_value="failed")
+            logger.error("[!] Configuration refusée (%s), configuration actuelle conservée", e)
+            return False, str(e)
+
+        changed = sorted(name for name in CONFIG_KEYS if merged[name] != current[name])
+        for name in changed:
+            if name in RESTART_KEYS and not startup:
+                logger.warning("[!] %s modifié: pris en compte au prochain redémarrage", name)
+            else:
+                globals()[name] = merged[name]
+
+        reaper.idle_timeout = IDLE_TIMEOUT
+        reaper.ping_timeout = PING_TIMEOUT
+        presence.window = ROSTER_WINDOW
+        tls_context = context
+        apply_capture()
+        apply_tracemalloc()
+
+    RELOADS.inc(label_value="ok")
+    if not startup:
+        logger.info("[*] Configuration rechargée (modifié: %s)", ", ".join(changed) or "certificats seulement")
+    return True, changed
+
+
+def apply_capture():
+    """Démarre, change ou arrête l'enregistrement du trafic selon CAPTURE_FILE."""
+    global recorder
+    current = recorder.path if recorder is not None else None
+    if CAPTURE_FILE == current:
+        return
+    if recorder is not None:
+        old, recorder = recorder, None
+        old.close()
+        logger.info("[*] Capture terminée: %s (%s messages, %s perdus)", old.path, old.recorded, old.dropped)
+    if CAPTURE_FILE:
+        try:
+            recorder = TrafficRecorder(CAPTURE_FILE, server="v3")
+        except OSError as e:
+            logger.error("[!] Capture impossible dans %s: %s", CAPTURE_FILE, e)
+            return
+        logger.info("[*] Capture du trafic dans %s", CAPTURE_FILE)
+
+
+def apply_tracemalloc():
+    """Démarre ou arrête tracemalloc selon TRACEMALLOC_FRAMES."""
+    if TRACEMALLOC_FRAMES > 0:
+        if tracer.start(TRACEMALLOC_FRAMES):
+            logger.info("[*] tracemalloc démarré (%s niveau(x) de pile)", TRACEMALLOC_FRAMES)
+    elif tracer.stop():
+        logger.info("[*] tracemalloc arrêté")
+
+
+def reload_signal(signum=None, frame=None):
+    """SIGHUP (exécuté par signal_worker)."""
+    reload_config()
+
+
+# Signaux: le gestionnaire s'exécute dans le thread principal, entre deux
+# instructions, peut-être pendant que celui-ci tient un verrou (file du logger,
+# reload_lock...). Il ne fait donc que mettre l'action en file (SimpleQueue.put
+# est réentrant); signal_worker l'exécute dans un thread à part.
+signal_actions = queue.SimpleQueue()
+
+
+def signal_worker():
+    while True:
+        action = signal_actions.get()
+        try:
+            action()
+        except Exception as e:
+            logger.error("[!] Erreur en traitant un signal: %s", e)
+
+
+def deferred(action):
+    """Gestionnaire de signal qui confie action à signal_worker."""
+    def handler(signum, frame):
+        signal_actions.put(action)
+    return handler
+
+
+# ---------------------------------------------------------------------
+# Arrêt propre
+# ---------------------------------------------------------------------
+def request_shutdown(reason):
+    """Passe en mode drain: la boucle d'acceptation s'arrête, main() appelle drain()."""
+    if drainer.closing.is_set():
+        return False
+    drainer.closing.set()
+    logger.info("[*] Arrêt demandé (%s): plus de nouvelles connexions", reason)
+    if listener is not None:
+        try:
+            # débloque accept() dans le thread principal
+            listener.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    return True
+
+
+def shutdown_signal(signum=None, frame=None):
+    """Gestionnaire de SIGTERM / SIGINT. Un second signal pendant le drain arrête tout de suite."""
+    if drainer.closing.is_set():
+        raise KeyboardInterrupt
+    reason = signal.Signals(signum).name if signum else "signal"
+    signal_actions.put(lambda: request_shutdown(reason))
+
+
+def drain():
+    """Prévient les clients, les laisse partir puis ferme ce qui reste à l'échéance."""
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    notice = encode_json({
+        "type": "SERVER_CLOSING",
+        "reconnect_after": RECONNECT_AFTER,
+        "reconnect_to": RECONNECT_TO,
+        "deadline": DRAIN_TIMEOUT,
+        "server_time": time.time()
+    })
+    conns = drainer.connections()
+    for c in conns:
+        try:
+            send_raw(c, notice)
+        except Exception:
+            pass
+    logger.info("[*] SERVER_CLOSING envoyé à %s connexion(s), échéance %s s", len(conns), DRAIN_TIMEOUT)
+
+    # pendant ce temps les messages reçus sont traités normalement
+    if not drainer.wait_disconnected(deadline):
+        # plus aucun nouveau message; ceux en cours (écriture FILE, relais) se terminent
+        drainer.stopping = True
+        if not drainer.wait_idle(time.monotonic() + DRAIN_TIMEOUT):
+            logger.warning("[!] Traitements encore en cours à l'échéance")
+        remaining = drainer.connections()
+        logger.info("[*] Échéance atteinte: fermeture de %s connexion(s)", len(remaining))
+        flush_outputs(remaining, time.monotonic() + FLUSH_TIMEOUT)
+        for c in remaining:
+            _close_quietly(c)
+        drainer.wait_disconnected(time.monotonic() + 2)
+
+    federation.close()
+    history.close()
+    if recorder is not None:
+        recorder.close()
+    logger.info("[*] Serveur arrêté")
+
+
+def tune_connection(conn):
+    """Réglages d'une connexion acceptée (avant le handshake TLS)."""
+    sockopts.tune(conn, TCP_NODELAY, TCP_KEEPALIVE, KEEPALIVE_IDLE, KEEPALIVE_INTERVAL,
+                  KEEPALIVE_COUNT, SEND_BUFFER, RECV_BUFFER)
+
+
+def register_client(conn, addr, username):
+    """Ajoute un client (authentifié) dans la table de routage (annoncé aux autres nœuds)."""
     ip = addr[0]
     with clients_lock:
         clients_by_ip.setdefault(ip, []).append(conn)
+        connections[conn].registered = True
+        federation.local_add(ip, username)
+        presence.add(ip, username)
 
 
 def unregister_client(conn, addr):
     """Retire un client de la table."""
-    ip = addr[0]
     with clients_lock:
-        lst = clients_by_ip.get(ip, [])
-        lst = [c for c in lst if c is not conn]
-        if lst:
-            clients_by_ip[ip] = lst
-        else:
-            clients_by_ip.pop(ip, None)
+        _remove_locked(conn, addr[0])
+    reaper.remove(conn)
+
+
+def _drop_dead(dead):
+    """Retire de la table les connexions dont l'envoi a échoué."""
+    if not dead:
+        return
+    with clients_lock:
+        for c in dead:
+            state = connections.get(c)
+            if state is not None and state.registered:
+                _remove_locked(c, state.addr[0])
+    for c in dead:
+        reaper.remove(c)
+        reaper.evictions += 1
+        _close_quietly(c)
 
 
 def broadcast(payload, exclude_conn=None):
     """Envoie payload à tous les clients."""
+    broadcast_raw(encode_json(payload), exclude_conn)
+
+
+def broadcast_raw(raw, exclude_conn=None):
+    """Envoie une ligne déjà encodée à tous les clients (encodée une seule fois pour tous)."""
+    start = time.perf_counter()
+    count = 0
+    dead = []
     with clients_lock:
         for ip, conns in list(clients_by_ip.items()):
             for c in list(conns):
                 if exclude_conn is not None and c is exclude_conn:
                     continue
                 try:
-                    send_json(c, payload)
+                    send_raw(c, raw)
+                    count += 1
                 except Exception:
-                    # client mort, on ignore ici (le cleanup arrivera à la déconnexion)
-                    pass
+                    # client mort: on le retire tout de suite pour ne plus lui envoyer
+                    dead.append(c)
+    _drop_dead(dead)
+    FANOUT_SIZE.observe(count)
+    FANOUT_TIME.observe(time.perf_counter() - start)
 
 
 def send_to_ip(target_ip, payload):
     """Envoie payload à tous les clients enregistrés sur target_ip. Retourne True si au moins 1 envoi."""
-    sent = False
+    return send_raw_to_ip(target_ip, encode_json(payload))
+
+
+def send_raw_to_ip(target_ip, raw):
+    """Comme send_to_ip, avec une ligne déjà encodée."""
+    start = time.perf_counter()
+    count = 0
+    dead = []
     with clients_lock:
         conns = clients_by_ip.get(target_ip, [])
         for c in list(conns):
             try:
-                send_json(c, payload)
-                sent = True
+                send_raw(c, raw)
+                count += 1
             except Exception:
-                pass
-    return sent
+                dead.append(c)
+    _drop_dead(dead)
+    FANOUT_SIZE.observe(count)
+    FANOUT_TIME.observe(time.perf_counter() - start)
+    return count > 0
+
+
+def send_or_queue(target_ip, raw, server_time=None, forward=True):
+    """
+    Envoie aux clients de target_ip (ici et sur les autres nœuds qui l'hébergent),
+    ou garde le message dans l'outbox s'il n'y en a aucun.
+    server_time: heure du MSG pour l'historique des autres nœuds (None = pas d'historique).
+    Retourne "delivered", "queued", "invalid" (pas une IP) ou "full" (arriéré plein).
+    """
+    local = send_raw_to_ip(target_ip, raw)
+    remote = federation.forward(target_ip, raw, server_time) if forward else 0
+    if local or remote:
+        return "delivered"
+    ip = normalize_ip(target_ip)
+    if ip is None:
+        return "invalid"
+    with outbox.lock_for(ip):
+        # le destinataire a pu se reconnecter (et vider son arriéré) entre-temps
+        if send_raw_to_ip(ip, raw):
+            return "delivered"
+        return "queued" if outbox.append(ip, raw) else "full"
+
+
+def send_raw_to_room(room, raw):
+    """Envoie une ligne encodée aux seuls membres du salon. Retourne le nombre d'envois."""
+    start = time.perf_counter()
+    count = 0
+    dead = []
+    # tuple immuable: pas besoin de tenir un verrou pendant les envois
+    for c in rooms.members(room):
+        try:
+            send_raw(c, raw)
+            count += 1
+        except Exception:
+            dead.append(c)
+    _drop_dead(dead)
+    FANOUT_SIZE.observe(count)
+    FANOUT_TIME.observe(time.perf_counter() - start)
+    return count
+
+
+def deliver_forwarded(to, raw, server_time):
+    """Message relayé par un autre nœud: livraison locale seulement (jamais relayé à nouveau)."""
+    if to == "*":
+        broadcast_raw(raw)
+        key = "*"
+    else:
+        # le destinataire a pu partir entre-temps: gardé dans l'outbox de ce nœud
+        send_or_queue(to, raw, forward=False)
+        key = f"ip:{to}"
+    if server_time is not None:
+        history.append(key, server_time, raw)
+
+
+federation = Federation(deliver_forwarded, log=logger.info)
+
+
+def complete_login(conn, addr, username, message):
+    """
+    Connexion authentifiée (mot de passe ou certificat): OK, livraison de l'arriéré
+    puis enregistrement, sous le même verrou: un message pour cette IP est soit
+    dans l'arriéré, soit envoyé en direct.
+    """
+    send_json(conn, {
+        "type": "OK",
+        "message": message,
+        "server_time": time.time()
+    })
+
+    ip = addr[0]
+    with outbox.lock_for(ip):
+        # envoi bloquant: un bloc n'est retiré de l'arriéré qu'une fois écrit sur la socket
+        # (l'arriéré dépasse la file de sortie, bornée: un lecteur lent y perdrait la suite)
+        delivered = outbox.deliver(ip, lambda data: send_raw_blocking(conn, data))
+        register_client(conn, addr, username)
+    # photo des présents, puis ROSTER_DIFF au fil des arrivées / départs
+    presence.subscribe(conn)
+    if delivered:
+        logger.info("[+] %s message(s) en attente livré(s) à %s", delivered, addr)
+
+
+# ---------------------------------------------------------------------
+# Handlers des messages (un par type, voir dispatch.py)
+# ---------------------------------------------------------------------
+def check_replay(session, msg):
+    """Anti-rejeu des types REPLAY_CHECKED: un message capturé puis renvoyé (même nonce) ou trop ancien est refusé."""
+    if msg["type"] not in REPLAY_CHECKED:
+        return None
+    if msg["type"] in REPLAY_AFTER_AUTH:
+        result = nonces.precheck(msg.get("nonce"), msg.get("timestamp"))
+    else:
+        result = nonces.check(msg.get("nonce"), msg.get("timestamp"))
+    return _replay_error(session, msg, result)
+
+
+def record_nonce(session, msg):
+    """Enregistre le nonce d'un LOGIN / PEER une fois authentifié. Retourne None ou le message d'erreur."""
+    return _replay_error(session, msg, nonces.check(msg.get("nonce"), msg.get("timestamp")))
+
+
+def _replay_error(session, msg, result):
+    if result == "ok":
+        return None
+    REPLAY_REJECTS.inc(label_value=result)
+    logger.warning("[!] %s refusé (%s) de %s", msg["type"], result, session.addr)
+    return REPLAY_ERRORS[result]
+
+
+dispatcher = Dispatcher(send_json, guard=check_replay,
+                        observe=lambda kind, seconds: DISPATCH_TIME.labels(kind).observe(seconds))
+
+
+def is_admin(session):
+    """Commandes d'admin acceptées uniquement depuis ADMIN_IPS (sinon ERR envoyée)."""
+    if session.addr[0] in ADMIN_IPS:
+        return True
+    dispatcher.error(session, "admin only")
+    return False
+
+
+@dispatcher.register("LOGIN", {"username": str, "password": str}, public=True)
+def handle_login(session, msg):
+    if session.username is not None:
+        dispatcher.error(session, "already logged in")
+        return False
+
+    # Vérification du mot de passe (hash scrypt, calculé hors de ce thread)
+    with LOGIN_TIME.time():
+        result = credentials.verify(msg["username"], msg["password"])
+    LOGINS.inc(label_value=result)
+
+    if result == "ok":
+        error = record_nonce(session, msg)
+        if error is not None:
+            dispatcher.error(session, error)
+            return False
+        session.username = msg["username"]
+        complete_login(session.conn, session.addr, session.username, "login accepted (v2 TLS + routing)")
+        return False
+
+    # "busy" (pool scrypt saturé) n'est pas un échec: le client peut réessayer
+    session.failures += result == "invalid"
+    dispatcher.error(session, "server busy, retry later" if result == "busy" else "invalid credentials")
+    if session.failures >= MAX_LOGIN_ATTEMPTS:
+        logger.warning("[!] Trop d'échecs de LOGIN, déconnexion: %s", session.addr)
+        return True
+    return False
+
+
+@dispatcher.register("MSG", {"payload": optional(str, ""), "to_ip": optional(str, "*"), "room": optional(str)})
+def handle_msg(session, msg):
+    conn, addr = session.conn, session.addr
+    to_ip = msg["to_ip"]   # "*" = broadcast
+    room = msg["room"]     # si présent: envoi aux membres du salon
+
+    server_time = time.time()
+    outgoing = {
+        "type": "MSG",
+        "from": session.username,
+        "payload": msg["payload"],
+        "from_ip": addr[0],
+        "server_time": server_time
+    }
+    if room is not None:
+        outgoing["room"] = room
+    # encodé une fois: même bytes pour tous les destinataires et pour l'historique
+    raw = encode_json(outgoing)
+
+    if room is not None:
+        if not rooms.is_member(conn, room):
+            dispatcher.error(session, f"not a member of room: {room}")
+        else:
+            count = send_raw_to_room(room, raw)
+            history.append(f"room:{room}", server_time, raw)
+            send_json(conn, {
+                "type": "ACK",
+                "delivered_to": f"room:{room}",
+                "recipients": count,
+                "server_time": time.time()
+            })
+
+    elif to_ip == "*" or to_ip == "":
+        # broadcast à tous (option: exclure l'émetteur si tu veux), ici et sur les autres nœuds
+        broadcast_raw(raw, exclude_conn=None)
+        federation.forward("*", raw, server_time)
+        history.append("*", server_time, raw)
+
+        # accusé au sender (pratique UI)
+        send_json(conn, {
+            "type": "ACK",
+            "delivered_to": "*",
+            "server_time": time.time()
+        })
+    else:
+        status = send_or_queue(to_ip, raw, server_time)
+        if status in ("delivered", "queued"):
+            history.append(f"ip:{to_ip}", server_time, raw)
+            send_json(conn, {
+                "type": "ACK",
+                "delivered_to": to_ip,
+                "queued": status == "queued",
+                "server_time": time.time()
+            })
+        else:
+            dispatcher.error(session, f"unknown recipient ip: {to_ip}" if status == "invalid"
+                             else f"outbox full for: {to_ip}")
+    return False
+
+
+@dispatcher.register("FILE", {"filename": optional(str, "received.txt"), "payload": optional(str, ""),
+                              "to_ip": optional(str, "*"), "room": optional(str), "sha256": optional(str)})
+def handle_file(session, msg):
+    # Trois modes:
+    # - to_ip="*" ou absent -> stocker sur le serveur
+    # - to_ip="x.x.x.x" -> relayer le fichier au(x) client(s) de cette IP
+    # - room="nom" -> relayer le fichier aux membres du salon
+    # sha256 (optionnel): somme des octets UTF-8 du payload, vérifiée ici puis
+    # transmise aux destinataires, qui la vérifient à leur tour
+    conn, addr = session.conn, session.addr
+    filename = msg["filename"]
+    data = msg["payload"]
+    to_ip = msg["to_ip"]
+    room = msg["room"]
+
+    # nom simple uniquement (stocké ici ou enregistré tel quel par les destinataires)
+    if safe_filename(filename) is None:
+        dispatcher.error(session, f"invalid filename: {filename}")
+        return False
+    # caractères: chacun fait au moins un octet en UTF-8
+    if len(data) > FILE_MAX_BYTES:
+        dispatcher.error(session, f"file too large: {filename}")
+        return False
+
+    if to_ip == "*" or to_ip == "":
+        size = sha256 = None   # calculés pendant l'écriture
+    else:
+        # relai: somme calculée ici en un passage (rien n'est écrit sur le disque)
+        size, sha256 = text_digest(data)
+        if msg["sha256"] is not None and msg["sha256"] != sha256:
+            dispatcher.error(session, f"checksum mismatch: {filename}")
+            return False
+
+    if room is not None:
+        if not rooms.is_member(conn, room):
+            dispatcher.error(session, f"not a member of room: {room}")
+        else:
+            count = send_raw_to_room(room, encode_json({
+                "type": "FILE_FROM",
+                "from": session.username,
+                "from_ip": addr[0],
+                "room": room,
+                "filename": filename,
+                "payload": data,
+                "size": size,
+                "sha256": sha256,
+                "server_time": time.time()
+            }))
+            send_json(conn, {
+                "type": "ACK_FILE",
+                "mode": "relayed",
+                "room": room,
+                "recipients": count,
+                "filename": filename,
+                "size": size,
+                "sha256": sha256,
+                "server_time": time.time()
+            })
+
+    elif to_ip == "*" or to_ip == "":
+        try:
+            with FILE_STORE_TIME.time():
+                _, size, sha256 = store_file(RECEIVE_DIR, filename, data, msg["sha256"])
+        except ChecksumError as e:
+            logger.warning("[!] FILE %s de %s refusé: %s", filename, addr, e)
+            dispatcher.error(session, str(e))
+            return False
+        logger.info("[FILE] Stockage fichier %s de %s, taille: %s octets", filename, addr, size)
+
+        send_json(conn, {
+            "type": "ACK_FILE",
+            "mode": "stored_on_server",
+            "filename": filename,
+            "size": size,
+            "sha256": sha256,
+            "server_time": time.time()
+        })
+    else:
+        outgoing = {
+            "type": "FILE_FROM",
+            "from": session.username,
+            "from_ip": addr[0],
+            "filename": filename,
+            "payload": data,
+            "size": size,
+            "sha256": sha256,
+            "server_time": time.time()
+        }
+
+        status = send_or_queue(to_ip, encode_json(outgoing))
+        if status in ("delivered", "queued"):
+            send_json(conn, {
+                "type": "ACK_FILE",
+                "mode": "relayed" if status == "delivered" else "queued",
+                "to_ip": to_ip,
+                "filename": filename,
+                "size": size,
+                "sha256": sha256,
+                "server_time": time.time()
+            })
+        else:
+            dispatcher.error(session, f"unknown recipient ip for file: {to_ip}" if status == "invalid"
+                             else f"outbox full for: {to_ip}")
+    return False
+
+
+@dispatcher.register("FILE_SIG", {"filename": str})
+def handle_file_sig(session, msg):
+    # signature de la copie stockée (voir delta.py): le client n'enverra que les blocs modifiés
+    filename = msg["filename"]
+    with FILE_SIG_TIME.time():
+        sig = signature(RECEIVE_DIR, filename)
+    if sig is None:
+        dispatcher.error(session, f"invalid filename: {filename}")
+        return False
+    send_json(session.conn, {
+        "type": "FILE_SIG",
+        "filename": filename,
+        **sig,
+        "server_time": time.time()
+    })
+    return False
+
+
+@dispatcher.register("FILE_DELTA", {"filename": str, "version": str, "block": int, "ops": list,
+                                    "size": int, "sha256": str})
+def handle_file_delta(session, msg):
+    # nouvelle version d'un fichier stocké: blocs de l'ancienne copie + octets nouveaux
+    filename = msg["filename"]
+    try:
+        with FILE_STORE_TIME.time():
+            _, copied, literal = apply_delta(RECEIVE_DIR, filename, msg["version"], msg["block"],
+                                             msg["ops"], msg["size"], msg["sha256"], FILE_MAX_BYTES)
+    except DeltaError as e:
+        dispatcher.error(session, str(e))
+        return False
+    except OSError as e:
+        # écriture impossible (disque plein...): même forme d'ERR, le client renverra le fichier entier
+        logger.error("[!] Delta %s de %s non enregistré: %s", filename, session.addr, e)
+        dispatcher.error(session, str(DeltaError("store failed", filename)))
+        return False
+    FILE_DELTA_BYTES.inc(copied, label_value="copied")
+    FILE_DELTA_BYTES.inc(literal, label_value="literal")
+    logger.info("[FILE] Delta %s de %s: %s octets (%s reçus, %s recopiés)",
+                filename, session.addr, msg["size"], literal, copied)
+    send_json(session.conn, {
+        "type": "ACK_FILE",
+        "mode": "stored_on_server",
+        "filename": filename,
+        "size": msg["size"],
+        "sha256": msg["sha256"],
+        "delta": {"copied": copied, "literal": literal},
+        "server_time": time.time()
+    })
+    return False
+
+
+@dispatcher.register("FILE_LIST")
+def handle_file_list(session, msg):
+    # fichiers stockés sur le serveur (FILE sans destinataire), récupérables par FILE_GET
+    send_json(session.conn, {
+        "type": "FILE_LIST",
+        "files": list_files(RECEIVE_DIR),
+        "server_time": time.time()
+    })
+    return False
+
+
+@dispatcher.register("FILE_GET", {"filename": str, "offset": optional(int, 0), "length": optional(int)})
+def handle_file_get(session, msg):
+    # téléchargement (éventuellement partiel: offset / length) d'un fichier stocké,
+    # en trames FILE_DATA de STREAM_CHUNK octets (voir filestore.py)
+    conn = session.conn
+    f, size, sha256 = open_stored(RECEIVE_DIR, msg["filename"], with_digest=True)
+    if f is None:
+        dispatcher.error(session, f"no such file: {msg['filename']}")
+        return False
+    with f:
+        requested = resolve_range(size, msg["offset"], msg["length"])
+        if requested is None:
+            dispatcher.error(session, f"invalid range for: {msg['filename']} ({size} bytes)")
+            return False
+        start = time.perf_counter()
+        for header, offset, length in frames(msg["filename"], size, *requested, sha256=sha256):
+            # socket réservée le temps d'une trame seulement: les MSG relayés passent entre deux trames
+            with session.output.exclusive(header):
+                send_range(conn, f, offset, length)
+            BYTES_OUT.inc(len(header) + length)
+            reaper.touch(conn)
+        FILE_SERVE_TIME.observe(time.perf_counter() - start)
+    logger.info("[FILE] %s envoyé à %s (%s octets à partir de %s)", msg["filename"], session.addr,
+                requested[1], requested[0])
+    return False
+
+
+@dispatcher.register("PING", public=True)
+def handle_ping(session, msg):
+    send_json(session.conn, {
+        "type": "PONG",
+        "server_time": time.time()
+    })
+    return False
+
+
+@dispatcher.register("PONG", public=True)
+def handle_pong(session, msg):
+    # réponse à un PING serveur: l'activité est déjà notée par reaper.touch()
+    return False
+
+
+@dispatcher.register("STATS")
+def handle_stats(session, msg):
+    # photo des métriques du serveur (même contenu que GET /metrics)
+    send_json(session.conn, {
+        "type": "STATS",
+        "metrics": registry.snapshot(),
+        "server_time": time.time()
+    })
+    return False
+
+
+@dispatcher.register("ROSTER")
+def handle_roster(session, msg):
+    # photo complète à la demande (ex: client qui a raté une version)
+    presence.snapshot(session.conn)
+    return False
+
+
+@dispatcher.register("JOIN", {"room": str})
+def handle_join(session, msg):
+    room = msg["room"]
+    members = rooms.join(session.conn, room) if valid_room_name(room) else None
+    if members is None:
+        dispatcher.error(session, f"cannot join room: {room}")
+    else:
+        send_json(session.conn, {
+            "type": "ACK",
+            "joined": room,
+            "members": members,
+            "server_time": time.time()
+        })
+    return False
+
+
+@dispatcher.register("LEAVE", {"room": str})
+def handle_leave(session, msg):
+    room = msg["room"]
+    if rooms.leave(session.conn, room):
+        send_json(session.conn, {
+            "type": "ACK",
+            "left": room,
+            "server_time": time.time()
+        })
+    else:
+        dispatcher.error(session, f"not a member of room: {room}")
+    return False
+
+
+@dispatcher.register("HISTORY", {"target": optional(str, "*"), "room": optional(str),
+                                 "limit": optional(int, HISTORY_SIZE), "since": optional((int, float))})
+def handle_history(session, msg):
+    # "*" = broadcasts; on ne peut relire que les messages ciblés vers sa propre IP,
+    # ou ceux des salons dont on est membre (room="nom")
+    target = msg["target"]
+    room = msg["room"]
+    if room is not None:
+        key = f"room:{room}" if rooms.is_member(session.conn, room) else None
+        target = f"room:{room}"
+    elif target in ("*", ""):
+        key = "*"
+    elif target == session.addr[0]:
+        key = f"ip:{target}"
+    else:
+        key = None
+
+    if key is None:
+        dispatcher.error(session, f"history not allowed for target: {target}")
+        return False
+
+    count, blob = history.replay(key, msg["limit"], msg["since"])
+
+    # en-tête puis les MSG tels qu'envoyés à l'origine, en un seul envoi
+    send_raw(session.conn, encode_json({
+        "type": "HISTORY",
+        "target": target or "*",
+        "count": count,
+        "server_time": time.time()
+    }) + blob)
+    return False
+
+
+@dispatcher.register("RELOAD")
+def handle_reload(session, msg):
+    # commande d'admin: relit la configuration et les certificats
+    if is_admin(session):
+        ok, detail = reload_config()
+        send_json(session.conn, {
+            "type": "RELOAD",
+            "ok": ok,
+            "changed" if ok else "error": detail,
+            "server_time": time.time()
+        })
+    return False
+
+
+@dispatcher.register("SHUTDOWN")
+def handle_shutdown(session, msg):
+    # commande d'admin: arrêt propre (drain) du serveur
+    if is_admin(session):
+        send_json(session.conn, {
+            "type": "ACK",
+            "shutdown": request_shutdown(f"SHUTDOWN de {session.addr[0]}"),
+            "server_time": time.time()
+        })
+    return False
+
+
+@dispatcher.register("PROFILE", {"action": optional(str, "stop")})
+def handle_profile(session, msg):
+    # commande d'admin, acceptée uniquement depuis la machine locale
+    if not is_admin(session):
+        return False
+    if msg["action"] == "start":
+        send_json(session.conn, {
+            "type": "PROFILE",
+            "running": True,
+            "started": profile_start(),
+            "server_time": time.time()
+        })
+    else:
+        path, top = profile_stop()
+        send_json(session.conn, {
+            "type": "PROFILE",
+            "running": False,
+            "file": path,
+            "top": [{"function": label, "self": own, "inclusive": inclusive}
+                    for label, own, inclusive in top],
+            "server_time": time.time()
+        })
+    return False
+
+
+@dispatcher.register("MEMORY", {"action": optional(str, "top"), "limit": optional(int, 15)})
+def handle_memory(session, msg):
+    # commande d'admin: usage du processus + allocations qui ont grossi depuis "mark"
+    if not is_admin(session):
+        return False
+    if msg["action"] == "mark":
+        top = []
+        marked = tracer.mark()
+    else:
+        top = tracer.top(max(1, min(msg["limit"], 100)))
+        marked = None
+    rss, threads, fds = process_usage()
+    send_json(session.conn, {
+        "type": "MEMORY",
+        "resident_bytes": rss,
+        "threads": threads,
+        "open_fds": fds,
+        "connections": len(connections),
+        "tracing": tracer.running,
+        "traced_bytes": tracer.traced(),
+        "marked": marked,
+        "top": [{"where": where, "size": size, "size_diff": size_diff, "count": count, "count_diff": count_diff}
+                for where, size, size_diff, count, count_diff in top],
+        "server_time": time.time()
+    })
+    return False
+
+
+def _send_exclusive(output, raw):
+    # ce qui est en attente dans le tampon, puis raw, en un seul sendall
+    with output.exclusive(raw):
+        pass
+
+
+@dispatcher.register("PEER", {"node": str, "secret": str}, public=True)
+def handle_peer(session, msg):
+    # lien ouvert par un autre nœud de la fédération (pas un client: jamais dans la table de routage)
+    error = federation.accept_peer(msg["node"], msg["secret"]) if session.username is None else "already logged in"
+    if error is None:
+        error = record_nonce(session, msg)
+    if error is not None:
+        logger.warning("[!] PEER refusé de %s: %s", session.addr, error)
+        dispatcher.error(session, error)
+        return True
+    send_json(session.conn, {
+        "type": "PEER_OK",
+        "node": federation.node,
+        "server_time": time.time()
+    })
+    # trames FED écrites via le tampon de sortie: PEER_OK (en attente) part avant la première
+    federation.attach(msg["node"], session.conn, send=lambda raw: _send_exclusive(session.output, raw))
+    return False
+
+
+@dispatcher.register("FED", {"items": list}, public=True)
+def handle_fed(session, msg):
+    # trame groupée d'un autre nœud: routes annoncées et messages à livrer ici
+    if not federation.receive(session.conn, msg["items"]):
+        dispatcher.error(session, "not a federation link")
+    return False
 
 
 def handle_client(conn, addr):
@@ -73,168 +1297,165 @@ def handle_client(conn, addr):
     Thread par client.
     conn est une socket TLS (ssl.SSLSocket).
     """
-    print(f"[+] Client connecté: {addr}")
+    logger.info("[+] Client connecté: %s", addr)
 
-    # Flux lecture ligne-par-ligne (1 JSON par ligne)
-    sock_file = conn.makefile("r", encoding="utf-8", newline="\n")
+    # Tout l'état de la connexion: flux de lecture ligne-par-ligne (1 JSON par
+    # ligne; mode binaire: pas de couche de décodage texte, taille lue en octets),
+    # tampon de sortie, utilisateur, compteurs.
+    # session.username reste None tant que LOGIN n'a pas réussi: la connexion
+    # n'entre dans la table de routage (et ne reçoit rien) qu'après LOGIN
+    session = Connection(conn, addr, conn.makefile("rb", buffering=READ_BUFFER),
+                         OutputBuffer(conn, COALESCE_DELAY, COALESCE_MAX_BYTES, OUTPUT_MAX_BYTES))
+    connections[conn] = session
+    reaper.add(conn, addr)
+    drainer.add(conn)
 
     try:
+        # Certificat client valide: authentifié par le handshake, pas de LOGIN attendu
+        if CLIENT_CERT_MODE != "off":
+            session.username = cert_identities.identity(conn)
+            if session.username is not None:
+                LOGINS.inc(label_value="cert")
+                logger.info("[+] %s authentifié par certificat (%s)", addr, session.username)
+                complete_login(conn, addr, session.username,
+                               f"login accepted (client certificate: {session.username})")
+
         while True:
-            msg = recv_json(sock_file)
+            msg, size = recv_json_sized(session.file)
             if msg is None:
-                print(f"[-] Client déconnecté: {addr}")
+                logger.info("[-] Client déconnecté: %s", addr)
                 break
 
-            mtype = msg.get("type")
-            print(f"[{addr}] RECU: {msg}")
-
-            if mtype == "LOGIN":
-                # Ici on “accepte” sans vérifier (tu peux ajouter une vraie vérif plus tard)
-                send_json(conn, {
-                    "type": "OK",
-                    "message": "login accepted (v2 TLS + routing)",
-                    "server_time": time.time()
-                })
-
-            elif mtype == "MSG":
-                from_user = msg.get("username", "unknown")
-                payload_text = msg.get("payload", "")
-                to_ip = msg.get("to_ip", "*")  # "*" = broadcast
-
-                outgoing = {
-                    "type": "MSG",
-                    "from": from_user,
-                    "payload": payload_text,
-                    "from_ip": addr[0],
-                    "server_time": time.time()
-                }
-
-                if to_ip == "*" or to_ip == "":
-                    # broadcast à tous (option: exclure l'émetteur si tu veux)
-                    broadcast(outgoing, exclude_conn=None)
-
-                    # accusé au sender (pratique UI)
-                    send_json(conn, {
-                        "type": "ACK",
-                        "delivered_to": "*",
-                        "server_time": time.time()
-                    })
-                else:
-                    ok = send_to_ip(to_ip, outgoing)
-                    if ok:
-                        send_json(conn, {
-                            "type": "ACK",
-                            "delivered_to": to_ip,
-                            "server_time": time.time()
-                        })
-                    else:
-                        send_json(conn, {
-                            "type": "ERR",
-                            "message": f"unknown recipient ip: {to_ip}",
-                            "server_time": time.time()
-                        })
-
-            elif mtype == "FILE":
-                # Deux modes:
-                # - to_ip="*" ou absent -> stocker sur le serveur
-                # - to_ip="x.x.x.x" -> relayer le fichier au(x) client(s) de cette IP
-                from_user = msg.get("username", "unknown")
-                filename = msg.get("filename", "received.txt")
-                data = msg.get("payload", "")
-                to_ip = msg.get("to_ip", "*")
-
-                if to_ip == "*" or to_ip == "":
-                    print(f"[FILE] Stockage fichier {filename} de {addr}, taille: {len(data)} octets")
-
-                    os.makedirs(RECEIVE_DIR, exist_ok=True)
-                    filepath = os.path.join(RECEIVE_DIR, f"receive_{filename}")
-                    with open(filepath, "w", encoding="utf-8") as f:
-                        f.write(data)
-
-                    send_json(conn, {
-                        "type": "ACK_FILE",
-                        "mode": "stored_on_server",
-                        "filename": filename,
-                        "size": len(data),
-                        "server_time": time.time()
-                    })
-                else:
-                    outgoing = {
-                        "type": "FILE_FROM",
-                        "from": from_user,
-                        "from_ip": addr[0],
-                        "filename": filename,
-                        "payload": data,
-                        "size": len(data),
-                        "server_time": time.time()
-                    }
-
-                    ok = send_to_ip(to_ip, outgoing)
-                    if ok:
-                        send_json(conn, {
-                            "type": "ACK_FILE",
-                            "mode": "relayed",
-                            "to_ip": to_ip,
-                            "filename": filename,
-                            "size": len(data),
-                            "server_time": time.time()
-                        })
-                    else:
-                        send_json(conn, {
-                            "type": "ERR",
-                            "message": f"unknown recipient ip for file: {to_ip}",
-                            "server_time": time.time()
-                        })
-
-            elif mtype == "PING":
-                send_json(conn, {
-                    "type": "PONG",
-                    "server_time": time.time()
-                })
+            if drainer.stopping:
+                # arrêt en cours: message non traité (pas d'ACK, le client le renverra)
+                break
 
-            else:
-                send_json(conn, {
-                    "type": "ERR",
-                    "message": "unknown type",
-                    "server_time": time.time()
-                })
+            reaper.touch(conn)
+            session.messages += 1
+            session.bytes_in += size
+            BYTES_IN.inc(size)
+            MESSAGES.inc(label_value=dispatcher.kind(msg))
+            logger.debug("[%s] RECU: %s", addr, summarize(msg), extra=SAMPLED)
+            capture = recorder   # lu une fois: un rechargement peut le remplacer entre-temps
+            if capture is not None:
+                capture.record(session, msg)
+
+            drainer.begin()
+            if dispatcher.dispatch(session, msg):
+                break
+            drainer.end()
 
     except Exception as e:
-        print(f"[!] Erreur avec {addr}: {e}")
+        logger.warning("[!] Erreur avec %s: %s", addr, e)
 
     finally:
+        # plus rien n'est mis en file pour cette connexion, puis ce qui reste est envoyé
+        unregister_client(conn, addr)
+        federation.detach(conn)
+        session.output.close()
+        connections.pop(conn, None)
         try:
-            sock_file.close()
+            session.file.close()
         except Exception:
             pass
         try:
             conn.close()
         except Exception:
             pass
-        unregister_client(conn, addr)
-        print(f"[+] Connexion fermée: {addr}")
+        drainer.remove(conn)
+        capture = recorder
+        if capture is not None:
+            capture.closed(session)
+        logger.info("[+] Connexion fermée: %s (%s)", addr, session.stats())
 
 
 def main():
-    # Contexte TLS serveur
-    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-    context.load_cert_chain(
-        certfile="../certs/server.crt",
-        keyfile="../certs/server.key"
-    )
+    global history, listener, outbox
+
+    # Logs écrits par un thread dédié (jamais de print() sur le chemin chaud)
+    setup_logging(LOG_LEVEL, sample_every=LOG_SAMPLE_EVERY)
+
+    # Configuration (fichier optionnel) + contexte TLS serveur
+    ok, error = reload_config(startup=True)
+    if not ok:
+        return
+
+    # Historique persistant (optionnel): relu depuis le journal au démarrage
+    if HISTORY_LOG:
+        history = HistoryStore(HISTORY_SIZE, HISTORY_LOG)
+    if OUTBOX_DIR != outbox.directory:
+        outbox = Outbox(OUTBOX_DIR)
+
+    # Thread de surveillance des connexions inactives
+    reaper.start()
+
+    # kill -USR1 <pid> démarre / arrête le profilage
+    # (pas de SIGUSR1 sous Windows, et signal() n'est permis que dans le thread principal)
+    # kill -HUP <pid> recharge la configuration et les certificats
+    # (le travail est fait par signal_worker, jamais dans le gestionnaire)
+    threading.Thread(target=signal_worker, name="signals", daemon=True).start()
+    if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, deferred(profile_toggle))
+        signal.signal(signal.SIGHUP, deferred(reload_signal))
+
+    # kill <pid> ou Ctrl-C: arrêt propre (drain)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, shutdown_signal)
+        signal.signal(signal.SIGINT, shutdown_signal)
+
+    # Endpoint local des métriques
+    if METRICS_PORT:
+        serve_http(registry, METRICS_HOST, METRICS_PORT)
+        logger.info("[*] Métriques sur http://%s:%s/metrics", METRICS_HOST, METRICS_PORT)
+
+    # Fédération: liens TLS vers les autres nœuds (rappelés s'ils tombent)
+    if FEDERATION_SECRET is not None:
+        peer_context = ssl.create_default_context(cafile=PEER_CA)
+        apply_tls_settings(peer_context, TLS_MIN_VERSION, TLS_CIPHERS)
+        federation.start(NODE_NAME or f"{socket.gethostname()}:{PORT}", FEDERATION_SECRET, PEERS,
+                         peer_context, tune_connection)
+        logger.info("[*] Fédération: nœud %s, pairs: %s", federation.node, ", ".join(PEERS) or "aucun")
 
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # tampons fixés avant listen(): hérités par les connexions acceptées
+        sockopts.set_buffers(s, SEND_BUFFER, RECV_BUFFER)
         s.bind((HOST, PORT))
-        s.listen(5)
-        print(f"[*] Serveur TLS + routage IP en écoute sur {HOST}:{PORT}")
+        s.listen(LISTEN_BACKLOG)
+        listener = s
+        logger.info("[*] Serveur TLS + routage IP en écoute sur %s:%s", HOST, PORT)
+        if not credentials.has_users():
+            logger.warning("[!] Aucun utilisateur dans %s: tous les LOGIN seront refusés "
+                           "(créer un compte avec: python auth.py add <nom>)", USERS_FILE)
 
-        while True:
-            conn, addr = s.accept()
-            tls_conn = context.wrap_socket(conn, server_side=True)
+        while not drainer.closing.is_set():
+            try:
+                conn, addr = s.accept()
+            except OSError:
+                # socket d'écoute coupée par request_shutdown()
+                if drainer.closing.is_set():
+                    break
+                raise
+            CONNECTIONS.inc()
 
-            register_client(tls_conn, addr)
-            print(f"[+] Connexion TLS établie avec {addr}")
+            start = time.perf_counter()
+            try:
+                tune_connection(conn)
+                # contexte lu à chaque connexion: un rechargement s'applique au handshake suivant
+                tls_conn = tls_context.wrap_socket(conn, server_side=True)
+            except (ssl.SSLError, OSError) as e:
+                # un handshake raté ne doit pas arrêter la boucle d'acceptation
+                HANDSHAKES.inc(label_value="failed")
+                logger.warning("[!] Handshake TLS échoué avec %s: %s", addr, e)
+                conn.close()
+                continue
+            HANDSHAKE_TIME.observe(time.perf_counter() - start)
+            HANDSHAKES.inc(label_value="ok")
+            if tls_conn.session_reused:
+                SESSIONS_RESUMED.inc()
+
+            # l'enregistrement dans la table se fait dans handle_client (après l'arriéré)
+            logger.info("[+] Connexion TLS établie avec %s", addr)
 
             threading.Thread(
                 target=handle_client,
@@ -242,6 +1463,12 @@ def main():
                 daemon=True
             ).start()
 
+    drain()
+    stop_logging()
+
 
 if __name__ == "__main__":
+    # python server.py [fichier de configuration]: plusieurs nœuds depuis le même dossier
+    if len(sys.argv) > 1:
+        CONFIG_FILE = sys.argv[1]
     main()
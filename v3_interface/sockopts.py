@@ -0,0 +1,49 @@
+# sockopts.py
+# Réglages des sockets TCP, communs au serveur et au client.
+#
+# - TCP_NODELAY: désactive l'algorithme de Nagle. Nos messages sont de petites
+#   lignes JSON (souvent deux envois de suite: MSG relayé puis ACK); avec Nagle,
+#   le 2e envoi attend l'ACK TCP du 1er, que le pair retarde (delayed ACK): ~40 ms
+# - SO_SNDBUF / SO_RCVBUF: tampons noyau; 0 = défaut du système (auto-ajusté
+#   sous Linux). Une valeur fixe désactive l'auto-ajustement.
+# - SO_KEEPALIVE + TCP_KEEPIDLE / KEEPINTVL / KEEPCNT: le noyau détecte un pair
+#   disparu (câble débranché, NAT expiré) même sans trafic applicatif
+
+import socket
+
+TCP_NODELAY = True
+SEND_BUFFER = 0          # octets, 0 = défaut du système
+RECV_BUFFER = 0
+TCP_KEEPALIVE = True
+KEEPALIVE_IDLE = 60      # secondes d'inactivité avant la 1re sonde
+KEEPALIVE_INTERVAL = 10  # secondes entre deux sondes
+KEEPALIVE_COUNT = 5      # sondes sans réponse avant de couper
+
+
+def set_buffers(sock, send_buffer=SEND_BUFFER, recv_buffer=RECV_BUFFER):
+    """
+    Tailles des tampons noyau. Sur une socket d'écoute, elles sont héritées par
+    les connexions acceptées (et RCVBUF doit être fixé avant la connexion pour
+    que la fenêtre TCP annoncée en tienne compte).
+    """
+    if send_buffer:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, send_buffer)
+    if recv_buffer:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, recv_buffer)
+
+
+def tune(sock, nodelay=TCP_NODELAY, keepalive=TCP_KEEPALIVE, keepalive_idle=KEEPALIVE_IDLE,
+         keepalive_interval=KEEPALIVE_INTERVAL, keepalive_count=KEEPALIVE_COUNT,
+         send_buffer=SEND_BUFFER, recv_buffer=RECV_BUFFER):
+    """Applique les réglages à une socket TCP (avant wrap_socket / connect)."""
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 if nodelay else 0)
+    set_buffers(sock, send_buffer, recv_buffer)
+
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1 if keepalive else 0)
+    if keepalive:
+        # options propres à Linux (et récents Windows / macOS): ignorées si absentes
+        for name, value in (("TCP_KEEPIDLE", keepalive_idle),
+                            ("TCP_KEEPINTVL", keepalive_interval),
+                            ("TCP_KEEPCNT", keepalive_count)):
+            if hasattr(socket, name):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
@@ -0,0 +1,28 @@
+# tlsconf.py
+# Réglages TLS communs au serveur et au client: version minimale, suites
+# de chiffrement et courbe ECDH.
+#
+# - TLS_MIN_VERSION: "TLSv1.2" ou "TLSv1.3" (TLS 1.3 seul: handshake en 1 aller-retour)
+# - TLS_CIPHERS: suites TLS 1.2 au format OpenSSL (None = défaut). Les suites
+#   TLS 1.3 ne sont pas réglables avec le module ssl de Python (toutes AEAD)
+# - TLS_CURVE: courbe de l'échange ECDHE côté serveur (ex: "X25519", "prime256v1")
+# Le type de clé (RSA ou ECDSA) dépend seulement du certificat chargé
+# (CERT_FILE / KEY_FILE du serveur): voir bench_tls.py pour comparer.
+
+import ssl
+
+TLS_MIN_VERSION = "TLSv1.2"
+TLS_CIPHERS = None
+TLS_CURVE = None
+
+
+def apply_tls_settings(context, min_version=TLS_MIN_VERSION, ciphers=TLS_CIPHERS, curve=TLS_CURVE):
+    """Applique les réglages à un contexte (lève ValueError / ssl.SSLError si invalides)."""
+    try:
+        context.minimum_version = ssl.TLSVersion[min_version.replace(".", "_")]
+    except KeyError:
+        raise ValueError(f"version TLS inconnue: {min_version}") from None
+    if ciphers:
+        context.set_ciphers(ciphers)
+    if curve:
+        context.set_ecdh_curve(curve)
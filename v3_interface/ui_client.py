@@ -2,8 +2,9 @@
 #il fait suite au code du client réseau pour permettre aux utilisateurs de se connecter à un serveur,
 #d'envoyer des messages et des fichiers via une interface conviviale.
 
+import bisect  #pour garder la liste "En ligne" triée sans la reconstruire
 import tkinter as tk
-from tkinter import filedialog, messagebox, scrolledtext
+from tkinter import filedialog, messagebox, scrolledtext, simpledialog
 import threading  #threading peut servir si on fait des actions UI asynchrones (ici la réception est gérée côté SecureClient)
 
 from client_network import SecureClient
@@ -25,6 +26,7 @@ class ChatUI:
         tk.Label(conn_frame, text="IP serveur").grid(row=0, column=0)  #label permettant d'afficher le texte
         tk.Label(conn_frame, text="Port").grid(row=0, column=2)
         tk.Label(conn_frame, text="Username").grid(row=0, column=4)
+        tk.Label(conn_frame, text="Mot de passe").grid(row=1, column=4)
 
         #champ de saisie pour l'adresse IP
         self.ip_entry = tk.Entry(conn_frame, width=15)
@@ -41,10 +43,23 @@ class ChatUI:
         self.user_entry.insert(0, "alice")
         self.user_entry.grid(row=0, column=5)
 
+        #entrée pour le mot de passe (show="*" pour masquer la saisie)
+        self.pass_entry = tk.Entry(conn_frame, width=10, show="*")
+        self.pass_entry.grid(row=1, column=5)
+
         #bouton pour se connecter au serveur
         self.connect_btn = tk.Button(conn_frame, text="Connecter", command=self.connect)
         self.connect_btn.grid(row=0, column=6, padx=5)
 
+        # ----------------- Utilisateurs en ligne -----------------
+        #remplie par ROSTER puis mise à jour par ROSTER_DIFF: on insère / supprime
+        #seulement les lignes qui changent (jamais toute la liste)
+        roster_frame = tk.LabelFrame(root, text="En ligne")
+        roster_frame.pack(side="right", fill="y", padx=(0, 10), pady=5)
+        self.roster_list = tk.Listbox(roster_frame, width=22)
+        self.roster_list.pack(fill="y", expand=True)
+        self.roster_items = []  #copie triée des lignes affichées (même ordre que la Listbox)
+
         # ----------------- Zone chat -----------------
         #scrolledtext = zone de texte avec scrollbar intégrée
         #state="disabled" pour empêcher la modification directe (on écrit dedans uniquement via log())
@@ -67,6 +82,12 @@ class ChatUI:
         self.file_btn = tk.Button(send_frame, text="Envoyer fichier", command=self.send_file)
         self.file_btn.pack(side="left")
 
+        #fichiers stockés sur le serveur: liste (FILE_LIST) et téléchargement (FILE_GET)
+        self.list_btn = tk.Button(send_frame, text="Fichiers serveur", command=self.list_files)
+        self.list_btn.pack(side="left", padx=5)
+        self.get_btn = tk.Button(send_frame, text="Télécharger", command=self.download_file)
+        self.get_btn.pack(side="left")
+
     # -----------------------------------------------------
 
     def log(self, text):  #cette méthode permet d'afficher les messages dans la zone de chat
@@ -75,6 +96,23 @@ class ChatUI:
         self.chat_area.configure(state="disabled")  #state disabled après modification
         self.chat_area.see(tk.END)  #see pour faire défiler automatiquement vers le bas
 
+    def on_roster(self, joined, left):  #appelée par le thread réseau: Tkinter ne doit être touché que par le thread principal
+        self.root.after(0, self.update_roster, joined, left)
+
+    def update_roster(self, joined, left):  #applique seulement les changements à la Listbox
+        for ip, user in left:
+            line = f"{user}@{ip}"
+            i = bisect.bisect_left(self.roster_items, line)
+            if i < len(self.roster_items) and self.roster_items[i] == line:
+                del self.roster_items[i]
+                self.roster_list.delete(i)
+        for ip, user in joined:
+            line = f"{user}@{ip}"
+            i = bisect.bisect_left(self.roster_items, line)
+            if i == len(self.roster_items) or self.roster_items[i] != line:
+                self.roster_items.insert(i, line)
+                self.roster_list.insert(i, line)
+
     def connect(self):  #cette méthode est appelée lorsque l'utilisateur clique sur le bouton de connexion
         if self.client:  #si le client existe déjà, on ne fait rien
             return
@@ -83,11 +121,13 @@ class ChatUI:
         ip = self.ip_entry.get()
         port = int(self.port_entry.get())
         username = self.user_entry.get()
+        password = self.pass_entry.get()
 
         try:
             #SecureClient est importé du module client_network
             #il encapsule toute la logique réseau (TLS, envoi JSON, thread de réception)
-            self.client = SecureClient(ip, port, username, self.log)  #secureclient est importé du module client_network
+            self.client = SecureClient(ip, port, username, self.log, password=password)  #secureclient est importé du module client_network
+            self.client.on_roster = self.on_roster  #changements de la liste "En ligne"
             self.client.connect()  #déclenche la connexion TLS + envoi LOGIN + lancement du thread de réception
             self.log("[+] Connecté au serveur TLS")
         except Exception as e:
@@ -121,6 +161,24 @@ class ChatUI:
         self.client.send_file(path)
         self.log(f"[MOI] Fichier envoyé : {path}")
 
+    def list_files(self):  #la réponse (liste des fichiers) s'affiche dans la zone de chat
+        if not self.client:
+            return
+        self.client.request_file_list()
+
+    def download_file(self):
+        if not self.client:
+            return
+
+        #nom du fichier tel qu'affiché par "Fichiers serveur"
+        name = simpledialog.askstring("Télécharger", "Nom du fichier sur le serveur :")
+        if not name:
+            return
+
+        #le contenu arrive par morceaux (FILE_DATA) et est écrit dans downloaded_<nom>
+        self.client.download_file(name)
+        self.log(f"[MOI] Téléchargement demandé : {name}")
+
 
 if __name__ == "__main__":
     #création de la fenêtre principale Tkinter